@@ -0,0 +1,46 @@
+import pytest
+
+from valutatrade_hub.parser_service.config import config
+from valutatrade_hub.parser_service.stub_server import FaultProfile, StubProviderServer
+
+# Файлы состояния parser_service, которые тесты переносят во временный каталог
+STATE_PATHS = (
+    "RATES_FILE_PATH",
+    "RATES_MATRIX_FILE_PATH",
+    "HISTORY_FILE_PATH",
+    "LEGACY_HISTORY_FILE_PATH",
+    "TIMESERIES_DIR",
+    "CANDLES_DIR",
+    "HTTP_CACHE_FILE_PATH",
+    "CIRCUIT_BREAKER_FILE_PATH",
+    "RATE_LIMIT_FILE_PATH",
+    "CASSETTE_DIR",
+)
+
+
+@pytest.fixture(autouse=True)
+def isolated_config(tmp_path, monkeypatch):
+    """Данные parser_service пишутся во временный каталог, а не в data/"""
+    data_dir = tmp_path / "data"
+    for name in STATE_PATHS:
+        default = getattr(config, name)
+        monkeypatch.setattr(config, name, str(data_dir / default.rsplit("/", 1)[-1]))
+    monkeypatch.setattr(config, "CASSETTE_MODE", "")
+    return config
+
+
+@pytest.fixture
+def stub_server(monkeypatch):
+    """Заменитель провайдеров; профиль сбоев меняется через server.profile"""
+    server = StubProviderServer(profile=FaultProfile())
+    server.start_in_thread()
+    monkeypatch.setattr(config, "COINGECKO_URL", server.coingecko_url)
+    monkeypatch.setattr(config, "EXCHANGERATE_API_URL", server.exchangerate_api_url)
+    monkeypatch.setattr(config, "EXCHANGERATE_API_KEY", "test-key")
+    monkeypatch.setattr(config, "HTTP_CACHE_ENABLED", False)
+    monkeypatch.setattr(config, "RATE_LIMITS", {})
+    monkeypatch.setattr(config, "RETRY_BASE_DELAY", 0.01)
+    monkeypatch.setattr(config, "RETRY_MAX_DELAY", 0.02)
+    yield server
+    server.shutdown()
+    server.server_close()
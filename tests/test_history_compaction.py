@@ -0,0 +1,121 @@
+import pytest
+
+from valutatrade_hub.parser_service.storage import (
+    append_history,
+    build_history_record,
+    compact_history,
+    iter_history,
+)
+from valutatrade_hub.parser_service.timeseries import (
+    append_to_timeseries,
+    from_epoch_ms,
+    get_series,
+    parse_retention_tiers,
+    to_epoch_ms,
+)
+
+NOW = "2026-03-01T00:00:00"
+HOUR_MS = 3_600_000
+DAY_MS = 24 * HOUR_MS
+TIERS = "1d:raw,7d:1h,*:drop"
+
+
+def history_record(pair_key, rate, age_ms):
+    """Запись истории курса пары возраста age_ms относительно NOW"""
+    from_currency, to_currency = pair_key.split("_")
+    return build_history_record({
+        "from_currency": from_currency,
+        "to_currency": to_currency,
+        "rate": rate,
+        "timestamp": from_epoch_ms(to_epoch_ms(NOW) - age_ms).rstrip("Z"),
+        "source": "CoinGecko",
+    })
+
+
+def seed_history():
+    """Свежие записи, три записи часового интервала трёхдневной давности и старая"""  # noqa: E501
+    records = [
+        history_record("BTC_USD", 1.0, 10 * DAY_MS),
+        history_record("BTC_USD", 2.0, 3 * DAY_MS + 50 * 60_000),
+        history_record("BTC_USD", 3.0, 3 * DAY_MS + 30 * 60_000),
+        history_record("ETH_USD", 9.0, 3 * DAY_MS + 20 * 60_000),
+        history_record("BTC_USD", 4.0, 3 * DAY_MS + 10 * 60_000),
+        history_record("BTC_USD", 5.0, 2 * HOUR_MS),
+        history_record("BTC_USD", 6.0, HOUR_MS),
+    ]
+    append_history(records)
+    for record in records:
+        append_to_timeseries({
+            f"{record['from_currency']}_{record['to_currency']}": {
+                "rate": record["rate"],
+                "updated_at": record["timestamp"],
+                "source": record["source"],
+            },
+        })
+    return records
+
+
+def test_tiers_keep_raw_downsample_and_drop():
+    """Свежие записи хранятся все, средние — последняя за час, старые удаляются"""
+    seed_history()
+
+    report = compact_history(TIERS, now=NOW)
+
+    history = list(iter_history())
+    assert [(r["from_currency"], r["rate"]) for r in history] == [
+        ("ETH", 9.0),
+        ("BTC", 4.0),
+        ("BTC", 5.0),
+        ("BTC", 6.0),
+    ]
+    # В интервале остаётся последняя запись пары, записи идут по времени
+    assert history[0]["meta"] == {"downsampled": "1h", "samples": 1}
+    assert history[1]["meta"] == {"downsampled": "1h", "samples": 3}
+    assert "downsampled" not in history[2]["meta"]
+    assert (report["records_before"], report["records_after"]) == (7, 4)
+    assert report["bytes_after"] < report["bytes_before"]
+    assert report["reclaimed"] > 0
+
+    assert [rate for _, rate, _ in get_series("BTC_USD").range()] == [4.0, 5.0, 6.0]
+    assert len(get_series("ETH_USD")) == 1
+
+
+def test_downsampled_records_keep_sample_count_on_repeat():
+    """Повторная компакция не теряет число исходных записей интервала"""
+    seed_history()
+    compact_history(TIERS, now=NOW)
+    compact_history(TIERS, now=NOW)
+
+    assert [r["meta"].get("samples") for r in iter_history()] == [1, 3, None, None]
+
+
+def test_dry_run_reports_without_writing(isolated_config):
+    """При dry_run отчёт тот же, но файлы не меняются"""
+    seed_history()
+    history_path = isolated_config.HISTORY_FILE_PATH
+    with open(history_path, "rb") as f:
+        history_before = f.read()
+    series_before = len(get_series("BTC_USD"))
+
+    report = compact_history(TIERS, now=NOW, dry_run=True)
+
+    assert (report["records_before"], report["records_after"]) == (7, 4)
+    with open(history_path, "rb") as f:
+        assert f.read() == history_before
+    assert len(get_series("BTC_USD")) == series_before
+
+
+def test_tier_spec_parsing():
+    """Уровни разбираются в (возраст в мс или None, режим)"""
+    assert parse_retention_tiers("7d:raw,365d:1h,*:1d") == [
+        (7 * DAY_MS, "raw"),
+        (365 * DAY_MS, "1h"),
+        (None, "1d"),
+    ]
+
+
+@pytest.mark.parametrize("spec", ["7d:raw,1d:1h", "*:1d,7d:raw", "7d", "7d:sometimes", ""])  # noqa: E501
+def test_invalid_tier_spec_is_rejected(spec):
+    """Убывающий возраст, * не в конце, уровень без режима и пустая строка"""
+    with pytest.raises(ValueError):
+        parse_retention_tiers(spec)
@@ -0,0 +1,63 @@
+import pytest
+
+from valutatrade_hub.parser_service.timeseries import (
+    append_to_timeseries,
+    rates_as_of,
+)
+
+
+@pytest.fixture
+def series():
+    """Ряды BTC_USD (CoinGecko) и EUR_USD (ExchangeRate-API) за сутки"""
+    for updated_at, btc, eur in (
+        ("2026-01-01T00:00:00", 40000.0, 1.10),
+        ("2026-01-01T12:00:00", 44000.0, 1.20),
+        ("2026-01-02T00:00:00", 48000.0, None),
+    ):
+        pairs = {"BTC_USD": {"rate": btc, "updated_at": updated_at, "source": "CoinGecko"}}  # noqa: E501
+        if eur is not None:
+            pairs["EUR_USD"] = {"rate": eur, "updated_at": updated_at, "source": "ExchangeRate-API"}  # noqa: E501
+        append_to_timeseries(pairs)
+
+
+def test_cross_rate_uses_both_legs_at_each_moment(series):
+    """Кросс-курс BTC→EUR считается через USD по записям на каждый момент"""
+    moments = ["2026-01-01T18:00:00", "2026-01-01T06:00:00", "2026-01-02T06:00:00"]
+    quotes = rates_as_of("BTC", "EUR", moments)
+
+    assert [q["rate"] for q in quotes] == pytest.approx([44000 / 1.2, 40000 / 1.1, 48000 / 1.2])  # noqa: E501
+    assert quotes[0]["via"] == "USD"
+    assert quotes[0]["at"] == "2026-01-01T18:00:00Z"
+    assert quotes[0]["sources"] == ["CoinGecko", "ExchangeRate-API"]
+    # Момент записи — более старая из двух ног кросс-курса
+    assert quotes[2]["timestamp"] == "2026-01-01T12:00:00Z"
+
+
+def test_direct_inverse_and_same_currency(series):
+    """Прямая пара, обратная пара и одна и та же валюта"""
+    direct, = rates_as_of("BTC", "USD", ["2026-01-01T12:00:00"])
+    inverse, = rates_as_of("USD", "EUR", ["2026-01-01T12:00:00"])
+    same, = rates_as_of("EUR", "EUR", ["2026-01-01T12:00:00"])
+
+    assert (direct["rate"], direct["via"]) == (44000.0, "direct")
+    assert inverse["rate"] == pytest.approx(1 / 1.2)
+    assert inverse["via"] == "inverse"
+    assert (same["rate"], same["via"]) == (1.0, "same")
+
+
+def test_moment_before_history_has_no_rate(series):
+    """До первой записи любой из ног курса нет"""
+    quotes = rates_as_of("BTC", "EUR", ["2025-12-31T23:59:59", "2026-01-01T00:00:00"])
+    assert quotes[0] is None
+    assert quotes[1]["rate"] == pytest.approx(40000 / 1.1)
+
+
+def test_unknown_pair_has_no_rate(series):
+    """Для пары без рядов курс не находится"""
+    assert rates_as_of("ETH", "EUR", ["2026-01-01T12:00:00"]) == [None]
+
+
+def test_invalid_moment_is_rejected(series):
+    """Неразбираемый момент — ValueError с понятным сообщением"""
+    with pytest.raises(ValueError, match="Некорректное время"):
+        rates_as_of("BTC", "EUR", ["вчера"])
@@ -0,0 +1,90 @@
+import threading
+
+import pytest
+
+from valutatrade_hub.infra.sqlite_store import (
+    SqliteDatabase,
+    SqlitePortfolioRepository,
+    SqliteUserRepository,
+)
+
+
+def user_record(username, user_id=1):
+    """Запись пользователя с фиктивным паролем"""
+    return {
+        "user_id": user_id,
+        "username": username,
+        "hashed_password": "hash",
+        "salt": "salt",
+        "registration_date": "2026-01-01T00:00:00",
+    }
+
+
+def open_repositories(db_path):
+    """Репозитории поверх отдельного подключения (как в другом процессе)"""
+    database = SqliteDatabase(db_path)
+    return SqliteUserRepository(database), SqlitePortfolioRepository(database)
+
+
+def test_colliding_id_does_not_replace_existing_user(tmp_path):
+    """Регистрация с уже занятым id получает новый id и не трогает чужие данные"""
+    db_path = tmp_path / "valutatrade.db"
+    users_a, portfolios_a = open_repositories(db_path)
+    users_b, portfolios_b = open_repositories(db_path)
+
+    # Оба процесса прочитали next_id до того, как кто-то записал пользователя
+    stale_id = users_a.next_id()
+    assert users_b.next_id() == stale_id
+
+    carol_id = users_a.add_with_portfolio(user_record("carol", stale_id), {"user_id": stale_id, "wallets": {}}, portfolios_a)  # noqa: E501
+    portfolios_a.record_trade(carol_id, "BTC", 2.0)
+    dave_id = users_b.add_with_portfolio(user_record("dave", stale_id), {"user_id": stale_id, "wallets": {}}, portfolios_b)  # noqa: E501
+
+    assert (carol_id, dave_id) == (1, 2)
+    assert users_b.get("carol")["user_id"] == 1
+    assert users_b.get("dave")["user_id"] == 2
+    assert portfolios_b.load(1)["wallets"] == {"BTC": {"balance": 2.0}}
+    assert portfolios_b.load(2)["wallets"] == {}
+
+
+def test_duplicate_username_is_rejected(tmp_path):
+    """Занятое имя не регистрируется повторно, даже с другим id"""
+    users, portfolios = open_repositories(tmp_path / "valutatrade.db")
+    users.add_with_portfolio(user_record("carol"), {"user_id": 1, "wallets": {}}, portfolios)  # noqa: E501
+
+    with pytest.raises(ValueError, match="уже занято"):
+        users.add_with_portfolio(user_record("carol", 5), {"user_id": 5, "wallets": {}}, portfolios)  # noqa: E501
+    assert [r["user_id"] for r in users.iter_records()] == [1]
+
+
+def test_parallel_registrations_get_distinct_ids(tmp_path):
+    """Параллельные регистрации из разных подключений получают разные id"""
+    db_path = tmp_path / "valutatrade.db"
+    # Схема создаётся заранее: проверяется гонка регистраций, а не миграций
+    SqliteDatabase(db_path).connection()
+    ids = []
+    errors = []
+    lock = threading.Lock()
+
+    def register(index):
+        users, portfolios = open_repositories(db_path)
+        try:
+            user_id = users.add_with_portfolio(user_record(f"user{index}"), {"user_id": 1, "wallets": {"USD": {"balance": float(index)}}}, portfolios)  # noqa: E501
+        except ValueError as e:
+            errors.append(e)
+            return
+        with lock:
+            ids.append((user_id, index))
+
+    threads = [threading.Thread(target=register, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert sorted(user_id for user_id, _ in ids) == list(range(1, 9))
+    users, portfolios = open_repositories(db_path)
+    for user_id, index in ids:
+        assert users.get(f"user{index}")["user_id"] == user_id
+        assert portfolios.load(user_id)["wallets"] == {"USD": {"balance": float(index)}}  # noqa: E501
@@ -0,0 +1,113 @@
+import json
+import multiprocessing
+
+import pytest
+
+from valutatrade_hub.infra.portfolio_store import PortfolioStore
+from valutatrade_hub.infra.trade_journal import TradeJournal
+
+
+def make_store(tmp_path, threshold=1000):
+    """Хранилище портфелей с журналом сделок во временном каталоге"""
+    journal = TradeJournal(tmp_path / "trades.jsonl")
+    return PortfolioStore(tmp_path / "portfolios", journal=journal, compact_threshold=threshold)  # noqa: E501
+
+
+def test_replay_applies_trades_over_snapshot(tmp_path):
+    """Сделки после journal_seq снимка применяются поверх него при чтении"""
+    store = make_store(tmp_path)
+    store.save({"user_id": 1, "wallets": {"USD": {"balance": 100.0}}})
+    store.record_trade(1, "USD", -40.0)
+    store.record_trade(1, "BTC", 0.5, rate=60.0)
+    store.record_trade(2, "EUR", 10.0)
+
+    # Новый экземпляр читает журнал с нуля
+    replayed = make_store(tmp_path)
+    assert replayed.load(1)["wallets"] == {"USD": {"balance": 60.0}, "BTC": {"balance": 0.5}}  # noqa: E501
+    assert replayed.load(2)["wallets"] == {"EUR": {"balance": 10.0}}
+    assert [p["user_id"] for p in replayed.iter_portfolios()] == [1, 2]
+
+
+def test_snapshot_does_not_replay_older_trades(tmp_path):
+    """Сохранённый снимок не применяет уже учтённые сделки повторно"""
+    store = make_store(tmp_path)
+    store.record_trade(1, "USD", 100.0)
+    store.save(store.load(1))
+    store.record_trade(1, "USD", 5.0)
+
+    assert make_store(tmp_path).load(1)["wallets"]["USD"]["balance"] == 105.0
+
+
+def test_torn_tail_is_ignored_and_separated(tmp_path):
+    """Оборванная последняя строка не читается и не склеивается со следующей"""
+    store = make_store(tmp_path)
+    store.record_trade(1, "USD", 1.0)
+    with open(tmp_path / "trades.jsonl", "ab") as f:
+        f.write(b'{"seq": 2, "user_id": 1, "curr')
+
+    store = make_store(tmp_path)
+    assert store.load(1)["wallets"]["USD"]["balance"] == 1.0
+    store.record_trade(1, "USD", 2.0)
+
+    assert make_store(tmp_path).load(1)["wallets"]["USD"]["balance"] == 3.0
+
+
+def test_compaction_folds_journal_into_snapshots(tmp_path):
+    """Компакция переносит сделки в снимки, нумерация продолжается"""
+    store = make_store(tmp_path, threshold=3)
+    store.record_trade(1, "USD", 10.0)
+    store.record_trade(2, "USD", 20.0)
+    store.record_trade(1, "USD", 5.0)
+
+    lines = (tmp_path / "trades.jsonl").read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line) for line in lines] == [{"snapshot_seq": 3}]
+    snapshot = json.loads((tmp_path / "portfolios" / "1.json").read_text(encoding="utf-8"))  # noqa: E501
+    assert snapshot["journal_seq"] == 3
+    assert snapshot["wallets"]["USD"]["balance"] == 15.0
+
+    store.record_trade(1, "USD", 1.0)
+    journal = TradeJournal(tmp_path / "trades.jsonl")
+    assert [e["seq"] for e in journal.entries_for(1)] == [4]
+    assert make_store(tmp_path).load(1)["wallets"]["USD"]["balance"] == 16.0
+    assert make_store(tmp_path).load(2)["wallets"]["USD"]["balance"] == 20.0
+
+
+def test_reader_notices_compaction_by_another_instance(tmp_path):
+    """Экземпляр, прочитавший журнал, перечитывает его после чужой компакции"""
+    reader = make_store(tmp_path)
+    writer = make_store(tmp_path)
+    writer.record_trade(1, "USD", 10.0)
+    assert reader.load(1)["wallets"]["USD"]["balance"] == 10.0
+
+    writer.compact()
+    writer.record_trade(1, "USD", 1.0)
+    assert reader.load(1)["wallets"]["USD"]["balance"] == 11.0
+
+
+def _trade_worker(tmp_path, user_id, count):
+    """Записывает count сделок по 1 USD из отдельного процесса"""
+    store = make_store(tmp_path, threshold=7)
+    for _ in range(count):
+        store.record_trade(user_id, "USD", 1.0)
+
+
+@pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(),
+    reason="нужен запуск процессов через fork",
+)
+def test_concurrent_appends_and_compactions_lose_no_trades(tmp_path):
+    """Сделки из нескольких процессов не теряются при частых компакциях"""
+    context = multiprocessing.get_context("fork")
+    workers = [
+        context.Process(target=_trade_worker, args=(tmp_path, user_id % 2 + 1, 100))
+        for user_id in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+        assert worker.exitcode == 0
+
+    store = make_store(tmp_path)
+    assert store.load(1)["wallets"]["USD"]["balance"] == 200.0
+    assert store.load(2)["wallets"]["USD"]["balance"] == 200.0
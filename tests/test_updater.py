@@ -0,0 +1,114 @@
+import json
+import threading
+import time
+
+from valutatrade_hub.parser_service.api_clients import (
+    CoinGeckoClient,
+    ExchangeRateApiClient,
+)
+from valutatrade_hub.parser_service.stub_server import FaultProfile
+from valutatrade_hub.parser_service.updater import RatesUpdater
+
+
+def fetch_threads():
+    """Живые потоки пула опроса провайдеров"""
+    return [t for t in threading.enumerate() if t.name.startswith("rates-fetch")]
+
+
+def seed_for(outcomes, **rates):
+    """Зерно профиля сбоев, при котором первые запросы дают outcomes"""
+    for seed in range(1000):
+        probe = FaultProfile(seed=seed, **rates)
+        if [probe.draw()[1] for _ in outcomes] == list(outcomes):
+            return seed
+    raise AssertionError(f"Нет зерна для исходов {outcomes}")
+
+
+def test_update_from_healthy_providers(stub_server, isolated_config):
+    """Оба провайдера отвечают с первой попытки, курсы попадают в кэш"""
+    result = RatesUpdater([CoinGeckoClient(), ExchangeRateApiClient()]).run_update()
+
+    results = result["results"]
+    assert {s["source"] for s in results["success"]} == {"CoinGecko", "ExchangeRate-API"}  # noqa: E501
+    assert results["failed"] == []
+    assert results["attempts"] == {"CoinGeckoClient": 1, "ExchangeRateApiClient": 1}
+    assert result["pairs"]["BTC_USD"]["source"] == "CoinGecko"
+    assert result["pairs"]["EUR_USD"]["source"] == "ExchangeRate-API"
+    with open(isolated_config.RATES_FILE_PATH, encoding="utf-8") as f:
+        assert set(json.load(f)["pairs"]) == set(result["pairs"])
+
+
+def test_transient_error_is_retried(stub_server):
+    """Ответ 500 повторяется, и вторая попытка приносит курсы"""
+    rates = {"error_rate": 0.5}
+    stub_server.profile = FaultProfile(seed=seed_for(["error", "ok"], **rates), **rates)  # noqa: E501
+
+    results = RatesUpdater([ExchangeRateApiClient()]).run_update()["results"]
+
+    assert results["attempts"] == {"ExchangeRateApiClient": 2}
+    assert [s["source"] for s in results["success"]] == ["ExchangeRate-API"]
+    assert stub_server.stats == {"requests": 2, "errors": 1, "ok": 1}
+
+
+def test_exhausted_retries_open_circuit_breaker(stub_server, isolated_config, monkeypatch):  # noqa: E501
+    """После исчерпания повторов автомат защиты отключает источник"""
+    stub_server.profile = FaultProfile(error_rate=1.0)
+    monkeypatch.setattr(isolated_config, "RETRY_ATTEMPTS", 3)
+    monkeypatch.setattr(isolated_config, "BREAKER_FAILURE_THRESHOLD", 1)
+
+    results = RatesUpdater([ExchangeRateApiClient()]).run_update()["results"]
+    assert results["attempts"] == {"ExchangeRateApiClient": 3}
+    assert [f["source"] for f in results["failed"]] == ["ExchangeRate-API"]
+    assert stub_server.stats["requests"] == 3
+
+    # Состояние автомата общее для процессов: новый updater тоже не ходит в сеть
+    results = RatesUpdater([ExchangeRateApiClient()]).run_update()["results"]
+    assert results["attempts"] == {"ExchangeRateApiClient": 0}
+    assert "автоматом защиты" in results["failed"][0]["error"]
+    assert stub_server.stats["requests"] == 3
+
+
+def test_permanent_error_is_not_retried(stub_server, isolated_config, monkeypatch):
+    """Постоянная ошибка (нет ключа API) не повторяется и не открывает автомат"""
+    monkeypatch.setattr(isolated_config, "EXCHANGERATE_API_KEY", "")
+    monkeypatch.setattr(isolated_config, "BREAKER_FAILURE_THRESHOLD", 1)
+
+    for _ in range(2):
+        results = RatesUpdater([ExchangeRateApiClient()]).run_update()["results"]
+        assert results["attempts"] == {"ExchangeRateApiClient": 1}
+        assert "EXCHANGERATE_API_KEY" in results["failed"][0]["error"]
+
+
+def test_retry_after_beyond_deadline_is_not_awaited(stub_server, isolated_config, monkeypatch):  # noqa: E501
+    """Повтор после 429 не ждётся, если Retry-After выходит за дедлайн"""
+    stub_server.profile = FaultProfile(rate_limit_rate=1.0, retry_after=30)
+    monkeypatch.setattr(isolated_config, "UPDATE_DEADLINE", 5)
+
+    started = time.monotonic()
+    results = RatesUpdater([ExchangeRateApiClient()]).run_update()["results"]
+
+    assert time.monotonic() - started < 2
+    assert results["attempts"] == {"ExchangeRateApiClient": 1}
+    assert stub_server.stats["rate_limited"] == 1
+
+
+def test_hanging_provider_is_cut_at_deadline(stub_server, isolated_config, monkeypatch):  # noqa: E501
+    """Зависший провайдер не задерживает обновление и потоки пула дольше дедлайна"""
+    stub_server.profile = FaultProfile(error_rate=0.0, hang_rate=1.0, hang_seconds=30)
+    monkeypatch.setattr(isolated_config, "UPDATE_DEADLINE", 1)
+    monkeypatch.setattr(isolated_config, "REQUEST_TIMEOUT", 30)
+
+    started = time.monotonic()
+    result = RatesUpdater([CoinGeckoClient(), ExchangeRateApiClient()]).run_update()
+
+    assert time.monotonic() - started < 2
+    assert result["pairs"] == {}
+    errors = [f["error"] for f in result["results"]["failed"]]
+    assert len(errors) == 2
+    assert all("дедлайн" in error for error in errors)
+
+    # Запросы ограничены остатком дедлайна, а не REQUEST_TIMEOUT
+    wait_until = time.monotonic() + 2
+    while fetch_threads() and time.monotonic() < wait_until:
+        time.sleep(0.05)
+    assert fetch_threads() == []
@@ -1,6 +1,13 @@
 import argparse
+import csv
+import json
+import os
 import shlex
 import sys
+import time
+from contextlib import closing
+from itertools import islice
+from operator import itemgetter
 
 from valutatrade_hub.core.exceptions import (
     ApiRequestError,
@@ -8,10 +15,15 @@ from valutatrade_hub.core.exceptions import (
     InsufficientFundsError,
 )
 from valutatrade_hub.core.usecases import (
+    RATES_TTL_SECONDS,
     buy_currency,
+    compact_trade_journal,
     get_rate,
+    get_rates_as_of,
     login_user,
+    migrate_storage_to_sqlite,
     register_user,
+    revalue_all_portfolios,
     sell_currency,
     show_portfolio,
 )
@@ -19,8 +31,16 @@ from valutatrade_hub.parser_service.api_clients import (
     CoinGeckoClient,
     ExchangeRateApiClient,
 )
-from valutatrade_hub.parser_service.storage import load_rates_cache
-from valutatrade_hub.parser_service.updater import RatesUpdater
+from valutatrade_hub.parser_service.candles import query_candles
+from valutatrade_hub.parser_service.config import config
+from valutatrade_hub.parser_service.scheduler import RatesScheduler
+from valutatrade_hub.parser_service.storage import (
+    compact_history,
+    get_rates_snapshot,
+    rebuild_timeseries,
+)
+from valutatrade_hub.parser_service.timeseries import query_range
+from valutatrade_hub.parser_service.updater import RatesUpdater, wait_for_refreshes
 
 
 def register_command(args):
@@ -78,6 +98,85 @@ def sell_command(args):
         print(str(e))
 
 
+def revalue_portfolios_command(args):
+    """Обработчик команды revalue-portfolios"""
+    bases = [code.strip().upper() for code in args.base.split(",")] if args.base else None  # noqa: E501
+    try:
+        started = time.perf_counter()
+        valuation = revalue_all_portfolios(bases)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+    except (ValueError, CurrencyNotFoundError) as e:
+        print(str(e))
+        return
+    
+    for base, data in valuation.items():
+        totals = data["totals"]
+        print(f"Оценка портфелей в {base} ({len(totals)} пользователей):")
+        for user_id, total in sorted(totals.items()):
+            print(f"- user_id={user_id}: {total:,.2f} {base}")
+        if data["missing"]:
+            print(f"  Нет курса для: {', '.join(data['missing'])}")
+    print(f"Время оценки: {elapsed_ms:.1f} мс")
+
+
+def compact_journal_command(args):
+    """Обработчик команды compact-journal"""
+    try:
+        users_count = compact_trade_journal()
+        print(f"Журнал сделок свёрнут в снимки портфелей (пользователей: {users_count})")  # noqa: E501
+    except ValueError as e:
+        print(str(e))
+
+
+def migrate_storage_command(args):
+    """Обработчик команды migrate-storage"""
+    try:
+        users_count, portfolios_count = migrate_storage_to_sqlite()
+        print(f"Перенесено в SQLite: пользователей {users_count}, портфелей {portfolios_count}. "  # noqa: E501
+              "Установите storage_backend = \"sqlite\" в pyproject.toml")
+    except ValueError as e:
+        print(str(e))
+
+
+def _format_bytes(size):
+    """Размер в байтах в читаемом виде"""
+    for unit in ("Б", "КБ", "МБ"):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == "Б" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ГБ"
+
+
+def compact_history_command(args):
+    """Обработчик команды compact-history"""
+    try:
+        report = compact_history(args.tiers, dry_run=args.dry_run)
+    except ValueError as e:
+        print(str(e))
+        return
+    
+    action = "будет освобождено" if args.dry_run else "освобождено"
+    print(f"История курсов{' (пробный прогон)' if args.dry_run else ''}: "
+          f"записей {report['records_before']} → {report['records_after']}, "
+          f"размер {_format_bytes(report['bytes_before'])} → {_format_bytes(report['bytes_after'])}")  # noqa: E501
+    for title, part in (("Временные ряды", report["timeseries"]), ("Свечи", report["candles"])):  # noqa: E501
+        print(f"{title}: файлов {part['files']}, "
+              f"размер {_format_bytes(part['bytes_before'])} → {_format_bytes(part['bytes_after'])}")  # noqa: E501
+    print(f"Всего {action} {_format_bytes(report['reclaimed'])}")
+
+
+def rebuild_timeseries_command(args):
+    """Обработчик команды rebuild-timeseries"""
+    try:
+        report = rebuild_timeseries()
+    except ValueError as e:
+        print(str(e))
+        return
+    
+    print(f"Временные ряды и свечи построены из истории: пар {report['pairs']}, "
+          f"записей {report['records']}")
+
+
 def get_rate_command(args):
     """Обработчик команды get-rate"""
     try:
@@ -93,6 +192,103 @@ def get_rate_command(args):
         print(str(e))
 
 
+def rate_at_command(args):
+    """Обработчик команды rate-at"""
+    moments = list(args.at or [])
+    if args.at_file:
+        try:
+            with open(args.at_file, "r", encoding="utf-8") as f:
+                moments.extend(line.strip() for line in f if line.strip())
+        except IOError as e:
+            print(f"Не удалось прочитать файл моментов: {e}")
+            return
+    if not moments:
+        print("Укажите момент через --at или файл моментов через --at-file")
+        return
+    
+    try:
+        quotes = get_rates_as_of(args.from_currency, args.to_currency, moments)
+    except (CurrencyNotFoundError, ValueError) as e:
+        print(str(e))
+        return
+    
+    pair = f"{args.from_currency}→{args.to_currency}"
+    missing = False
+    for moment, quote in zip(moments, quotes):
+        if quote is None:
+            print(f"{moment}: курс {pair} в истории не найден")
+            missing = True
+            continue
+        via = f", через {quote['via']}" if quote["via"] not in ("direct", "inverse", "same") else ""  # noqa: E501
+        print(f"{quote['at']}: {pair} = {quote['rate']:.8f} "
+              f"(запись от {quote['timestamp']}{via})")
+    if missing:
+        print("Если история накоплена до появления временных рядов, "
+              "выполните 'rebuild-timeseries'")
+
+
+def _print_update_result(result):
+    """Выводит итоги одного обновления курсов"""
+    has_errors = bool(result["results"]["failed"])
+    
+    timings = result["results"].get("timings", {})
+    
+    for success in result["results"]["success"]:
+        pairs_count = success["pairs_count"]
+        elapsed = timings.get(success["client"], 0.0)
+        print(f"INFO: Fetching from {success['source']}... OK ({pairs_count} rates, {elapsed:.2f}s)")  # noqa: E501
+    
+    for skipped in result["results"].get("skipped", []):
+        if skipped.get("reason") == "rate_limit":
+            print(f"WARNING: {skipped['source']}: local rate limit reached, "
+                  f"next request in {skipped['retry_after']:.0f}s, skipped")
+        else:
+            print(f"INFO: {skipped['source']}: rates are fresh ({skipped['age']:.0f}s old), skipped")  # noqa: E501
+    
+    for failure in result["results"]["failed"]:
+        print(f"ERROR: Failed to fetch from {failure['source']}: {failure['error']}")
+    
+    cache_stats = result["results"].get("cache", {})
+    if cache_stats:
+        hits = sum(stats["hits"] for stats in cache_stats.values())
+        revalidated = sum(stats["revalidated"] for stats in cache_stats.values())
+        misses = sum(stats["misses"] for stats in cache_stats.values())
+        print(f"INFO: HTTP cache: {hits} hits, {revalidated} revalidated (304), {misses} misses")  # noqa: E501
+    
+    rate_limit_stats = result["results"].get("rate_limit", {})
+    waited = sum(stats["waited"] for stats in rate_limit_stats.values())
+    if waited:
+        wait_seconds = sum(stats["wait_seconds"] for stats in rate_limit_stats.values())  # noqa: E501
+        print(f"INFO: Rate limit: {waited} requests waited {wait_seconds:.2f}s for quota")  # noqa: E501
+    
+    if result["results"]["total_pairs"] > 0:
+        print(f"INFO: Writing {result['results']['total_pairs']} rates to data/rates.json...")  # noqa: E501
+    
+    if has_errors:
+        print("Update completed with errors. Check logs/parser.log for details.")
+    else:
+        print(f"Update successful. Total rates updated: {result['results']['total_pairs']}. "  # noqa: E501
+              f"Last refresh: {result['last_refresh']}")
+
+
+def _run_rates_daemon(updater):
+    """Запускает фоновое обновление курсов до Ctrl+C / SIGTERM"""
+    scheduler = RatesScheduler(updater, RATES_TTL_SECONDS)
+    
+    def on_cycle(cycle):
+        if cycle["error"] is not None:
+            print(f"ERROR: Cycle {cycle['cycle']} failed: {cycle['error']}")
+        else:
+            _print_update_result(cycle["result"])
+        print(f"INFO: Cycle {cycle['cycle']} took {cycle['latency']:.2f}s, "
+              f"next refresh in {cycle['next_in']:.0f}s")
+    
+    print("INFO: Rates daemon started. Press Ctrl+C to stop.")
+    with scheduler.handle_signals():
+        cycles = scheduler.run(on_cycle=on_cycle)
+    print(f"INFO: Rates daemon stopped after {cycles} cycles")
+
+
 def update_rates_command(args):
     """Обработчик команды update-rates"""
     print("INFO: Starting rates update...")
@@ -114,35 +310,14 @@ def update_rates_command(args):
     
     updater = RatesUpdater(api_clients)
     
+    if args.daemon:
+        _run_rates_daemon(updater)
+        return
+    
     try:
-        result = updater.run_update()
-        
-        has_errors = bool(result["results"]["failed"])
-        
-        for success in result["results"]["success"]:
-            client_name = success["client"]
-            pairs_count = success["pairs_count"]
-            if "CoinGecko" in client_name:
-                print(f"INFO: Fetching from CoinGecko... OK ({pairs_count} rates)")
-            elif "ExchangeRate" in client_name:
-                print(f"INFO: Fetching from ExchangeRate-API... OK ({pairs_count} rates)")  # noqa: E501
-        
-        for failure in result["results"]["failed"]:
-            client_name = failure["client"]
-            error_msg = failure["error"]
-            if "CoinGecko" in client_name:
-                print(f"ERROR: Failed to fetch from CoinGecko: {error_msg}")
-            elif "ExchangeRate" in client_name:
-                print(f"ERROR: Failed to fetch from ExchangeRate-API: {error_msg}")
-        
-        if result["results"]["total_pairs"] > 0:
-            print(f"INFO: Writing {result['results']['total_pairs']} rates to data/rates.json...")  # noqa: E501
-        
-        if has_errors:
-            print("Update completed with errors. Check logs/parser.log for details.")
-        else:
-            print(f"Update successful. Total rates updated: {result['results']['total_pairs']}. "  # noqa: E501
-                  f"Last refresh: {result['last_refresh']}")
+        # Явно выбранный источник обновляется всегда, иначе — только устаревшие
+        result = updater.run_update(stale_only=not (args.force or args.source))
+        _print_update_result(result)
             
     except ApiRequestError as e:
         print(f"ERROR: {e}")
@@ -152,10 +327,28 @@ def update_rates_command(args):
         print(f"ERROR: Unexpected error: {e}")
 
 
+def benchmark_update_command(args):
+    """Обработчик команды benchmark-update"""
+    from valutatrade_hub.parser_service.benchmark import run_offline_benchmark
+    
+    print(f"INFO: Offline benchmark: {args.crypto} crypto + {args.fiat} fiat assets, "
+          f"latency {args.latency:.3f}s ± {args.jitter:.3f}s, {args.runs} runs")
+    try:
+        report = run_offline_benchmark(args.crypto, args.fiat, args.latency, args.jitter, args.runs)  # noqa: E501
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        return
+    
+    for run in report["runs"]:
+        print(f"Run {run['run']}: {run['seconds']:.3f}s, {run['pairs']} rates, {run['failed']} failed")  # noqa: E501
+    print(f"Median: {report['median_seconds']:.3f}s "
+          f"({report['assets']} assets, {report['requests_per_run']} requests per run)")
+
+
 def show_rates_command(args):
     """Обработчик команды show-rates"""
     try:
-        cache = load_rates_cache()
+        cache = get_rates_snapshot().data
     except ValueError as e:
         print(f"ERROR: {e}")
         return
@@ -183,33 +376,24 @@ def show_rates_command(args):
     
     if args.base:
         base_upper = args.base.upper()
-        converted_pairs = {}
-        base_rate = None
+        matrix = get_rates_snapshot().matrix
         
-        for pair_key, pair_data in filtered_pairs.items():
-            if pair_key.endswith(f"_{base_upper}"):
-                base_rate = pair_data["rate"]
-                break
-        
-        if base_rate is None:
-            base_pair = f"{base_upper}_USD"
-            if base_pair in pairs:
-                base_rate = pairs[base_pair]["rate"]
-            else:
-                print(f"Курс для базовой валюты '{args.base}' не найден в кеше.")
-                return
+        if base_upper not in matrix:
+            print(f"Курс для базовой валюты '{args.base}' не найден в кеше.")
+            return
         
+        converted_pairs = {}
         for pair_key, pair_data in filtered_pairs.items():
-            if pair_key.endswith("_USD"):
-                currency = pair_key.split("_")[0]
-                usd_rate = pair_data["rate"]
-                converted_rate = usd_rate / base_rate
-                new_pair_key = f"{currency}_{base_upper}"
-                converted_pairs[new_pair_key] = {
-                    "rate": converted_rate,
-                    "updated_at": pair_data["updated_at"],
-                    "source": pair_data["source"]
-                }
+            currency = pair_key.split("_")[0]
+            converted_rate = matrix.rate(currency, base_upper)
+            if converted_rate is None:
+                continue
+            new_pair_key = f"{currency}_{base_upper}"
+            converted_pairs[new_pair_key] = {
+                "rate": converted_rate,
+                "updated_at": pair_data["updated_at"],
+                "source": pair_data["source"]
+            }
         
         filtered_pairs = converted_pairs
     
@@ -230,6 +414,80 @@ def show_rates_command(args):
         print(f"- {pair_key}: {rate:.8f}")
 
 
+HISTORY_FIELDS = {
+    "candles": ("timestamp", "open", "high", "low", "close", "count"),
+    "raw": ("timestamp", "rate", "source"),
+}
+
+
+def _history_table_row(kind, row):
+    """Строка таблицы history для свечи или записи ряда"""
+    if kind == "raw":
+        return f"{row['timestamp']:<28} {row['rate']:>20.8f}  {row['source']}"
+    return (f"{row['timestamp']:<22} {row['open']:>16.8f} {row['high']:>16.8f} "
+            f"{row['low']:>16.8f} {row['close']:>16.8f} {row['count']:>6}")
+
+
+def _write_history(rows, kind, output_format, title):
+    """Потоково выводит строки истории в stdout и возвращает их число"""
+    fields = HISTORY_FIELDS[kind]
+    values = itemgetter(*fields)
+    writer = None
+    if output_format == "csv":
+        writer = csv.writer(sys.stdout, lineterminator="\n")
+        writer.writerow(fields)
+    
+    count = 0
+    for row in rows:
+        if output_format == "csv":
+            writer.writerow(values(row))
+        elif output_format == "jsonl":
+            sys.stdout.write(json.dumps(row, ensure_ascii=False) + "\n")
+        else:
+            if count == 0:
+                print(title)
+                if kind == "raw":
+                    print(f"{'Время (UTC)':<28} {'Курс':>20}  Источник")
+                else:
+                    print(f"{'Начало (UTC)':<22} {'Open':>16} {'High':>16} {'Low':>16} {'Close':>16} {'Тиков':>6}")  # noqa: E501
+            print(_history_table_row(kind, row))
+        count += 1
+    sys.stdout.flush()
+    return count
+
+
+def history_command(args):
+    """Обработчик команды history"""
+    pair_key = args.pair.upper()
+    if args.raw and args.interval:
+        print("Параметры --raw и --interval несовместимы")
+        return
+    if args.limit is not None and args.limit <= 0:
+        print("Параметр --limit должен быть положительным")
+        return
+    
+    try:
+        if args.raw:
+            kind, rows = "raw", query_range(pair_key, args.since, args.until)
+            title = f"Записи {pair_key} из временного ряда:"
+        else:
+            resolution, rows = query_candles(pair_key, args.since, args.until, args.interval)  # noqa: E501
+            kind = "candles"
+            title = (f"Свечи {pair_key} (интервал {args.interval or resolution}, "
+                     f"прочитаны свечи {resolution}):")
+        # Строки читаются и выводятся по одной: память не зависит от объёма
+        with closing(rows):
+            count = _write_history(islice(rows, args.limit), kind, args.format, title)  # noqa: E501
+    except ValueError as e:
+        print(str(e))
+        return
+    
+    if count == 0 and args.format == "table":
+        print(f"История курса {pair_key} за указанный период не найдена. "
+              "Выполните 'update-rates', чтобы накопить данные, или "
+              "'rebuild-timeseries', чтобы построить ряды из лога истории.")
+
+
 def create_parser():
     """Создаёт и настраивает парсер аргументов"""
     parser = argparse.ArgumentParser(description="ValutaTrade Hub CLI", exit_on_error=False)  # noqa: E501
@@ -259,25 +517,88 @@ def create_parser():
     sell_parser.add_argument("--amount", required=True, type=float, help="Количество продаваемой валюты")  # noqa: E501
     sell_parser.set_defaults(func=sell_command)
 
+    revalue_parser = subparsers.add_parser("revalue-portfolios", help="Оценить портфели всех пользователей")  # noqa: E501
+    revalue_parser.add_argument("--base", help="Базовые валюты через запятую (по умолчанию USD)")  # noqa: E501
+    revalue_parser.set_defaults(func=revalue_portfolios_command)
+
+    compact_journal_parser = subparsers.add_parser("compact-journal", help="Свернуть журнал сделок в снимки портфелей")  # noqa: E501
+    compact_journal_parser.set_defaults(func=compact_journal_command)
+
+    migrate_storage_parser = subparsers.add_parser("migrate-storage", help="Перенести пользователей и портфели из JSON в SQLite")  # noqa: E501
+    migrate_storage_parser.set_defaults(func=migrate_storage_command)
+
+    compact_history_parser = subparsers.add_parser("compact-history", help="Проредить историю курсов по уровням хранения")  # noqa: E501
+    compact_history_parser.add_argument("--tiers", help="Уровни хранения, например 7d:raw,365d:1h,*:1d")  # noqa: E501
+    compact_history_parser.add_argument("--dry-run", action="store_true", help="Только посчитать, сколько места освободится")  # noqa: E501
+    compact_history_parser.set_defaults(func=compact_history_command)
+
+    rebuild_timeseries_parser = subparsers.add_parser("rebuild-timeseries", help="Построить временные ряды и свечи из лога истории")  # noqa: E501
+    rebuild_timeseries_parser.set_defaults(func=rebuild_timeseries_command)
+
     get_rate_parser = subparsers.add_parser("get-rate", help="Получить курс валюты")
     get_rate_parser.add_argument("--from", dest="from_currency", required=True, help="Исходная валюта")  # noqa: E501
     get_rate_parser.add_argument("--to", dest="to_currency", required=True, help="Целевая валюта")  # noqa: E501
     get_rate_parser.set_defaults(func=get_rate_command)
 
+    rate_at_parser = subparsers.add_parser("rate-at", help="Курс валюты на момент в прошлом (по истории)")  # noqa: E501
+    rate_at_parser.add_argument("--from", dest="from_currency", required=True, help="Исходная валюта")  # noqa: E501
+    rate_at_parser.add_argument("--to", dest="to_currency", required=True, help="Целевая валюта")  # noqa: E501
+    rate_at_parser.add_argument("--at", action="append", help="Момент: ISO-время или длительность назад (7d); можно повторять")  # noqa: E501
+    rate_at_parser.add_argument("--at-file", help="Файл с моментами, по одному в строке")  # noqa: E501
+    rate_at_parser.set_defaults(func=rate_at_command)
+
     update_rates_parser = subparsers.add_parser("update-rates", help="Обновить курсы валют из внешних API")  # noqa: E501
     update_rates_parser.add_argument("--source", help="Источник данных (coingecko или exchangerate)")  # noqa: E501
+    update_rates_parser.add_argument("--force", action="store_true", help="Обновить все источники, даже со свежими курсами")  # noqa: E501
+    update_rates_parser.add_argument("--daemon", action="store_true", help="Обновлять курсы в фоне по TTL до Ctrl+C")  # noqa: E501
     update_rates_parser.set_defaults(func=update_rates_command)
 
+    benchmark_parser = subparsers.add_parser("benchmark-update", help="Замерить обновление курсов без сети на синтетических данных")  # noqa: E501
+    benchmark_parser.add_argument("--crypto", type=int, default=500, help="Число вымышленных криптовалют")  # noqa: E501
+    benchmark_parser.add_argument("--fiat", type=int, default=150, help="Число вымышленных фиатных валют")  # noqa: E501
+    benchmark_parser.add_argument("--latency", type=float, default=0.05, help="Задержка ответа провайдера, с")  # noqa: E501
+    benchmark_parser.add_argument("--jitter", type=float, default=0.0, help="Разброс задержки, с")  # noqa: E501
+    benchmark_parser.add_argument("--runs", type=int, default=3, help="Число прогонов")
+    benchmark_parser.set_defaults(func=benchmark_update_command)
+
     show_rates_parser = subparsers.add_parser("show-rates", help="Показать курсы из локального кеша")  # noqa: E501
     show_rates_parser.add_argument("--currency", help="Показать курс только для указанной валюты")  # noqa: E501
     show_rates_parser.add_argument("--top", type=int, help="Показать N самых дорогих криптовалют")  # noqa: E501
     show_rates_parser.add_argument("--base", help="Показать все курсы относительно указанной базы")  # noqa: E501
     show_rates_parser.set_defaults(func=show_rates_command)
 
+    history_parser = subparsers.add_parser("history", help="Показать или выгрузить историю курса пары")  # noqa: E501
+    history_parser.add_argument("--pair", required=True, help="Пара вида BTC_USD")
+    history_parser.add_argument("--since", help="Начало периода: ISO-время или длительность назад (7d)")  # noqa: E501
+    history_parser.add_argument("--until", help="Конец периода (по умолчанию — сейчас)")  # noqa: E501
+    history_parser.add_argument("--interval", help="Длительность свечи: 1m, 15m, 1h, 4h, 1d... (по умолчанию подбирается по периоду)")  # noqa: E501
+    history_parser.add_argument("--raw", action="store_true", help="Выводить записи временного ряда вместо свечей")  # noqa: E501
+    history_parser.add_argument("--limit", type=int, help="Не больше N строк")
+    history_parser.add_argument("--format", choices=("table", "csv", "jsonl"), default="table", help="Формат вывода")  # noqa: E501
+    history_parser.set_defaults(func=history_command)
+
     return parser
 
 
-def parse_and_execute_command(line, parser):
+def execute_command(argv, parser):
+    """Выполняет команду из списка аргументов и возвращает код завершения"""
+    try:
+        args = parser.parse_args(argv)
+    except argparse.ArgumentError as e:
+        print(str(e))
+        return 2
+    except SystemExit as e:
+        # argparse уже вывел справку или сообщение об ошибке
+        return e.code or 0
+    
+    if args.command is None:
+        parser.print_help()
+    else:
+        args.func(args)
+    return 0
+
+
+def parse_and_execute_command(line, parser, quiet=False):
     """Парсит и выполняет команду из строки"""
     if not line.strip():
         return
@@ -285,7 +606,8 @@ def parse_and_execute_command(line, parser):
     line = line.strip()
     
     if line.lower() in ("exit", "quit", "q"):
-        print("Выход из приложения")
+        if not quiet:
+            print("Выход из приложения")
         sys.exit(0)
     
     if line.lower() in ("help", "?"):
@@ -293,27 +615,57 @@ def parse_and_execute_command(line, parser):
         return
     
     try:
-        args = parser.parse_args(shlex.split(line))
-    except argparse.ArgumentError as e:
-        print(str(e))
-        return
-    except SystemExit:
+        argv = shlex.split(line)
+    except ValueError as e:
+        print(f"Некорректная команда: {e}")
         return
+    execute_command(argv, parser)
+
+
+def _run_interactive(parser):
+    """Читает команды из stdin до exit или конца ввода"""
+    # Без терминала (команды из канала или файла) баннер и приглашение
+    # не выводятся, чтобы в stdout попадал только вывод команд
+    interactive = sys.stdin.isatty()
+    if interactive:
+        print("ValutaTrade Hub CLI")
+        print("Введите команду (help - справка, exit - выход)")
+        print("-" * 50)
     
-    if args.command is None:
-        parser.print_help()
-    else:
-        args.func(args)
+    while True:
+        try:
+            line = input("> " if interactive else "")
+        except EOFError:
+            if interactive:
+                print()
+            return
+        parse_and_execute_command(line, parser, quiet=not interactive)
 
 
-def main():
-    """Главная функция CLI - интерактивный режим"""
+def main(argv=None):
+    """Главная функция CLI: команда из аргументов или интерактивный режим"""
+    argv = sys.argv[1:] if argv is None else argv
     parser = create_parser()
     
-    print("ValutaTrade Hub CLI")
-    print("Введите команду (help - справка, exit - выход)")
-    print("-" * 50)
-    
-    while True:
-        line = input("> ")
-        parse_and_execute_command(line, parser)
+    code = 0
+    try:
+        if argv:
+            # Однократный запуск: project history --pair BTC_USD --format csv > out.csv
+            code = execute_command(argv, parser)
+        else:
+            _run_interactive(parser)
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # Читатель закрыл канал (например, | head): остаток вывода
+        # отбрасывается, а stdout перенаправляется в devnull, чтобы
+        # интерпретатор не сообщал об ошибке при завершении
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        code = 1
+    finally:
+        # Обновление курсов, запущенное командой в фоне, завершается до
+        # выхода (в том числе по exit), иначе поток-демон погибнет вместе
+        # с процессом
+        if not wait_for_refreshes(config.UPDATE_DEADLINE):
+            print("Фоновое обновление курсов не успело завершиться", file=sys.stderr)
+    sys.exit(code)
@@ -1,7 +1,13 @@
+import json
 import re
 from abc import ABC, abstractmethod
+from functools import lru_cache
+from pathlib import Path
 
 from valutatrade_hub.core.exceptions import CurrencyNotFoundError
+from valutatrade_hub.core.settings import settings
+
+DEFAULT_CURRENCIES_FILE = Path(__file__).with_name("currencies.json")
 
 
 class Currency(ABC):
@@ -67,6 +73,13 @@ def register_currency(currency):
     _currency_registry[currency.code] = currency
 
 
+def register_provider_fiat(code):
+    """Регистрирует фиатную валюту провайдера, которой нет во вселенной валют"""
+    if code not in _currency_registry:
+        register_currency(FiatCurrency(code, code, "не указана"))
+    return _currency_registry[code]
+
+
 def get_currency(code):
     """Получает валюту по коду (фабричный метод)"""
     if not code or not code.strip():
@@ -80,14 +93,45 @@ def get_currency(code):
     return _currency_registry[code]
 
 
+@lru_cache(maxsize=None)
+def load_currency_universe(file_path=None):
+    """
+    Загружает вселенную валют из JSON-файла.
+
+    Файл задаётся настройкой currencies_file (по умолчанию —
+    currencies.json рядом с модулем) и содержит списки "fiat" и "crypto";
+    для криптовалют указывается coingecko_id.
+    """
+    file_path = Path(file_path or settings.get("currencies_file", DEFAULT_CURRENCIES_FILE))  # noqa: E501
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            universe = json.load(f)
+    except (json.JSONDecodeError, IOError) as e:
+        raise ValueError(f"Ошибка при чтении списка валют {file_path}: {e}")
+    
+    return {
+        "fiat": tuple(universe.get("fiat", [])),
+        "crypto": tuple(universe.get("crypto", [])),
+    }
+
+
+def iter_currencies(currency_class=Currency):
+    """Итерирует зарегистрированные валюты заданного класса"""
+    return (c for c in _currency_registry.values() if isinstance(c, currency_class))
+
+
 def initialize_default_currencies():
-    """Инициализирует реестр валют значениями по умолчанию"""
-    register_currency(FiatCurrency("US Dollar", "USD", "United States"))
-    register_currency(FiatCurrency("Euro", "EUR", "Eurozone"))
-    register_currency(FiatCurrency("Russian Ruble", "RUB", "Russia"))
-    register_currency(CryptoCurrency("Bitcoin", "BTC", "SHA-256", 1.12e12))
-    register_currency(CryptoCurrency("Ethereum", "ETH", "Ethash", 3.5e11))
-    register_currency(CryptoCurrency("Solana", "SOL", "Ed25519", 1)) 
+    """Инициализирует реестр валют из файла вселенной валют"""
+    universe = load_currency_universe()
+    for entry in universe["fiat"]:
+        register_currency(FiatCurrency(entry["name"], entry["code"], entry["issuing_country"]))  # noqa: E501
+    for entry in universe["crypto"]:
+        register_currency(CryptoCurrency(
+            entry["name"],
+            entry["code"],
+            entry["algorithm"],
+            entry.get("market_cap", 0),
+        ))
 
 
 initialize_default_currencies()
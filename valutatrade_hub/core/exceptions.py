@@ -22,3 +22,20 @@ class ApiRequestError(Exception):
     def __init__(self, reason):
         self.reason = reason
         super().__init__(f"Ошибка при обращении к внешнему API: {reason}")
+
+
+class TransientApiError(ApiRequestError):
+    """Временный сбой внешнего API (сеть, HTTP 5xx, 429): запрос можно повторить"""
+    
+    def __init__(self, reason, retry_after=None):
+        self.retry_after = retry_after
+        super().__init__(reason)
+
+
+class RateLimitExceeded(ApiRequestError):
+    """Клиентский лимит запросов к источнику исчерпан: запрос не выполнялся"""
+    
+    def __init__(self, source, retry_after):
+        self.source = source
+        self.retry_after = retry_after
+        super().__init__(f"превышен лимит запросов к {source}, следующий через {retry_after:.0f} с")  # noqa: E501
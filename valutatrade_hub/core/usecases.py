@@ -1,10 +1,9 @@
 import hashlib
-import json
 import secrets
 from datetime import datetime
 from pathlib import Path
 
-from valutatrade_hub.core.currencies import get_currency
+from valutatrade_hub.core.currencies import get_currency, register_provider_fiat
 from valutatrade_hub.core.decorators import log_action
 from valutatrade_hub.core.exceptions import (
     ApiRequestError,
@@ -13,81 +12,61 @@ from valutatrade_hub.core.exceptions import (
 )
 from valutatrade_hub.core.models import Portfolio, User
 from valutatrade_hub.core.settings import settings
+from valutatrade_hub.core.valuation import PortfolioValuationEngine
+from valutatrade_hub.infra.repositories import (
+    create_json_repositories,
+    create_repositories,
+)
 
 DATA_DIR = Path(settings.get("data_dir", "data"))
-USERS_FILE = Path(settings.get("users_file", DATA_DIR / "users.json"))
-PORTFOLIOS_FILE = Path(settings.get("portfolios_file", DATA_DIR / "portfolios.json"))
-RATES_FILE = Path(settings.get("rates_file", DATA_DIR / "rates.json"))
 RATES_TTL_SECONDS = settings.get("rates_ttl_seconds", 300)
 DEFAULT_BASE_CURRENCY = settings.get("default_base_currency", "USD")
 
 _current_user = None
+_user_repository, _portfolio_repository = create_repositories()
 
 
-def get_rate_from_cache(currency_code, base_currency="USD"):
-    """Получает курс валюты из кеша"""
-    try:
-        from valutatrade_hub.parser_service.storage import load_rates_cache
-        cache = load_rates_cache()
-        pairs = cache.get("pairs", {})
-        
-        if currency_code == base_currency:
-            return 1.0
-        
-        pair_key = f"{currency_code}_{base_currency}"
-        if pair_key in pairs:
-            return pairs[pair_key]["rate"]
-        
-        if base_currency == "USD":
-            return None
-        
-        usd_pair = f"{currency_code}_USD"
-        base_usd_pair = f"{base_currency}_USD"
-        
-        if usd_pair in pairs and base_usd_pair in pairs:
-            currency_rate = pairs[usd_pair]["rate"]
-            base_rate = pairs[base_usd_pair]["rate"]
-            return currency_rate / base_rate
-        
-        return None
-    except (ValueError, ImportError):
-        return None
-
+def resolve_currency(code):
+    """
+    Возвращает валюту из реестра или фиатную валюту провайдера.
 
-def load_json_file(file_path):
-    """Загружает данные из JSON файла (безопасная операция)"""
+    ExchangeRate-API отдаёт больше валют, чем описано во вселенной валют;
+    код, курс которого к базовой валюте есть в кеше курсов, регистрируется
+    как фиатная валюта, чтобы с ним работали get-rate и сделки.
+    """
     try:
-        if not file_path.exists():
-            return []
-        with open(file_path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except (json.JSONDecodeError, IOError) as e:
-        raise ValueError(f"Ошибка при чтении файла {file_path}: {e}")
+        return get_currency(code)
+    except CurrencyNotFoundError:
+        from valutatrade_hub.parser_service.config import config
+        from valutatrade_hub.parser_service.storage import get_rates_snapshot
+        
+        code = code.strip()
+        try:
+            pair = get_rates_snapshot().get_pair(f"{code}_{config.BASE_CURRENCY}")
+        except ValueError:
+            pair = None
+        if pair is None:
+            raise
+        return register_provider_fiat(code)
 
 
-def save_json_file(file_path, data):
-    """Сохраняет данные в JSON файл (безопасная операция)"""
+def get_rate_from_cache(currency_code, base_currency="USD"):
+    """Получает курс валюты из кеша"""
     try:
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2)
-    except (IOError, OSError) as e:
-        raise ValueError(f"Ошибка при записи файла {file_path}: {e}")
+        from valutatrade_hub.parser_service.storage import get_rates_snapshot
+        return get_rates_snapshot().get_rate(currency_code, base_currency)
+    except (ValueError, ImportError):
+        return None
 
 
 def get_next_user_id():
     """Получает следующий доступный user_id"""
-    users = load_json_file(USERS_FILE)
-    if not users:
-        return 1
-    max_id = max(user.get("user_id") for user in users)
-    return max_id + 1
+    return _user_repository.next_id()
 
 
 def is_username_taken(username):
     """Проверяет, занято ли имя пользователя"""
-    users = load_json_file(USERS_FILE)
-    return any(user.get("username") == username for user in users)
+    return _user_repository.is_taken(username.strip())
 
 
 @log_action("REGISTER")
@@ -116,24 +95,16 @@ def register_user(username, password):
         registration_date=registration_date,
     )
 
+    portfolio_data = {
+        "user_id": user_id,
+        "wallets": {},
+    }
     try:
-        users = load_json_file(USERS_FILE)
-        users.append(user.to_dict())
-        save_json_file(USERS_FILE, users)
+        # Хранилище может выделить другой id, если этот успели занять
+        user_id = _user_repository.add_with_portfolio(user.to_dict(), portfolio_data, _portfolio_repository)  # noqa: E501
     except ValueError as e:
         raise ValueError(f"Ошибка при сохранении пользователя: {e}")
 
-    try:
-        portfolios = load_json_file(PORTFOLIOS_FILE)
-        portfolio_data = {
-            "user_id": user_id,
-            "wallets": {},
-        }
-        portfolios.append(portfolio_data)
-        save_json_file(PORTFOLIOS_FILE, portfolios)
-    except ValueError as e:
-        raise ValueError(f"Ошибка при создании портфеля: {e}")
-
     return user_id
 
 
@@ -144,8 +115,7 @@ def login_user(username, password):
     if not username or not username.strip():
         raise ValueError("Имя пользователя не может быть пустым")
 
-    users = load_json_file(USERS_FILE)
-    user_data = next((u for u in users if u.get("username") == username.strip()), None)
+    user_data = _user_repository.get(username.strip())
 
     if user_data is None:
         raise ValueError(f"Пользователь '{username}' не найден")
@@ -166,8 +136,7 @@ def get_current_user():
 
 def load_portfolio(user_id):
     """Загружает портфель пользователя из JSON"""
-    portfolios = load_json_file(PORTFOLIOS_FILE)
-    portfolio_data = next((p for p in portfolios if p.get("user_id") == user_id), None)
+    portfolio_data = _portfolio_repository.load(user_id)
     
     if portfolio_data is None:
         return None
@@ -235,24 +204,51 @@ def show_portfolio(base_currency=None):
     return "\n".join(lines)
 
 
+def revalue_all_portfolios(base_currencies=None):
+    """Оценивает портфели всех пользователей в одной или нескольких базах"""
+    if not base_currencies:
+        base_currencies = [DEFAULT_BASE_CURRENCY]
+    
+    for code in base_currencies:
+        resolve_currency(code)
+    
+    from valutatrade_hub.parser_service.storage import get_rates_snapshot
+    rate_matrix = get_rates_snapshot().matrix
+    
+    engine = PortfolioValuationEngine.from_portfolios(_portfolio_repository.iter_portfolios())  # noqa: E501
+    return engine.revalue(rate_matrix, base_currencies)
+
+
 def save_portfolio(portfolio):
     """Сохраняет портфель в JSON (безопасная операция)"""
     try:
-        portfolios = load_json_file(PORTFOLIOS_FILE)
-        portfolio_dict = portfolio.to_dict()
-        
-        for i, p in enumerate(portfolios):
-            if p.get("user_id") == portfolio._user_id:
-                portfolios[i] = portfolio_dict
-                save_json_file(PORTFOLIOS_FILE, portfolios)
-                return
-        
-        portfolios.append(portfolio_dict)
-        save_json_file(PORTFOLIOS_FILE, portfolios)
+        _portfolio_repository.save(portfolio.to_dict())
+    except ValueError as e:
+        raise ValueError(f"Ошибка при сохранении портфеля: {e}")
+
+
+def record_trade(user_id, currency, delta, rate=None):
+    """Фиксирует сделку в журнале (одна запись вместо перезаписи портфеля)"""
+    try:
+        _portfolio_repository.record_trade(user_id, currency, delta, rate)
     except ValueError as e:
         raise ValueError(f"Ошибка при сохранении портфеля: {e}")
 
 
+def compact_trade_journal():
+    """Сворачивает журнал сделок в снимки портфелей"""
+    return _portfolio_repository.compact()
+
+
+def migrate_storage_to_sqlite():
+    """Переносит пользователей и портфели из JSON-файлов в SQLite"""
+    from valutatrade_hub.infra.sqlite_store import SqliteDatabase, migrate_from_json
+
+    json_users, json_portfolios = create_json_repositories()
+    database = SqliteDatabase(settings.get("sqlite_path", DATA_DIR / "valutatrade.db"))
+    return migrate_from_json(database, json_users, json_portfolios)
+
+
 @log_action("BUY", verbose=True)
 def buy_currency(currency, amount):
     """Покупает валюту"""
@@ -277,7 +273,7 @@ def buy_currency(currency, amount):
         raise ValueError("'amount' должен быть положительным числом")
     
     try:
-        get_currency(currency)
+        resolve_currency(currency)
     except CurrencyNotFoundError:
         raise
     
@@ -294,9 +290,9 @@ def buy_currency(currency, amount):
     wallet.deposit(amount)
     new_balance = wallet.balance
     
-    save_portfolio(portfolio)
-    
     currency_rate = get_rate_from_cache(currency, "USD")
+    record_trade(user.user_id, currency, amount, currency_rate)
+    
     if currency_rate is not None:
         cost_in_usd = amount * currency_rate
     else:
@@ -351,7 +347,7 @@ def sell_currency(currency, amount):
         raise ValueError("'amount' должен быть положительным числом")
     
     try:
-        get_currency(currency)
+        resolve_currency(currency)
     except CurrencyNotFoundError:
         raise
     
@@ -372,9 +368,9 @@ def sell_currency(currency, amount):
         raise
     new_balance = wallet.balance
     
-    save_portfolio(portfolio)
-    
     currency_rate = get_rate_from_cache(currency, "USD")
+    record_trade(user.user_id, currency, -amount, currency_rate)
+    
     if currency_rate is not None:
         revenue_in_usd = amount * currency_rate
     else:
@@ -405,63 +401,70 @@ def sell_currency(currency, amount):
     return "\n".join(result)
 
 
-def load_rates_cache():
-    """Загружает кеш курсов из JSON (безопасная операция)"""
-    try:
-        if not RATES_FILE.exists():
-            return {}
-        with open(RATES_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except (json.JSONDecodeError, IOError) as e:
-        raise ValueError(f"Ошибка при чтении кеша курсов: {e}")
-
-
-def save_rates_cache(rates_data):
-    """Сохраняет кеш курсов в JSON (безопасная операция)"""
-    try:
-        RATES_FILE.parent.mkdir(parents=True, exist_ok=True)
-        with open(RATES_FILE, "w", encoding="utf-8") as f:
-            json.dump(rates_data, f, indent=2)
-    except (IOError, OSError) as e:
-        raise ValueError(f"Ошибка при сохранении кеша курсов: {e}")
-
-
-def get_rate_from_api(from_currency, to_currency):
-    """Получает курс валюты из API (использует кеш rates.json)"""
-    try:
-        get_currency(from_currency)
-        get_currency(to_currency)
-    except CurrencyNotFoundError as e:
-        raise ApiRequestError(f"Валюта '{e.code}' не поддерживается")
-    
-    from_rate = get_rate_from_cache(from_currency, "USD")
-    to_rate = get_rate_from_cache(to_currency, "USD")
-    
-    if from_rate is None or to_rate is None:
-        raise ApiRequestError(f"Курс {from_currency}→{to_currency} недоступен в кеше")
+def format_age(seconds):
+    """Форматирует возраст курса: «40 с», «12 мин», «3 ч 5 мин», «2 дн»"""
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds} с"
+    if seconds < 3600:
+        return f"{seconds // 60} мин"
+    if seconds < 86400:
+        return f"{seconds // 3600} ч {seconds % 3600 // 60} мин"
+    return f"{seconds // 86400} дн"
+
+
+def get_rate_quote(from_currency, to_currency):
+    """
+    Возвращает курс из кеша с его возрастом (stale-while-revalidate).
+
+    Последний известный курс отдаётся сразу. Если он старше TTL своего
+    источника (ParserConfig.SOURCE_TTLS, иначе rates_ttl_seconds),
+    обновление источников запускается в фоновом потоке, и ответ
+    помечается как устаревший — время ответа не зависит от скорости
+    провайдера.
+    """
+    from valutatrade_hub.parser_service.storage import (
+        cache_age_seconds,
+        get_rates_snapshot,
+    )
+    from valutatrade_hub.parser_service.updater import (
+        refresh_sources_async,
+        source_for_currency,
+        source_ttl,
+    )
     
-    if to_currency == "USD":
-        return from_rate
-    elif from_currency == "USD":
-        return 1.0 / to_rate
-    else:
-        return to_rate / from_rate
-
-
-def is_rate_fresh(timestamp_str, max_age_seconds=None):
-    """Проверяет, свежий ли курс (моложе max_age_seconds секунд)"""
-    if max_age_seconds is None:
-        max_age_seconds = RATES_TTL_SECONDS
     try:
-        timestamp = datetime.fromisoformat(timestamp_str)
-        age = datetime.now() - timestamp
-        return age.total_seconds() < max_age_seconds
-    except (ValueError, TypeError):
-        return False
+        quote = get_rates_snapshot().get_quote(from_currency, to_currency)
+    except ValueError:
+        quote = None
+    
+    if quote is None:
+        refreshing = refresh_sources_async(
+            source_for_currency(code) for code in (from_currency, to_currency)
+        )
+        message = f"Курс {from_currency}→{to_currency} недоступен в кеше"
+        if refreshing:
+            message += "; обновление запущено в фоне, повторите запрос позже"
+        raise ApiRequestError(message)
+    
+    ttl = min(
+        (source_ttl(source, RATES_TTL_SECONDS) for source in quote["sources"]),
+        default=RATES_TTL_SECONDS,
+    )
+    age = cache_age_seconds(quote["updated_at"])
+    stale = age is None or age >= ttl
+    
+    return {
+        **quote,
+        "ttl": ttl,
+        "age": age,
+        "stale": stale,
+        "refreshing": refresh_sources_async(quote["sources"]) if stale else [],
+    }
 
 
-def get_rate(from_currency, to_currency):
-    """Получает курс одной валюты к другой"""
+def _validate_rate_pair(from_currency, to_currency):
+    """Проверяет коды валют пары и возвращает их без пробелов"""
     if not from_currency or not from_currency.strip():
         raise ValueError("Код исходной валюты не может быть пустым")
     
@@ -478,61 +481,64 @@ def get_rate(from_currency, to_currency):
         raise ValueError("Код целевой валюты должен состоять из прописных букв")
     
     try:
-        get_currency(from_currency)
-        get_currency(to_currency)
+        resolve_currency(from_currency)
+        resolve_currency(to_currency)
     except CurrencyNotFoundError:
         raise
     
-    if from_currency == to_currency:
-        return f"Курс {from_currency}→{to_currency}: 1.0 (одинаковые валюты)"
-    
-    cache_key = f"{from_currency}_{to_currency}"
-    
-    try:
-        rates_cache = load_rates_cache()
-    except ValueError:
-        rates_cache = {}
-    
-    cached_rate = rates_cache.get(cache_key)
+    return from_currency, to_currency
+
+
+def get_rates_as_of(from_currency, to_currency, moments):
+    """
+    Курсы пары на множество моментов по истории (временным рядам).
+
+    Для каждого момента берётся последний известный до него курс; пары без
+    своего ряда считаются кросс-курсом через базовую валюту. Все моменты
+    обрабатываются одним проходом по рядам. Возвращает список словарей
+    {at, rate, timestamp, sources, via} (None — курса на момент нет).
+    """
+    from valutatrade_hub.parser_service.timeseries import rates_as_of
     
-    if cached_rate and is_rate_fresh(cached_rate.get("timestamp"), RATES_TTL_SECONDS):
-        rate = cached_rate.get("rate")
-        timestamp_str = cached_rate.get("timestamp")
-        timestamp = datetime.fromisoformat(timestamp_str)
-        timestamp_formatted = timestamp.strftime("%Y-%m-%d %H:%M:%S")
-        
-        reverse_rate = 1.0 / rate
-        
-        result = [
-            f"Курс {from_currency}→{to_currency}: {rate:.8f} "
-            f"(обновлено: {timestamp_formatted})",
-            f"Обратный курс {to_currency}→{from_currency}: {reverse_rate:.2f}"
-        ]
-        return "\n".join(result)
+    from_currency, to_currency = _validate_rate_pair(from_currency, to_currency)
+    return rates_as_of(from_currency, to_currency, list(moments))
+
+
+def get_rate_as_of(from_currency, to_currency, at):
+    """Курс пары на момент at (ISO-время или длительность назад, например 7d)"""
+    quote = get_rates_as_of(from_currency, to_currency, [at])[0]
+    if quote is None:
+        raise ValueError(f"В истории нет курса {from_currency}→{to_currency} на момент {at}")  # noqa: E501
+    return quote
+
+
+def get_rate(from_currency, to_currency):
+    """Получает курс одной валюты к другой"""
+    from_currency, to_currency = _validate_rate_pair(from_currency, to_currency)
     
-    try:
-        rate = get_rate_from_api(from_currency, to_currency)
-    except ApiRequestError:
-        raise
+    if from_currency == to_currency:
+        return f"Курс {from_currency}→{to_currency}: 1.0 (одинаковые валюты)"
     
-    timestamp = datetime.now()
-    timestamp_str = timestamp.isoformat()
-    timestamp_formatted = timestamp.strftime("%Y-%m-%d %H:%M:%S")
+    quote = get_rate_quote(from_currency, to_currency)
+    rate = quote["rate"]
     
+    updated_at = quote["updated_at"]
     try:
-        rates_cache[cache_key] = {
-            "rate": rate,
-            "timestamp": timestamp_str
-        }
-        save_rates_cache(rates_cache)
-    except ValueError:
-        pass
-    
-    reverse_rate = 1.0 / rate
+        updated_formatted = datetime.fromisoformat(updated_at.rstrip("Z")).strftime("%Y-%m-%d %H:%M:%S UTC")  # noqa: E501
+    except (AttributeError, ValueError):
+        updated_formatted = "неизвестно"
     
     result = [
         f"Курс {from_currency}→{to_currency}: {rate:.8f} "
-        f"(обновлено: {timestamp_formatted})",
-        f"Обратный курс {to_currency}→{from_currency}: {reverse_rate:.2f}"
+        f"(обновлено: {updated_formatted})",
+        f"Обратный курс {to_currency}→{from_currency}: {1.0 / rate:.2f}"
     ]
+    
+    if quote["stale"]:
+        age = format_age(quote["age"]) if quote["age"] is not None else "неизвестно"
+        warning = f"Внимание: курс устарел (возраст {age})"
+        if quote["refreshing"]:
+            warning += "; обновление запущено в фоне"
+        result.append(warning)
+    
     return "\n".join(result)
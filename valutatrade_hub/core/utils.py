@@ -0,0 +1,74 @@
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка между процессами недоступна
+    fcntl = None
+
+
+def file_signature(file_path):
+    """Возвращает (mtime_ns, size) файла или None, если файла нет"""
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def write_json_atomic(file_path, data, indent=2):
+    """Атомарно записывает JSON через временный файл и замену"""
+    file_path = Path(file_path)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with tempfile.NamedTemporaryFile(mode="w", delete=False, encoding="utf-8", dir=file_path.parent) as tmp:  # noqa: E501
+        json.dump(data, tmp, indent=indent, ensure_ascii=False)
+        tmp_path = tmp.name
+
+    Path(tmp_path).replace(file_path)
+
+
+@contextmanager
+def file_lock(file_path):
+    """Межпроцессная блокировка файла через соседний файл <имя>.lock (flock)"""
+    file_path = Path(file_path)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    lock_path = file_path.with_name(file_path.name + ".lock")
+
+    with open(lock_path, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+@contextmanager
+def locked_json_state(file_path, default=None, strict=False):
+    """
+    Читает JSON-состояние под межпроцессной блокировкой и сохраняет его.
+
+    Блокировка берётся через file_lock(), поэтому несколько процессов не
+    перетирают изменения друг друга. Изменённый внутри блока словарь
+    атомарно записывается при выходе. Повреждённый файл считается пустым
+    состоянием, а при strict — ошибкой (ValueError), и файл не меняется.
+    """
+    with file_lock(file_path):
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = {} if default is None else default
+        except ValueError as e:
+            if strict:
+                raise ValueError(f"Ошибка при чтении файла {file_path}: {e}")
+            state = {} if default is None else default
+
+        yield state
+
+        write_json_atomic(file_path, state)
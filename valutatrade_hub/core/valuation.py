@@ -0,0 +1,67 @@
+from array import array
+from operator import mul
+
+
+class PortfolioValuationEngine:
+    """
+    Пакетная оценка всех портфелей.
+
+    Балансы упаковываются в матрицу пользователи × валюты (array('d'),
+    построчно), а оценка в базовой валюте — произведение этой матрицы на
+    вектор курсов валют к базе. Так N портфелей оцениваются за один проход
+    без обращений к кешу курсов на каждый кошелёк.
+    """
+
+    def __init__(self, user_ids, currencies, balances):
+        """Инициализация (balances — array('d') длины len(user_ids) * len(currencies))"""  # noqa: E501
+        self.user_ids = list(user_ids)
+        self.currencies = list(currencies)
+        self._balances = balances
+
+    @classmethod
+    def from_portfolios(cls, portfolios):
+        """Упаковывает словари портфелей (формат Portfolio.to_dict) в матрицу"""
+        portfolios = list(portfolios)
+        currencies = sorted({code for p in portfolios for code in p.get("wallets", {})})
+        column = {code: j for j, code in enumerate(currencies)}
+        width = len(currencies)
+
+        balances = array("d", bytes(8 * width * len(portfolios)))
+        user_ids = []
+        for i, portfolio in enumerate(portfolios):
+            user_ids.append(portfolio["user_id"])
+            for code, wallet in portfolio.get("wallets", {}).items():
+                balances[i * width + column[code]] = wallet.get("balance", 0.0)
+
+        return cls(user_ids, currencies, balances)
+
+    def rate_vector(self, rate_matrix, base_currency):
+        """Строит вектор курсов валют портфелей к базе и список валют без курса"""
+        vector = array("d")
+        missing = []
+        for code in self.currencies:
+            rate = rate_matrix.rate(code, base_currency)
+            if rate is None:
+                missing.append(code)
+                rate = 0.0
+            vector.append(rate)
+        return vector, missing
+
+    def revalue(self, rate_matrix, base_currencies=("USD",)):
+        """Возвращает {база: {"totals": {user_id: стоимость}, "missing": [...]}}"""
+        width = len(self.currencies)
+        result = {}
+
+        for base_currency in base_currencies:
+            if base_currency not in rate_matrix:
+                raise ValueError(f"Курс для базовой валюты '{base_currency}' не найден в кеше")  # noqa: E501
+
+            vector, missing = self.rate_vector(rate_matrix, base_currency)
+            totals = {}
+            for i, user_id in enumerate(self.user_ids):
+                row = self._balances[i * width:(i + 1) * width]
+                totals[user_id] = sum(map(mul, row, vector))
+
+            result[base_currency] = {"totals": totals, "missing": missing}
+
+        return result
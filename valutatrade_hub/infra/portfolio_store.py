@@ -0,0 +1,137 @@
+import json
+from pathlib import Path
+
+from valutatrade_hub.core.utils import file_signature, write_json_atomic
+from valutatrade_hub.infra.repositories import PortfolioRepository
+from valutatrade_hub.infra.trade_journal import apply_entries
+
+
+class PortfolioStore(PortfolioRepository):
+    """
+    Хранилище портфелей с отдельным файлом на пользователя.
+
+    Каждый портфель лежит в <portfolios_dir>/<user_id>.json, поэтому
+    чтение и запись затрагивают только данные одного пользователя.
+    Старый общий portfolios.json используется только для чтения: если
+    у пользователя ещё нет своего файла, портфель берётся оттуда и при
+    первом сохранении переезжает в отдельный файл.
+
+    Если передан журнал сделок, файл пользователя служит снимком:
+    сделки дописываются в журнал, при чтении поверх снимка применяются
+    записи с номером больше его journal_seq, а compact() сворачивает
+    журнал в снимки.
+    """
+
+    def __init__(self, portfolios_dir, legacy_file=None, journal=None, compact_threshold=1000):  # noqa: E501
+        """Инициализация хранилища"""
+        self._dir = Path(portfolios_dir)
+        self._legacy_file = Path(legacy_file) if legacy_file else None
+        self._legacy_index = {}
+        self._legacy_signature = None
+        self._journal = journal
+        self._compact_threshold = compact_threshold
+
+    def _shard_path(self, user_id):
+        """Возвращает путь к файлу портфеля пользователя"""
+        return self._dir / f"{int(user_id)}.json"
+
+    def _legacy_portfolios(self):
+        """Возвращает индекс user_id → портфель из общего portfolios.json"""
+        if self._legacy_file is None:
+            return {}
+
+        signature = file_signature(self._legacy_file)
+        if signature is None:
+            return {}
+
+        if signature != self._legacy_signature:
+            try:
+                with open(self._legacy_file, "r", encoding="utf-8") as f:
+                    portfolios = json.load(f)
+            except (json.JSONDecodeError, IOError) as e:
+                raise ValueError(f"Ошибка при чтении файла {self._legacy_file}: {e}")
+            self._legacy_index = {p.get("user_id"): p for p in portfolios}
+            self._legacy_signature = signature
+
+        return self._legacy_index
+
+    def _load_snapshot(self, user_id):
+        """Загружает снимок портфеля пользователя или None"""
+        shard_path = self._shard_path(user_id)
+        try:
+            with open(shard_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return self._legacy_portfolios().get(user_id)
+        except (json.JSONDecodeError, IOError) as e:
+            raise ValueError(f"Ошибка при чтении файла {shard_path}: {e}")
+
+    def load(self, user_id):
+        """Загружает словарь портфеля пользователя (с учётом журнала) или None"""
+        portfolio_data = self._load_snapshot(user_id)
+        if self._journal is None:
+            return portfolio_data
+
+        after_seq = portfolio_data.get("journal_seq", 0) if portfolio_data else 0
+        entries = self._journal.entries_for(user_id, after_seq=after_seq)
+        if not entries:
+            return portfolio_data
+
+        if portfolio_data is None:
+            portfolio_data = {"user_id": user_id, "wallets": {}}
+        return apply_entries(portfolio_data, entries)
+
+    def save(self, portfolio_data):
+        """Сохраняет словарь портфеля (перезаписывается только файл пользователя)"""
+        if self._journal is not None:
+            portfolio_data = dict(portfolio_data, journal_seq=self._journal.last_seq)
+        self._write_snapshot(portfolio_data)
+
+    def _write_snapshot(self, portfolio_data):
+        """Записывает снимок портфеля в файл пользователя"""
+        shard_path = self._shard_path(portfolio_data["user_id"])
+        try:
+            write_json_atomic(shard_path, portfolio_data)
+        except (IOError, OSError) as e:
+            raise ValueError(f"Ошибка при записи файла {shard_path}: {e}")
+
+    def record_trade(self, user_id, currency, delta, rate=None):
+        """Фиксирует изменение баланса одной записью журнала"""
+        if self._journal is None:
+            portfolio_data = self.load(user_id) or {"user_id": user_id, "wallets": {}}
+            self.save(apply_entries(portfolio_data, [{"currency": currency, "delta": delta}]))  # noqa: E501
+            return
+
+        self._journal.append(user_id, currency, delta, rate)
+        if self._journal.pending_count >= self._compact_threshold:
+            self.compact()
+
+    def compact(self):
+        """Сворачивает журнал сделок в снимки портфелей и очищает его"""
+        if self._journal is None:
+            return 0
+
+        # Другие процессы не дописывают сделки, пока журнал свёртывается
+        with self._journal.locked():
+            last_seq = self._journal.last_seq
+            user_ids = self._journal.user_ids()
+            for user_id in user_ids:
+                portfolio_data = self.load(user_id)
+                self._write_snapshot(dict(portfolio_data, journal_seq=last_seq))
+
+            self._journal.reset(last_seq)
+        return len(user_ids)
+
+    def iter_portfolios(self):
+        """Перечисляет словари всех портфелей (снимки с учётом журнала)"""
+        user_ids = set()
+        if self._dir.exists():
+            user_ids.update(int(p.stem) for p in self._dir.glob("*.json") if p.stem.isdigit())  # noqa: E501
+        user_ids.update(self._legacy_portfolios())
+        if self._journal is not None:
+            user_ids.update(self._journal.user_ids())
+
+        for user_id in sorted(user_ids):
+            portfolio_data = self.load(user_id)
+            if portfolio_data is not None:
+                yield portfolio_data
@@ -0,0 +1,122 @@
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from valutatrade_hub.core.settings import settings
+
+
+class UserRepository(ABC):
+    """Абстрактный репозиторий пользователей (записи в формате User.to_dict)"""
+
+    @abstractmethod
+    def get(self, username):
+        """Возвращает запись пользователя по имени или None"""
+        pass
+
+    @abstractmethod
+    def is_taken(self, username):
+        """Проверяет, занято ли имя пользователя"""
+        pass
+
+    @abstractmethod
+    def next_id(self):
+        """Возвращает следующий свободный user_id"""
+        pass
+
+    @abstractmethod
+    def add(self, record):
+        """Добавляет запись пользователя"""
+        pass
+
+    @abstractmethod
+    def iter_records(self):
+        """Перечисляет записи всех пользователей"""
+        pass
+
+    def add_with_portfolio(self, record, portfolio_data, portfolio_repository):
+        """
+        Добавляет пользователя вместе с его портфелем.
+
+        По умолчанию портфель сохраняется первым: если запись пользователя
+        не удалась, не остаётся пользователя без портфеля. Хранилища с
+        транзакциями переопределяют метод и пишут обе записи сразу.
+        Возвращает user_id, под которым сохранён пользователь.
+        """
+        portfolio_repository.save(portfolio_data)
+        self.add(record)
+        return record["user_id"]
+
+
+class PortfolioRepository(ABC):
+    """Абстрактный репозиторий портфелей (словари в формате Portfolio.to_dict)"""
+
+    @abstractmethod
+    def load(self, user_id):
+        """Загружает словарь портфеля пользователя или None"""
+        pass
+
+    @abstractmethod
+    def save(self, portfolio_data):
+        """Сохраняет словарь портфеля целиком"""
+        pass
+
+    @abstractmethod
+    def record_trade(self, user_id, currency, delta, rate=None):
+        """Изменяет баланс одного кошелька на delta"""
+        pass
+
+    @abstractmethod
+    def compact(self):
+        """Обслуживание хранилища; возвращает число затронутых портфелей"""
+        pass
+
+    @abstractmethod
+    def iter_portfolios(self):
+        """Перечисляет словари всех портфелей"""
+        pass
+
+
+def create_json_repositories():
+    """Создаёт репозитории поверх JSON-файлов"""
+    from valutatrade_hub.infra.portfolio_store import PortfolioStore
+    from valutatrade_hub.infra.trade_journal import TradeJournal
+    from valutatrade_hub.infra.user_store import UserStore
+
+    data_dir = Path(settings.get("data_dir", "data"))
+    users_file = Path(settings.get("users_file", data_dir / "users.json"))
+    portfolios_file = Path(settings.get("portfolios_file", data_dir / "portfolios.json"))  # noqa: E501
+    portfolios_dir = Path(settings.get("portfolios_dir", data_dir / "portfolios"))
+    journal_file = Path(settings.get("trades_journal_file", data_dir / "trades.jsonl"))  # noqa: E501
+
+    user_repository = UserStore(users_file)
+    portfolio_repository = PortfolioStore(
+        portfolios_dir,
+        legacy_file=portfolios_file,
+        journal=TradeJournal(journal_file),
+        compact_threshold=settings.get("journal_compact_threshold", 1000),
+    )
+    return user_repository, portfolio_repository
+
+
+def create_sqlite_repositories():
+    """Создаёт репозитории поверх SQLite"""
+    from valutatrade_hub.infra.sqlite_store import (
+        SqliteDatabase,
+        SqlitePortfolioRepository,
+        SqliteUserRepository,
+    )
+
+    data_dir = Path(settings.get("data_dir", "data"))
+    database = SqliteDatabase(settings.get("sqlite_path", data_dir / "valutatrade.db"))
+    return SqliteUserRepository(database), SqlitePortfolioRepository(database)
+
+
+def create_repositories(backend=None):
+    """Создаёт пару (пользователи, портфели) для бэкенда из настроек"""
+    if backend is None:
+        backend = settings.get("storage_backend", "json")
+
+    if backend == "json":
+        return create_json_repositories()
+    if backend == "sqlite":
+        return create_sqlite_repositories()
+    raise ValueError(f"Неизвестный бэкенд хранилища '{backend}'. Используйте 'json' или 'sqlite'")  # noqa: E501
@@ -0,0 +1,264 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from valutatrade_hub.infra.repositories import PortfolioRepository, UserRepository
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL,
+    hashed_password TEXT NOT NULL,
+    salt TEXT NOT NULL,
+    registration_date TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users (username);
+
+CREATE TABLE IF NOT EXISTS portfolios (
+    user_id INTEGER PRIMARY KEY
+);
+
+CREATE TABLE IF NOT EXISTS wallets (
+    user_id INTEGER NOT NULL,
+    currency TEXT NOT NULL,
+    balance REAL NOT NULL CHECK (balance >= 0)
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_wallets_user_currency
+    ON wallets (user_id, currency);
+
+CREATE TABLE IF NOT EXISTS trades (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    currency TEXT NOT NULL,
+    delta REAL NOT NULL,
+    rate REAL,
+    timestamp TEXT NOT NULL
+);
+"""
+
+
+class SqliteDatabase:
+    """Подключение к SQLite в режиме WAL (отдельное соединение на поток)"""
+
+    def __init__(self, db_path):
+        """Инициализация (файл базы и схема создаются при первом обращении)"""
+        self._db_path = Path(db_path)
+        self._local = threading.local()
+
+    def connection(self):
+        """Возвращает соединение текущего потока"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            try:
+                self._db_path.parent.mkdir(parents=True, exist_ok=True)
+                conn = sqlite3.connect(self._db_path, timeout=10)
+                conn.row_factory = sqlite3.Row
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.executescript(SCHEMA)
+            except sqlite3.Error as e:
+                raise ValueError(f"Ошибка при открытии базы {self._db_path}: {e}")
+            self._local.conn = conn
+        return conn
+
+    def read(self, query, params=()):
+        """Выполняет запрос на чтение и возвращает все строки"""
+        try:
+            return self.connection().execute(query, params).fetchall()
+        except sqlite3.Error as e:
+            raise ValueError(f"Ошибка при чтении из базы {self._db_path}: {e}")
+
+    def write(self, statements):
+        """Выполняет список (query, params) одной транзакцией"""
+        conn = self.connection()
+        try:
+            with conn:
+                for query, params in statements:
+                    conn.execute(query, params)
+        except sqlite3.Error as e:
+            raise ValueError(f"Ошибка при записи в базу {self._db_path}: {e}")
+
+    @contextmanager
+    def transaction(self):
+        """
+        Транзакция BEGIN IMMEDIATE: блокировка записи берётся сразу.
+
+        Чтения внутри блока видят состояние, которое не изменится до
+        фиксации, поэтому значения (например, следующий user_id) можно
+        вычислять и записывать без гонки с другими процессами.
+        """
+        conn = self.connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+        except sqlite3.Error as e:
+            raise ValueError(f"Ошибка при записи в базу {self._db_path}: {e}")
+
+
+class SqliteUserRepository(UserRepository):
+    """Репозиторий пользователей в SQLite"""
+
+    def __init__(self, database):
+        """Инициализация репозитория"""
+        self._db = database
+
+    def get(self, username):
+        """Возвращает запись пользователя по имени или None"""
+        rows = self._db.read("SELECT * FROM users WHERE username = ?", (username,))
+        return dict(rows[0]) if rows else None
+
+    def is_taken(self, username):
+        """Проверяет, занято ли имя пользователя"""
+        rows = self._db.read("SELECT 1 FROM users WHERE username = ?", (username,))
+        return bool(rows)
+
+    def next_id(self):
+        """Возвращает следующий свободный user_id"""
+        rows = self._db.read("SELECT COALESCE(MAX(user_id), 0) + 1 FROM users")
+        return rows[0][0]
+
+    def add(self, record):
+        """Добавляет запись пользователя"""
+        if self.is_taken(record["username"]):
+            raise ValueError(f"Имя пользователя '{record['username']}' уже занято")
+        self._db.write([_insert_user(record)])
+
+    def add_with_portfolio(self, record, portfolio_data, portfolio_repository):
+        """
+        Добавляет пользователя и его портфель одной транзакцией.
+
+        user_id выделяется внутри той же транзакции, поэтому параллельные
+        регистрации не получают один id; возвращает выделенный user_id.
+        """
+        with self._db.transaction() as conn:
+            if conn.execute("SELECT 1 FROM users WHERE username = ?", (record["username"],)).fetchone():  # noqa: E501
+                raise ValueError(f"Имя пользователя '{record['username']}' уже занято")
+            user_id = conn.execute("SELECT COALESCE(MAX(user_id), 0) + 1 FROM users").fetchone()[0]  # noqa: E501
+            statements = [
+                _insert_user({**record, "user_id": user_id}),
+                *_replace_portfolio({**portfolio_data, "user_id": user_id}),
+            ]
+            for query, params in statements:
+                conn.execute(query, params)
+        return user_id
+
+    def iter_records(self):
+        """Перечисляет записи всех пользователей"""
+        for row in self._db.read("SELECT * FROM users ORDER BY user_id"):
+            yield dict(row)
+
+
+class SqlitePortfolioRepository(PortfolioRepository):
+    """Репозиторий портфелей в SQLite (кошельки — строки таблицы wallets)"""
+
+    def __init__(self, database):
+        """Инициализация репозитория"""
+        self._db = database
+
+    def load(self, user_id):
+        """Загружает словарь портфеля пользователя или None"""
+        if not self._db.read("SELECT 1 FROM portfolios WHERE user_id = ?", (user_id,)):
+            return None
+
+        rows = self._db.read(
+            "SELECT currency, balance FROM wallets WHERE user_id = ? ORDER BY rowid",
+            (user_id,),
+        )
+        wallets = {row["currency"]: {"balance": row["balance"]} for row in rows}
+        return {"user_id": user_id, "wallets": wallets}
+
+    def save(self, portfolio_data):
+        """Сохраняет словарь портфеля целиком одной транзакцией"""
+        self._db.write(_replace_portfolio(portfolio_data))
+
+    def record_trade(self, user_id, currency, delta, rate=None):
+        """Изменяет баланс кошелька и пишет сделку одной транзакцией"""
+        self._db.write([
+            ("INSERT OR IGNORE INTO portfolios (user_id) VALUES (?)", (user_id,)),
+            (
+                "INSERT OR IGNORE INTO wallets (user_id, currency, balance) "
+                "VALUES (?, ?, 0)",
+                (user_id, currency),
+            ),
+            (
+                "UPDATE wallets SET balance = balance + ? "
+                "WHERE user_id = ? AND currency = ?",
+                (delta, user_id, currency),
+            ),
+            (
+                "INSERT INTO trades (user_id, currency, delta, rate, timestamp) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (user_id, currency, delta, rate, datetime.now().isoformat()),
+            ),
+        ])
+
+    def compact(self):
+        """Переносит WAL в основной файл базы"""
+        self._db.read("PRAGMA wal_checkpoint(TRUNCATE)")
+        return 0
+
+    def iter_portfolios(self):
+        """Перечисляет словари всех портфелей"""
+        portfolios = {}
+        for row in self._db.read("SELECT user_id FROM portfolios ORDER BY user_id"):
+            portfolios[row["user_id"]] = {"user_id": row["user_id"], "wallets": {}}
+
+        for row in self._db.read("SELECT user_id, currency, balance FROM wallets ORDER BY rowid"):  # noqa: E501
+            portfolio = portfolios.get(row["user_id"])
+            if portfolio is not None:
+                portfolio["wallets"][row["currency"]] = {"balance": row["balance"]}
+
+        yield from portfolios.values()
+
+
+def _insert_user(record, replace=False):
+    """Строит запрос на вставку пользователя (replace — с заменой записи)"""
+    return (
+        f"INSERT {'OR REPLACE ' if replace else ''}INTO users "
+        "(user_id, username, hashed_password, salt, registration_date) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (
+            record["user_id"],
+            record["username"],
+            record["hashed_password"],
+            record["salt"],
+            record["registration_date"],
+        ),
+    )
+
+
+def _replace_portfolio(portfolio_data):
+    """Строит запросы, заменяющие портфель и его кошельки"""
+    user_id = portfolio_data["user_id"]
+    statements = [
+        ("INSERT OR IGNORE INTO portfolios (user_id) VALUES (?)", (user_id,)),
+        ("DELETE FROM wallets WHERE user_id = ?", (user_id,)),
+    ]
+    for currency, wallet in portfolio_data.get("wallets", {}).items():
+        statements.append((
+            "INSERT INTO wallets (user_id, currency, balance) VALUES (?, ?, ?)",
+            (user_id, currency, wallet.get("balance", 0.0)),
+        ))
+    return statements
+
+
+def migrate_from_json(database, user_repository, portfolio_repository):
+    """Однократно переносит пользователей и портфели из JSON в SQLite"""
+    # Повторный перенос перезаписывает уже перенесённых пользователей
+    statements = [_insert_user(record, replace=True) for record in user_repository.iter_records()]  # noqa: E501
+    users_count = len(statements)
+
+    portfolios_count = 0
+    for portfolio_data in portfolio_repository.iter_portfolios():
+        statements.extend(_replace_portfolio(portfolio_data))
+        portfolios_count += 1
+
+    database.write(statements)
+    return users_count, portfolios_count
@@ -0,0 +1,170 @@
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+from valutatrade_hub.core.utils import file_lock
+
+
+class TradeJournal:
+    """
+    Append-only журнал сделок в формате JSON Lines.
+
+    Каждая сделка — одна строка {seq, user_id, currency, delta, rate,
+    timestamp}, записанная с fsync. После компакции файл заменяется
+    одной строкой-заголовком {"snapshot_seq": N}, чтобы нумерация
+    продолжалась с N + 1. Запись и компакция идут под межпроцессной
+    блокировкой журнала (locked()), поэтому номера не повторяются, а
+    сделки не теряются при замене файла. Журнал читается инкрементально: при каждом
+    обращении дочитываются только байты, дописанные после прошлого чтения.
+    """
+
+    def __init__(self, file_path):
+        """Инициализация журнала (файл читается лениво)"""
+        self._file_path = Path(file_path)
+        self._reset_state()
+
+    def _reset_state(self):
+        """Сбрасывает прочитанное состояние журнала"""
+        self._inode = None
+        self._head = b""
+        self._offset = 0
+        self._last_seq = 0
+        self._by_user = {}
+        self._count = 0
+
+    @property
+    def last_seq(self):
+        """Номер последней записи журнала"""
+        self._sync()
+        return self._last_seq
+
+    @property
+    def pending_count(self):
+        """Количество сделок, ещё не свёрнутых в снимок"""
+        self._sync()
+        return self._count
+
+    def _sync(self):
+        """Дочитывает новые записи (или перечитывает файл после компакции)"""
+        try:
+            with open(self._file_path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                # После компакции файл новый, но его inode может совпасть
+                # с прежним, поэтому замена проверяется и по первой строке
+                if (
+                    stat.st_ino != self._inode
+                    or stat.st_size < self._offset
+                    or f.read(len(self._head)) != self._head
+                ):
+                    self._reset_state()
+                    self._inode = stat.st_ino
+
+                if stat.st_size == self._offset:
+                    return
+                f.seek(self._offset)
+                chunk = f.read(stat.st_size - self._offset)
+        except FileNotFoundError:
+            self._reset_state()
+            return
+        except (IOError, OSError) as e:
+            raise ValueError(f"Ошибка при чтении журнала {self._file_path}: {e}")
+
+        # Неполная последняя строка (запись оборвалась) не учитывается
+        complete = chunk.rfind(b"\n") + 1
+        if self._offset == 0:
+            self._head = chunk[:chunk.find(b"\n") + 1]
+        self._offset += complete
+
+        for line in chunk[:complete].splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            self._apply(entry)
+
+    def _apply(self, entry):
+        """Учитывает прочитанную запись в индексе по пользователям"""
+        if "snapshot_seq" in entry:
+            self._last_seq = max(self._last_seq, entry["snapshot_seq"])
+            return
+
+        self._last_seq = max(self._last_seq, entry["seq"])
+        self._by_user.setdefault(entry["user_id"], []).append(entry)
+        self._count += 1
+
+    def locked(self):
+        """Межпроцессная блокировка журнала (не реентерабельна)"""
+        return file_lock(self._file_path)
+
+    def append(self, user_id, currency, delta, rate=None):
+        """Дописывает сделку в журнал с fsync и возвращает запись"""
+        with self.locked():
+            return self._append(user_id, currency, delta, rate)
+
+    def _append(self, user_id, currency, delta, rate):
+        """Дописывает сделку; вызывается под блокировкой журнала"""
+        self._sync()
+
+        entry = {
+            "seq": self._last_seq + 1,
+            "user_id": user_id,
+            "currency": currency,
+            "delta": delta,
+            "rate": rate,
+            "timestamp": datetime.now().isoformat(),
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+
+        try:
+            self._file_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self._file_path, "ab") as f:
+                # Отделяем оборванный хвост прошлой записи, если он есть
+                if f.tell() > self._offset:
+                    line = "\n" + line
+                f.write(line.encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+        except (IOError, OSError) as e:
+            raise ValueError(f"Ошибка при записи в журнал {self._file_path}: {e}")
+
+        self._sync()
+        return entry
+
+    def entries_for(self, user_id, after_seq=0):
+        """Возвращает сделки пользователя с номером больше after_seq"""
+        self._sync()
+        return [e for e in self._by_user.get(user_id, []) if e["seq"] > after_seq]
+
+    def user_ids(self):
+        """Возвращает пользователей, у которых есть несвёрнутые сделки"""
+        self._sync()
+        return list(self._by_user)
+
+    def reset(self, snapshot_seq):
+        """
+        Заменяет журнал заголовком после того, как сделки свёрнуты в снимки.
+
+        Вызывается под locked(): иначе сделка, дописанная другим процессом
+        после свёртки, пропадёт вместе со старым файлом.
+        """
+        tmp_path = self._file_path.with_name(self._file_path.name + ".tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(json.dumps({"snapshot_seq": snapshot_seq}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            tmp_path.replace(self._file_path)
+        except (IOError, OSError) as e:
+            raise ValueError(f"Ошибка при компакции журнала {self._file_path}: {e}")
+
+        self._reset_state()
+
+
+def apply_entries(portfolio_data, entries):
+    """Применяет сделки журнала к словарю портфеля"""
+    wallets = {code: dict(wallet) for code, wallet in portfolio_data.get("wallets", {}).items()}  # noqa: E501
+    for entry in entries:
+        wallet = wallets.setdefault(entry["currency"], {"balance": 0.0})
+        wallet["balance"] = wallet.get("balance", 0.0) + entry["delta"]
+    return dict(portfolio_data, wallets=wallets)
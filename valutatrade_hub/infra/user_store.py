@@ -0,0 +1,83 @@
+import json
+from pathlib import Path
+
+from valutatrade_hub.core.utils import file_signature, write_json_atomic
+from valutatrade_hub.infra.repositories import UserRepository
+
+
+class UserStore(UserRepository):
+    """
+    Хранилище пользователей поверх users.json.
+
+    Файл читается один раз и держится в памяти вместе с индексом
+    username → запись и следующим свободным user_id. Повторное чтение
+    происходит, только если файл изменился (mtime/размер), поэтому поиск,
+    проверка имени и выдача ID работают за O(1).
+    """
+
+    def __init__(self, file_path):
+        """Инициализация хранилища (файл читается лениво)"""
+        self._file_path = Path(file_path)
+        self._records = []
+        self._index = {}
+        self._next_id = 1
+        self._signature = None
+
+    def _refresh(self):
+        """Перечитывает файл, если он изменился с момента последней загрузки"""
+        signature = file_signature(self._file_path)
+        if signature is not None and signature == self._signature:
+            return
+
+        records = []
+        if signature is not None:
+            try:
+                with open(self._file_path, "r", encoding="utf-8") as f:
+                    records = json.load(f)
+            except (json.JSONDecodeError, IOError) as e:
+                raise ValueError(f"Ошибка при чтении файла {self._file_path}: {e}")
+
+        self._records = records
+        self._index = {record.get("username"): record for record in records}
+        max_id = max((record.get("user_id", 0) for record in records), default=0)
+        self._next_id = max_id + 1
+        self._signature = signature
+
+    def get(self, username):
+        """Возвращает запись пользователя по имени или None"""
+        self._refresh()
+        return self._index.get(username)
+
+    def is_taken(self, username):
+        """Проверяет, занято ли имя пользователя"""
+        self._refresh()
+        return username in self._index
+
+    def next_id(self):
+        """Возвращает следующий свободный user_id"""
+        self._refresh()
+        return self._next_id
+
+    def add(self, record):
+        """Добавляет запись пользователя (одна запись файла)"""
+        self._refresh()
+
+        username = record["username"]
+        if username in self._index:
+            raise ValueError(f"Имя пользователя '{username}' уже занято")
+
+        records = self._records + [record]
+        try:
+            write_json_atomic(self._file_path, records)
+        except (IOError, OSError) as e:
+            raise ValueError(f"Ошибка при записи файла {self._file_path}: {e}")
+
+        self._records = records
+        self._index[username] = record
+        self._next_id = max(self._next_id, record["user_id"] + 1)
+        self._signature = file_signature(self._file_path)
+
+    def iter_records(self):
+        """Перечисляет записи всех пользователей"""
+        self._refresh()
+        return iter(list(self._records))
@@ -1,65 +1,310 @@
+import json
+import re
+import threading
+import time
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
 
 import requests
 
-from valutatrade_hub.core.exceptions import ApiRequestError
+from valutatrade_hub.core.exceptions import ApiRequestError, TransientApiError
+from valutatrade_hub.core.logging_config import get_logger
 from valutatrade_hub.parser_service.config import config
+from valutatrade_hub.parser_service.hedging import assigned_pairs
+from valutatrade_hub.parser_service.http_cache import (
+    build_response,
+    cache_key,
+    fresh_until_from_headers,
+    get_http_cache,
+)
+from valutatrade_hub.parser_service.http_session import get_session
+from valutatrade_hub.parser_service.rate_limiter import get_rate_limiter
+
+logger = get_logger("parser_service")
+
+_CURRENCY_CODE_RE = re.compile(r"^[A-Z]{3}$")
+
+# Сетевые сбои, после которых запрос имеет смысл повторить
+TRANSIENT_REQUEST_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)  # noqa: E501
+
+
+def retry_after_seconds(value, now=None):
+    """Значение заголовка Retry-After (секунды или HTTP-дата) в секундах или None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        moment = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    now = time.time() if now is None else now
+    return max(0.0, moment - now)
 
 
 class BaseApiClient(ABC):
     """Абстрактный базовый класс для клиентов API"""
     
+    # Имя источника: ключ лимита запросов в ParserConfig.RATE_LIMITS
+    SOURCE_NAME = None
+    
+    def __init__(self, session=None):
+        """Инициализация клиента (по умолчанию — общая HTTP-сессия с пулом)"""
+        self._session = session
+        # Момент time.monotonic(), к которому запрос должен завершиться
+        # (задаёт RatesUpdater; None — только REQUEST_TIMEOUT)
+        self.deadline = None
+        self._stats_lock = threading.Lock()
+        self.cache_stats = {"hits": 0, "revalidated": 0, "misses": 0}
+        self.rate_limit_stats = {"requests": 0, "waited": 0, "wait_seconds": 0.0}
+    
+    @property
+    def session(self):
+        """HTTP-сессия клиента"""
+        return self._session or get_session()
+    
+    def _count(self, stats_name, key, value=1):
+        """Увеличивает счётчик метрик (запросы клиента могут идти из пула потоков)"""  # noqa: E501
+        with self._stats_lock:
+            getattr(self, stats_name)[key] += value
+    
+    def pop_cache_stats(self):
+        """Возвращает и обнуляет счётчики кэша HTTP-ответов"""
+        with self._stats_lock:
+            stats = self.cache_stats
+            self.cache_stats = {"hits": 0, "revalidated": 0, "misses": 0}
+        return stats
+    
+    def pop_rate_limit_stats(self):
+        """Возвращает и обнуляет метрики ожидания лимита запросов"""
+        with self._stats_lock:
+            stats = self.rate_limit_stats
+            self.rate_limit_stats = {"requests": 0, "waited": 0, "wait_seconds": 0.0}
+        return stats
+    
+    def _fresh_until(self, response, body):
+        """Срок свежести ответа (unix) или None; провайдер может уточнить"""
+        return fresh_until_from_headers(response.headers)
+    
+    def _raise_for_status(self, response, reason=None):
+        """
+        Преобразует HTTP-ошибку ответа в ApiRequestError.
+
+        429 и 5xx — временные сбои (TransientApiError с Retry-After), прочие
+        коды 4xx — постоянные ошибки, повтор которых не поможет.
+        """
+        status = response.status_code
+        if status < 400:
+            return
+        reason = reason or f"Ошибка {self.SOURCE_NAME}: HTTP {status}"
+        if status == 429 or status >= 500:
+            raise TransientApiError(reason, retry_after_seconds(response.headers.get("Retry-After")))  # noqa: E501
+        raise ApiRequestError(reason)
+    
+    def _throttle(self):
+        """Ждёт разрешения лимита запросов источника перед сетевым вызовом"""
+        limiter = get_rate_limiter(self.SOURCE_NAME)
+        if limiter is None:
+            return
+        wait = limiter.acquire()
+        self._count("rate_limit_stats", "requests")
+        if wait > 0:
+            self._count("rate_limit_stats", "waited")
+            self._count("rate_limit_stats", "wait_seconds", wait)
+    
+    def _request_timeout(self):
+        """Таймаут запроса: REQUEST_TIMEOUT, но не дольше остатка до дедлайна"""
+        if self.deadline is None:
+            return config.REQUEST_TIMEOUT
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise ApiRequestError(f"{self.SOURCE_NAME}: истёк дедлайн обновления")
+        return min(config.REQUEST_TIMEOUT, remaining)
+    
+    def _get(self, url, params=None):
+        """Выполняет GET-запрос через сессию с пулом и кэшем ответов"""
+        if not config.HTTP_CACHE_ENABLED:
+            self._throttle()
+            return self.session.get(url, params=params, timeout=self._request_timeout())  # noqa: E501
+        
+        cache = get_http_cache()
+        key = cache_key(url, params)
+        entry = cache.get(key)
+        
+        if entry is not None and cache.is_fresh(entry):
+            self._count("cache_stats", "hits")
+            return build_response(url, entry)
+        
+        headers = cache.conditional_headers(entry) if entry is not None else {}
+        self._throttle()
+        response = self.session.get(
+            url,
+            params=params,
+            headers=headers,
+            timeout=self._request_timeout(),
+        )
+        
+        if response.status_code == 304 and entry is not None:
+            self._count("cache_stats", "revalidated")
+            entry = dict(
+                entry,
+                etag=response.headers.get("ETag", entry.get("etag")),
+                fresh_until=self._fresh_until(response, entry["body"]),
+            )
+            cache.put(key, entry)
+            return build_response(url, entry)
+        
+        self._count("cache_stats", "misses")
+        if response.status_code == 200:
+            cache.put(key, {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "fresh_until": self._fresh_until(response, response.text),
+                "body": response.text,
+            })
+        return response
+    
     @abstractmethod
     def fetch_rates(self):
         """Получает курсы валют из API"""
         pass
 
 
+def split_id_batches(ids, max_length, max_size):
+    """
+    Делит список id на пакеты для параметра ids=a,b,c.
+
+    Длина параметра в URL (запятая кодируется как %2C) не превышает
+    max_length, в пакете не больше max_size id.
+    """
+    batches = []
+    batch = []
+    length = 0
+    for item in ids:
+        added = len(item) + (3 if batch else 0)
+        if batch and (length + added > max_length or len(batch) >= max_size):
+            batches.append(batch)
+            batch = []
+            added = len(item)
+            length = 0
+        batch.append(item)
+        length += added
+    if batch:
+        batches.append(batch)
+    return batches
+
+
 class CoinGeckoClient(BaseApiClient):
     """Клиент для работы с CoinGecko API"""
     
-    def fetch_rates(self):
-        """Получает курсы криптовалют из CoinGecko API"""
-        crypto_ids = [config.CRYPTO_ID_MAP.get(code) for code in config.CRYPTO_CURRENCIES]  # noqa: E501
-        
+    SOURCE_NAME = "CoinGecko"
+    
+    def _fetch_batch(self, crypto_ids, vs_currencies):
+        """Запрашивает цены одного пакета id; возвращает {id: {валюта: цена}}"""
         params = {
             "ids": ",".join(crypto_ids),
-            "vs_currencies": config.BASE_CURRENCY.lower()
+            "vs_currencies": vs_currencies,
         }
         
-        url = config.COINGECKO_URL
+        try:
+            response = self._get(config.COINGECKO_URL, params=params)
+            self._raise_for_status(response)
+            return response.json()
+        except TRANSIENT_REQUEST_ERRORS as e:
+            raise TransientApiError(f"Ошибка при запросе к CoinGecko: {e}")
+        except requests.exceptions.RequestException as e:
+            raise ApiRequestError(f"Ошибка при запросе к CoinGecko: {e}")
+        except ValueError as e:
+            raise ApiRequestError(f"Ошибка при парсинге ответа CoinGecko: {e}")
+    
+    def _pair_prices(self):
+        """
+        Что запросить для назначенных CoinGecko пар (assigned_pairs).
+
+        Пара криптовалюта_X — цена криптовалюты в X; фиатная пара A_B —
+        кросс-курс через цену COINGECKO_FIAT_REFERENCE в B и в A.
+        Возвращает ({пара: (id, валюта числителя, валюта знаменателя
+        или None)}, валюты vs_currencies).
+        """
+        reference_id = config.CRYPTO_ID_MAP.get(config.COINGECKO_FIAT_REFERENCE)
+        plan = {}
+        for pair_key in assigned_pairs(self.SOURCE_NAME):
+            code, _, quote = pair_key.partition("_")
+            if code in config.CRYPTO_ID_MAP:
+                plan[pair_key] = (config.CRYPTO_ID_MAP[code], quote.lower(), None)
+            elif reference_id and code not in config.CRYPTO_CURRENCIES:
+                plan[pair_key] = (reference_id, quote.lower(), code.lower())
+        vs_currencies = sorted({v for _, *vs in plan.values() for v in vs if v})
+        return plan, vs_currencies
+    
+    def fetch_rates(self):
+        """Получает курсы назначенных пар из CoinGecko API (пакетами, параллельно)"""
+        plan, vs_currencies = self._pair_prices()
+        if not plan:
+            return {}
+        vs_param = ",".join(vs_currencies)
+        
+        params_length = len("?ids=&vs_currencies=") + len(vs_param) * 3
+        batches = split_id_batches(
+            sorted({crypto_id for crypto_id, *_ in plan.values()}),
+            config.COINGECKO_MAX_URL_LENGTH - len(config.COINGECKO_URL) - params_length,
+            config.COINGECKO_BATCH_SIZE,
+        )
+        
+        data = {}
+        errors = []
+        workers = max(1, min(config.COINGECKO_MAX_PARALLEL, len(batches)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="coingecko") as executor:  # noqa: E501
+            futures = [executor.submit(self._fetch_batch, batch, vs_param) for batch in batches]  # noqa: E501
+            for future in futures:
+                try:
+                    data.update(future.result())
+                except ApiRequestError as e:
+                    errors.append(e)
+        
+        if errors and not data:
+            # Если хотя бы один пакет упал временно, весь запрос можно повторить
+            raise next((e for e in errors if isinstance(e, TransientApiError)), errors[0])  # noqa: E501
+        if errors:
+            logger.warning(f"CoinGecko: {len(errors)} из {len(batches)} пакетов не получены: {errors[0]}")  # noqa: E501
         
         try:
-            response = requests.get(
-                url,
-                params=params,
-                timeout=config.REQUEST_TIMEOUT
-            )
-            response.raise_for_status()
-            
-            data = response.json()
-            
             result = {}
-            for code in config.CRYPTO_CURRENCIES:
-                crypto_id = config.CRYPTO_ID_MAP.get(code)
-                
-                if crypto_id and crypto_id in data:
-                    rate = data[crypto_id].get(config.BASE_CURRENCY.lower())
-                    if rate:
-                        pair_key = f"{code}_{config.BASE_CURRENCY}"
-                        result[pair_key] = float(rate)
-            
+            for pair_key, (crypto_id, quote, denominator) in plan.items():
+                prices = data.get(crypto_id) or {}
+                rate = prices.get(quote)
+                if rate and denominator is not None:
+                    # Цена фиатной валюты — отношение цен эталона
+                    divisor = prices.get(denominator)
+                    rate = float(rate) / float(divisor) if divisor else None
+                if rate:
+                    result[pair_key] = float(rate)
             return result
-            
-        except requests.exceptions.RequestException as e:
-            raise ApiRequestError(f"Ошибка при запросе к CoinGecko: {e}")
-        except (ValueError, KeyError, TypeError) as e:
+        except (ValueError, AttributeError, TypeError) as e:
             raise ApiRequestError(f"Ошибка при парсинге ответа CoinGecko: {e}")
 
 
 class ExchangeRateApiClient(BaseApiClient):
     """Клиент для работы с ExchangeRate-API"""
     
+    SOURCE_NAME = "ExchangeRate-API"
+    
+    def _fresh_until(self, response, body):
+        """Ответ свежий до времени следующего обновления у провайдера"""
+        try:
+            data = json.loads(body)
+        except (TypeError, ValueError):
+            return None
+        if data.get("result") != "success":
+            return None
+        next_update = data.get("time_next_update_unix")
+        if next_update:
+            return float(next_update)
+        return super()._fresh_until(response, body)
+    
     def fetch_rates(self):
         """ Получает курсы фиатных валют из ExchangeRate-API"""
         if not config.EXCHANGERATE_API_KEY:
@@ -67,10 +312,7 @@ class ExchangeRateApiClient(BaseApiClient):
         
         url = f"{config.EXCHANGERATE_API_URL}/{config.EXCHANGERATE_API_KEY}/latest/{config.BASE_CURRENCY}"  # noqa: E501
         try:
-            response = requests.get(
-                url,
-                timeout=config.REQUEST_TIMEOUT,
-            )
+            response = self._get(url)
             
             if response.status_code != 200:
                 error_msg = f"HTTP {response.status_code}"
@@ -80,9 +322,10 @@ class ExchangeRateApiClient(BaseApiClient):
                         error_msg = error_data["error-type"]
                 except (ValueError, KeyError):
                     pass
-                raise ApiRequestError(f"Ошибка ExchangeRate-API: {error_msg}")
+                reason = f"Ошибка ExchangeRate-API: {error_msg}"
+                self._raise_for_status(response, reason)
+                raise ApiRequestError(reason)
             
-            response.raise_for_status()
             data = response.json()
             if data.get("result") != "success":
                 error_type = data.get("error-type", "unknown")
@@ -91,15 +334,34 @@ class ExchangeRateApiClient(BaseApiClient):
             rates = data.get("conversion_rates", {})
             result = {}
             
-            for code in config.FIAT_CURRENCIES:
-                if code in rates:
-                    rate = rates[code]
+            # Сохраняются все фиатные валюты провайдера, а не только
+            # FIAT_CURRENCIES: ответ уже загружен целиком
+            for code, value in rates.items():
+                if code != config.BASE_CURRENCY and value and _CURRENCY_CODE_RE.match(code):  # noqa: E501
+                    # conversion_rates — сколько единиц code за 1 BASE,
+                    # а пара code_BASE хранит цену 1 code в BASE
                     pair_key = f"{code}_{config.BASE_CURRENCY}"
-                    result[pair_key] = float(rate)
+                    result[pair_key] = 1.0 / float(value)
             
             return result
             
+        except TRANSIENT_REQUEST_ERRORS as e:
+            raise TransientApiError(f"Ошибка при запросе к ExchangeRate-API: {e}")
         except requests.exceptions.RequestException as e:
             raise ApiRequestError(f"Ошибка при запросе к ExchangeRate-API: {e}")
         except (ValueError, KeyError, TypeError) as e:
             raise ApiRequestError(f"Ошибка при парсинге ответа ExchangeRate-API: {e}")
+
+
+CLIENT_CLASSES = {
+    client_class.SOURCE_NAME: client_class
+    for client_class in (CoinGeckoClient, ExchangeRateApiClient)
+}
+
+
+def create_client(source_name):
+    """Создаёт клиент API по имени источника"""
+    try:
+        return CLIENT_CLASSES[source_name]()
+    except KeyError:
+        raise ValueError(f"Неизвестный источник курсов '{source_name}'")
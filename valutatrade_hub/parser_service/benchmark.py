@@ -0,0 +1,110 @@
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import requests
+
+from valutatrade_hub.parser_service.api_clients import (
+    CoinGeckoClient,
+    ExchangeRateApiClient,
+)
+from valutatrade_hub.parser_service.cassettes import (
+    REPLAY,
+    CassetteAdapter,
+    CassetteStore,
+    synthetic_universe,
+    universe_config,
+    write_synthetic_cassettes,
+)
+from valutatrade_hub.parser_service.config import config
+from valutatrade_hub.parser_service.updater import RatesUpdater
+
+# Файлы Parser Service, которые бенчмарк переносит во временный каталог
+DATA_FILE_FIELDS = (
+    "RATES_FILE_PATH",
+    "RATES_MATRIX_FILE_PATH",
+    "HISTORY_FILE_PATH",
+    "LEGACY_HISTORY_FILE_PATH",
+    "TIMESERIES_DIR",
+    "CANDLES_DIR",
+    "HTTP_CACHE_FILE_PATH",
+    "CIRCUIT_BREAKER_FILE_PATH",
+    "RATE_LIMIT_FILE_PATH",
+    "CASSETTE_DIR",
+)
+
+
+@contextmanager
+def override_config(**values):
+    """Временно подменяет поля ParserConfig"""
+    saved = {name: getattr(config, name) for name in values}
+    try:
+        for name, value in values.items():
+            setattr(config, name, value)
+        yield config
+    finally:
+        for name, value in saved.items():
+            setattr(config, name, value)
+
+
+def run_offline_benchmark(crypto_count, fiat_count, latency=0.0, jitter=0.0, runs=3):
+    """
+    Прогоняет RatesUpdater.run_update без сети на вымышленных валютах.
+
+    Ответы провайдеров синтезируются в кассеты и воспроизводятся с
+    задержкой latency ± jitter; все файлы пишутся во временный каталог,
+    лимиты запросов и кэш ответов отключены. Возвращает метрики прогонов.
+    """
+    with tempfile.TemporaryDirectory(prefix="valutatrade-bench-") as tmp:
+        universe = synthetic_universe(crypto_count, fiat_count)
+        overrides = {
+            name: str(Path(tmp) / Path(getattr(config, name)).name)
+            for name in DATA_FILE_FIELDS
+        }
+        overrides.update(universe_config(universe))
+        overrides.update(
+            RATE_LIMITS={},
+            HTTP_CACHE_ENABLED=False,
+            EXCHANGERATE_API_KEY=config.EXCHANGERATE_API_KEY or "offline",
+        )
+        
+        with override_config(**overrides):
+            store = CassetteStore()
+            cassettes = write_synthetic_cassettes(universe, store)
+            
+            session = requests.Session()
+            adapter = CassetteAdapter(
+                REPLAY,
+                store,
+                latency=latency,
+                jitter=jitter,
+                pool_maxsize=config.HTTP_POOL_MAXSIZE,
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            
+            measurements = []
+            for run in range(1, runs + 1):
+                updater = RatesUpdater([
+                    CoinGeckoClient(session=session),
+                    ExchangeRateApiClient(session=session),
+                ])
+                started = time.perf_counter()
+                result = updater.run_update()
+                measurements.append({
+                    "run": run,
+                    "seconds": round(time.perf_counter() - started, 4),
+                    "pairs": result["results"]["total_pairs"],
+                    "failed": len(result["results"]["failed"]),
+                })
+            session.close()
+    
+    seconds = [m["seconds"] for m in measurements]
+    return {
+        "assets": crypto_count + fiat_count,
+        "requests_per_run": cassettes,
+        "runs": measurements,
+        "median_seconds": statistics.median(seconds) if seconds else None,
+    }
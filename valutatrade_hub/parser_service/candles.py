@@ -0,0 +1,235 @@
+import os
+import struct
+import time
+from pathlib import Path
+
+from valutatrade_hub.core.utils import file_lock
+from valutatrade_hub.parser_service.config import config
+from valutatrade_hub.parser_service.timeseries import (
+    RateSeries,
+    compact_series,
+    from_epoch_ms,
+    get_series,
+    parse_duration,
+    parse_moment,
+    parse_retention_tiers,
+    to_epoch_ms,
+)
+
+# начало свечи (мс от эпохи, UTC), open, high, low, close, число тиков
+CANDLE = struct.Struct("<qddddI4x")
+
+
+def resolution_ms(name):
+    """Длительность свечи разрешения name (1m, 1h, 1d) в миллисекундах"""
+    try:
+        return config.CANDLE_RESOLUTIONS[name] * 1000
+    except KeyError:
+        raise ValueError(f"Неизвестное разрешение свечей '{name}'")
+
+
+class CandleSeries(RateSeries):
+    """
+    Свечи OHLC одной пары одного разрешения.
+
+    Файл того же устройства, что и RateSeries, но запись — свеча. Новые
+    курсы вливаются в последнюю свечу на месте или открывают следующую,
+    поэтому обновление не зависит от длины истории.
+    """
+
+    record = CANDLE
+
+    def __init__(self, path, resolution):
+        """Инициализация ряда свечей разрешения resolution (мс)"""
+        super().__init__(path)
+        self.resolution = resolution
+
+    def _merge(self, candles, ticks):
+        """Вливает тики в упорядоченный список свечей candles на месте"""
+        for timestamp, rate in sorted(ticks):
+            start = timestamp - timestamp % self.resolution
+            if candles and start < candles[-1][0]:
+                continue
+            if candles and start == candles[-1][0]:
+                candle = candles[-1]
+                candle[2] = max(candle[2], rate)
+                candle[3] = min(candle[3], rate)
+                candle[4] = rate
+                candle[5] += 1
+            else:
+                candles.append([start, rate, rate, rate, rate, 1])
+        return candles
+
+    def rebuild(self, ticks):
+        """Заменяет свечи ряда свечами, построенными заново из тиков"""
+        self.replace(self._merge([], ticks))
+
+    def update(self, ticks):
+        """Вливает тики (timestamp_ms, rate) в свечи; тики старше последней свечи пропускаются"""  # noqa: E501
+        if not ticks:
+            return
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            # Последнюю свечу может дополнять и фоновое обновление, а
+            # compact() — заменять файл целиком
+            with file_lock(self._path), os.fdopen(os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644), "r+b") as f:  # noqa: E501
+                size = f.seek(0, os.SEEK_END)
+                # Обрезаем оборванную запись, оставшуюся после сбоя
+                size -= size % self.record.size
+
+                # Последняя свеча перезаписывается вместе с новыми
+                candles = []
+                position = size
+                if size:
+                    position = size - self.record.size
+                    f.seek(position)
+                    candles.append(list(self.record.unpack(f.read(self.record.size))))  # noqa: E501
+
+                self._merge(candles, ticks)
+                f.seek(position)
+                f.write(b"".join(self.record.pack(*candle) for candle in candles))
+                f.truncate()
+        except (IOError, OSError) as e:
+            raise ValueError(f"Ошибка при записи свечей {self._path}: {e}")
+
+
+def get_candles(pair_key, resolution):
+    """Возвращает ряд свечей пары вида BTC_USD разрешения resolution (1m, 1h, 1d)"""  # noqa: E501
+    return CandleSeries(
+        Path(config.CANDLES_DIR) / resolution / f"{pair_key}.bin",
+        resolution_ms(resolution),
+    )
+
+
+def _update_pairs(ticks_by_pair, rebuild=False):
+    """Вливает тики {пара: [(timestamp_ms, rate)]} во все разрешения"""
+    for pair_key, ticks in ticks_by_pair.items():
+        for resolution in config.CANDLE_RESOLUTIONS:
+            candles = get_candles(pair_key, resolution)
+            if rebuild:
+                candles.rebuild(ticks)
+            else:
+                candles.update(ticks)
+
+
+def update_candles(pairs_data):
+    """Дополняет свечи курсами из rates.json-формата ({пара: {rate, updated_at}})"""
+    _update_pairs({
+        pair_key: [(to_epoch_ms(pair_data["updated_at"]), float(pair_data["rate"]))]
+        for pair_key, pair_data in pairs_data.items()
+    })
+
+
+def rebuild_candles(records):
+    """Строит свечи из записей истории заново (например, iter_history())"""
+    # Дубли в истории (одинаковое время) учитываются один раз
+    ticks_by_pair = {}
+    for record in records:
+        pair_key = f"{record['from_currency']}_{record['to_currency']}"
+        ticks_by_pair.setdefault(pair_key, {})[to_epoch_ms(record["timestamp"])] = float(record["rate"])  # noqa: E501
+    _update_pairs({
+        pair_key: list(ticks.items()) for pair_key, ticks in ticks_by_pair.items()
+    }, rebuild=True)
+    return len(ticks_by_pair)
+
+
+def compact_candles(now_ms, dry_run=False):
+    """
+    Удаляет устаревшие свечи по CANDLE_RETENTION.
+
+    Для разрешения задаются уровни хранения в том же формате, что и
+    HISTORY_RETENTION, но только с режимами raw и drop: свечи не
+    прореживаются, а удаляются, так как их покрывают более крупные.
+    Возвращает отчёт {files, bytes_before, bytes_after}.
+    """
+    report = {"files": 0, "bytes_before": 0, "bytes_after": 0}
+    for resolution, spec in config.CANDLE_RETENTION.items():
+        tiers = parse_retention_tiers(spec)
+        if any(mode not in ("raw", "drop") for _, mode in tiers):
+            raise ValueError(f"Для свечей {resolution} допустимы только режимы raw и drop")  # noqa: E501
+        paths = sorted((Path(config.CANDLES_DIR) / resolution).glob("*.bin"))
+        series_list = (CandleSeries(path, resolution_ms(resolution)) for path in paths)  # noqa: E501
+        for key, value in compact_series(series_list, tiers, now_ms, dry_run=dry_run).items():  # noqa: E501
+            report[key] += value
+    return report
+
+
+def choose_resolution(interval_ms=None, span_ms=None):
+    """
+    Самое крупное разрешение, которое удовлетворяет запросу.
+
+    Для заданного интервала — наибольшее разрешение, на которое он делится
+    без остатка; без интервала — наибольшее, дающее не меньше
+    CANDLE_MIN_POINTS свечей за span_ms (иначе самое мелкое).
+    """
+    resolutions = sorted(config.CANDLE_RESOLUTIONS, key=resolution_ms, reverse=True)
+    if interval_ms is not None:
+        for name in resolutions:
+            if interval_ms % resolution_ms(name) == 0:
+                return name
+        raise ValueError(f"Интервал должен быть кратен {resolutions[-1]}")
+    if span_ms is not None:
+        for name in resolutions:
+            if span_ms // resolution_ms(name) >= config.CANDLE_MIN_POINTS:
+                return name
+    return resolutions[-1]
+
+
+def _aggregate(candles, interval):
+    """Сворачивает упорядоченные свечи в свечи интервала interval (мс)"""
+    current = None
+    for start, open_, high, low, close, count in candles:
+        bucket = start - start % interval
+        if current is not None and current[0] == bucket:
+            current[2] = max(current[2], high)
+            current[3] = min(current[3], low)
+            current[4] = close
+            current[5] += count
+            continue
+        if current is not None:
+            yield current
+        current = [bucket, open_, high, low, close, count]
+    if current is not None:
+        yield current
+
+
+def query_candles(pair_key, start=None, end=None, interval=None):
+    """
+    Выбирает свечи пары за период.
+
+    start и end — ISO-время или длительность назад (7d), interval — 15m,
+    4h, 1d и т.п. Возвращает (использованное разрешение, итератор свечей
+    {timestamp, open, high, low, close, count}).
+    """
+    now_ms = int(time.time() * 1000)
+    start_ms = None if start is None else parse_moment(start, now_ms)
+    end_ms = now_ms if end is None else parse_moment(end, now_ms)
+    interval_ms = None if interval is None else parse_duration(interval)
+
+    span_ms = None
+    if start_ms is not None:
+        span_ms = end_ms - start_ms
+    else:
+        # Без start период считается от первой записи временного ряда пары
+        first = get_series(pair_key).first()
+        if first is not None:
+            span_ms = end_ms - first[0]
+
+    resolution = choose_resolution(interval_ms, span_ms)
+    series = get_candles(pair_key, resolution)
+    interval_ms = interval_ms or series.resolution
+    if start_ms is not None:
+        start_ms -= start_ms % interval_ms
+
+    def iterate():
+        for candle in _aggregate(series.range(start_ms, end_ms), interval_ms):
+            yield {
+                "timestamp": from_epoch_ms(candle[0]),
+                "open": candle[1],
+                "high": candle[2],
+                "low": candle[3],
+                "close": candle[4],
+                "count": candle[5],
+            }
+
+    return resolution, iterate()
@@ -0,0 +1,210 @@
+import hashlib
+import itertools
+import json
+import random
+import string
+import time
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from valutatrade_hub.core.utils import write_json_atomic
+from valutatrade_hub.parser_service.config import config
+
+RECORD = "record"
+REPLAY = "replay"
+
+API_KEY_PLACEHOLDER = "API_KEY"
+
+# Заголовки, которые нужны клиентам и кэшу ответов
+_KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Cache-Control", "Expires")
+
+
+class CassetteStore:
+    """
+    Каталог кассет: по файлу на каждый записанный HTTP-запрос.
+
+    Ключ записи — метод и URL с отсортированными параметрами; ключ
+    ExchangeRate-API в URL заменяется заглушкой, поэтому кассеты можно
+    хранить в репозитории и воспроизводить с любым ключом.
+    """
+
+    def __init__(self, directory=None):
+        """Инициализация хранилища (по умолчанию — CASSETTE_DIR)"""
+        self.directory = Path(directory or config.CASSETTE_DIR)
+
+    @staticmethod
+    def normalize_url(url):
+        """URL без ключа API и с отсортированными параметрами запроса"""
+        parts = urlsplit(url)
+        key = config.EXCHANGERATE_API_KEY
+        path = "/".join(
+            API_KEY_PLACEHOLDER if key and segment == key else segment
+            for segment in parts.path.split("/")
+        )
+        query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+        return urlunsplit((parts.scheme, parts.netloc, path, query, ""))
+
+    def path_for(self, method, url):
+        """Путь файла кассеты для запроса"""
+        normalized = self.normalize_url(url)
+        digest = hashlib.sha256(f"{method} {normalized}".encode("utf-8")).hexdigest()
+        host = urlsplit(normalized).netloc.replace(":", "_") or "local"
+        return self.directory / host / f"{digest[:32]}.json"
+
+    def load(self, method, url):
+        """Возвращает запись кассеты или None"""
+        try:
+            with open(self.path_for(method, url), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (json.JSONDecodeError, IOError) as e:
+            raise ValueError(f"Ошибка при чтении кассеты для {url}: {e}")
+
+    def save(self, method, url, status_code, headers, body):
+        """Сохраняет ответ в кассету"""
+        write_json_atomic(self.path_for(method, url), {
+            "request": {"method": method, "url": self.normalize_url(url)},
+            "status_code": status_code,
+            "headers": {k: headers[k] for k in _KEPT_HEADERS if k in headers},
+            "body": body,
+        })
+
+
+class CassetteAdapter(HTTPAdapter):
+    """
+    Транспорт requests с записью и воспроизведением ответов.
+
+    В режиме record запросы уходят в сеть, а ответы сохраняются в
+    кассеты; в режиме replay сеть не используется: ответ берётся из
+    кассеты после задержки latency ± jitter секунд. Запрос без записи
+    в режиме replay завершается ConnectionError.
+    """
+
+    def __init__(self, mode, store=None, latency=None, jitter=None, **kwargs):
+        """Инициализация адаптера (kwargs — параметры пула HTTPAdapter)"""
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Неизвестный режим кассет '{mode}'")
+        super().__init__(**kwargs)
+        self.mode = mode
+        self.store = store or CassetteStore()
+        self.latency = config.CASSETTE_LATENCY if latency is None else latency
+        self.jitter = config.CASSETTE_LATENCY_JITTER if jitter is None else jitter
+
+    def send(self, request, **kwargs):
+        """Отправляет запрос в сеть (record) или отвечает из кассеты (replay)"""
+        if self.mode == RECORD:
+            response = super().send(request, **kwargs)
+            # 304 относится к кэшу клиента, а не к содержимому ответа
+            if response.status_code != 304:
+                self.store.save(request.method, request.url, response.status_code, response.headers, response.text)  # noqa: E501
+            return response
+
+        entry = self.store.load(request.method, request.url)
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if entry is None:
+            raise requests.exceptions.ConnectionError(
+                f"Нет записи в кассете для {self.store.normalize_url(request.url)}",
+                request=request,
+            )
+        return self._build_response(request, entry)
+
+    def _build_response(self, request, entry):
+        """Собирает requests.Response из записи кассеты"""
+        response = requests.Response()
+        response.status_code = entry["status_code"]
+        response.headers = CaseInsensitiveDict(entry.get("headers", {}))
+        response._content = entry["body"].encode("utf-8")
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+
+def synthetic_universe(crypto_count, fiat_count):
+    """Вселенная из crypto_count/fiat_count вымышленных валют (формат currencies.json)"""  # noqa: E501
+    # Трёхбуквенные коды на Q/X/Z: до 2028 фиатных валют
+    fiat_codes = [
+        "".join(letters)
+        for letters in itertools.product(string.ascii_uppercase, repeat=3)
+        if letters[0] in "QXZ"
+    ][:fiat_count]
+    
+    return {
+        "fiat": [
+            {"code": code, "name": f"Synthetic fiat {code}", "issuing_country": "Nowhere"}  # noqa: E501
+            for code in fiat_codes
+        ],
+        "crypto": [
+            {
+                "code": f"X{i:04d}",
+                "name": f"Synthetic coin {i}",
+                "algorithm": "Synthetic",
+                "market_cap": 0,
+                "coingecko_id": f"synthetic-coin-{i}",
+            }
+            for i in range(crypto_count)
+        ],
+    }
+
+
+def universe_config(universe):
+    """Значения списков валют ParserConfig для заданной вселенной"""
+    return {
+        "FIAT_CURRENCIES": tuple(
+            entry["code"] for entry in universe["fiat"] if entry["code"] != config.BASE_CURRENCY  # noqa: E501
+        ),
+        "CRYPTO_CURRENCIES": tuple(entry["code"] for entry in universe["crypto"]),
+        "CRYPTO_ID_MAP": {
+            entry["code"]: entry["coingecko_id"] for entry in universe["crypto"]
+        },
+    }
+
+
+def write_synthetic_cassettes(universe, store=None, seed=0):
+    """
+    Записывает кассеты ответов CoinGecko и ExchangeRate-API для вселенной.
+
+    Пакеты CoinGecko строятся так же, как в CoinGeckoClient, поэтому
+    клиент в режиме replay найдёт запись для каждого запроса.
+    """
+    from valutatrade_hub.parser_service.api_clients import split_id_batches
+    
+    store = store or CassetteStore()
+    rng = random.Random(seed)
+    base = config.BASE_CURRENCY
+    json_headers = {"Content-Type": "application/json"}
+    
+    crypto_ids = [entry["coingecko_id"] for entry in universe["crypto"]]
+    params_length = len("?ids=&vs_currencies=") + len(base)
+    batches = split_id_batches(
+        crypto_ids,
+        config.COINGECKO_MAX_URL_LENGTH - len(config.COINGECKO_URL) - params_length,
+        config.COINGECKO_BATCH_SIZE,
+    )
+    for batch in batches:
+        request = requests.Request("GET", config.COINGECKO_URL, params={
+            "ids": ",".join(batch),
+            "vs_currencies": base.lower(),
+        }).prepare()
+        body = {crypto_id: {base.lower(): round(rng.uniform(0.01, 50000), 6)} for crypto_id in batch}  # noqa: E501
+        store.save("GET", request.url, 200, json_headers, json.dumps(body))
+    
+    conversion_rates = {base: 1}
+    for entry in universe["fiat"]:
+        conversion_rates[entry["code"]] = round(rng.uniform(0.1, 5000), 6)
+    url = f"{config.EXCHANGERATE_API_URL}/{config.EXCHANGERATE_API_KEY or API_KEY_PLACEHOLDER}/latest/{base}"  # noqa: E501
+    store.save("GET", url, 200, json_headers, json.dumps({
+        "result": "success",
+        "base_code": base,
+        "conversion_rates": conversion_rates,
+    }))
+    
+    return len(batches) + 1
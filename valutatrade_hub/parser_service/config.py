@@ -4,34 +4,131 @@ from types import MappingProxyType
 
 from dotenv import load_dotenv
 
+from valutatrade_hub.core.currencies import load_currency_universe
+
 load_dotenv()
 
+_universe = load_currency_universe()
+
 
 @dataclass
 class ParserConfig:
     
     EXCHANGERATE_API_KEY: str = os.getenv("EXCHANGERATE_API_KEY", "")
     
-    # Эндпоинты
-    COINGECKO_URL: str = "https://api.coingecko.com/api/v3/simple/price"
-    EXCHANGERATE_API_URL: str = "https://v6.exchangerate-api.com/v6"
+    # Эндпоинты (можно направить на локальный stub_server)
+    COINGECKO_URL: str = os.getenv("COINGECKO_URL", "https://api.coingecko.com/api/v3/simple/price")  # noqa: E501
+    EXCHANGERATE_API_URL: str = os.getenv("EXCHANGERATE_API_URL", "https://v6.exchangerate-api.com/v6")  # noqa: E501
     
-    # Списки валют
+    # Списки валют (из файла вселенной валют, см. core/currencies.json)
     BASE_CURRENCY: str = "USD"
-    FIAT_CURRENCIES: tuple = ("EUR", "GBP", "RUB")
-    CRYPTO_CURRENCIES: tuple = ("BTC", "ETH", "SOL")
+    FIAT_CURRENCIES: tuple = tuple(
+        entry["code"] for entry in _universe["fiat"] if entry["code"] != "USD"
+    )
+    CRYPTO_CURRENCIES: tuple = tuple(entry["code"] for entry in _universe["crypto"])
     CRYPTO_ID_MAP: dict = MappingProxyType({
-        "BTC": "bitcoin",
-        "ETH": "ethereum",
-        "SOL": "solana",
+        entry["code"]: entry["coingecko_id"]
+        for entry in _universe["crypto"]
+        if entry.get("coingecko_id")
+    })
+    # Пакеты запросов к CoinGecko: ограничение длины URL и числа id,
+    # пакеты запрашиваются параллельно
+    COINGECKO_MAX_URL_LENGTH: int = 2000
+    COINGECKO_BATCH_SIZE: int = 250
+    COINGECKO_MAX_PARALLEL: int = 4
+    # Фиатные пары, назначенные CoinGecko (PAIR_SOURCE_PRIORITY), считаются
+    # кросс-курсом через цену этой криптовалюты в обеих валютах
+    COINGECKO_FIAT_REFERENCE: str = "BTC"
+    
+    # Числовые id источников для бинарных временных рядов
+    SOURCE_IDS: dict = MappingProxyType({
+        "Unknown": 0,
+        "CoinGecko": 1,
+        "ExchangeRate-API": 2,
     })
     
     # Пути к файлам
     RATES_FILE_PATH: str = "data/rates.json"
-    HISTORY_FILE_PATH: str = "data/exchange_rates.json"
+    RATES_MATRIX_FILE_PATH: str = "data/rates_matrix.bin"
+    HISTORY_FILE_PATH: str = "data/exchange_rates.jsonl"
+    LEGACY_HISTORY_FILE_PATH: str = "data/exchange_rates.json"
+    TIMESERIES_DIR: str = "data/timeseries"
+    CANDLES_DIR: str = "data/candles"
+    HTTP_CACHE_FILE_PATH: str = "data/http_cache.json"
+    CIRCUIT_BREAKER_FILE_PATH: str = "data/circuit_breakers.json"
+    RATE_LIMIT_FILE_PATH: str = "data/rate_limits.json"
     
     # Сетевые параметры
     REQUEST_TIMEOUT: int = 10
+    # Пул HTTP-соединений (keep-alive), общий для всех клиентов
+    HTTP_POOL_CONNECTIONS: int = 4
+    HTTP_POOL_MAXSIZE: int = 8
+    HTTP_POOL_BLOCK: bool = False
+    HTTP_USER_AGENT: str = "valutatrade-hub/0.1"
+    # Кэш ответов провайдеров (ETag, Last-Modified, время следующего обновления)
+    HTTP_CACHE_ENABLED: bool = True
+    # Повторы с экспоненциальной задержкой и автомат защиты по источникам
+    RETRY_ATTEMPTS: int = 3
+    RETRY_BASE_DELAY: float = 0.5
+    RETRY_MAX_DELAY: float = 4.0
+    BREAKER_FAILURE_THRESHOLD: int = 3
+    BREAKER_RESET_TIMEOUT: int = 300
+    # Лимиты запросов к провайдерам (token bucket, общий для всех процессов):
+    # CoinGecko free — ~30 запросов в минуту, ExchangeRate-API free — 1500 в месяц
+    RATE_LIMITS: dict = MappingProxyType({
+        "CoinGecko": MappingProxyType({"capacity": 10, "refill_per_second": 0.5}),
+        "ExchangeRate-API": MappingProxyType({
+            "capacity": 5,
+            "refill_per_second": 1500 / (30 * 24 * 3600),
+        }),
+    })
+    # Дольше этого запрос не ждёт токен и завершается ошибкой
+    RATE_LIMIT_MAX_WAIT: float = 5.0
+    # Источники пар в порядке приоритета: по классу активов и явно для
+    # отдельных пар, например {"EUR_USD": ("ExchangeRate-API", "CoinGecko")};
+    # каждый клиент запрашивает назначенные ему пары (assigned_pairs)
+    ASSET_CLASS_SOURCES: dict = MappingProxyType({
+        "crypto": ("CoinGecko",),
+        "fiat": ("ExchangeRate-API",),
+    })
+    PAIR_SOURCE_PRIORITY: dict = MappingProxyType({})
+    # Пары с несколькими источниками: "first" — ответ самого приоритетного
+    # источника, полученный за HEDGE_BUDGET секунд (позже — любой
+    # полученный), "median" — медиана всех ответов до UPDATE_DEADLINE
+    HEDGE_STRATEGY: str = "first"
+    HEDGE_BUDGET: float = 2.0
+    # TTL курсов по источникам: криптовалюты меняются ежесекундно,
+    # фиатные курсы ExchangeRate-API обновляются раз в сутки
+    SOURCE_TTLS: dict = MappingProxyType({
+        "CoinGecko": 60,
+        "ExchangeRate-API": 6 * 3600,
+    })
+    # Режим update-rates --daemon: источник обновляется при возрасте в долю
+    # DAEMON_REFRESH_AHEAD его TTL плюс случайная задержка до DAEMON_JITTER
+    # TTL; после ошибки — не чаще DAEMON_MIN_INTERVAL секунд
+    DAEMON_REFRESH_AHEAD: float = 0.8
+    DAEMON_JITTER: float = 0.1
+    DAEMON_MIN_INTERVAL: int = 30
+    # Кассеты HTTP-ответов для работы без сети: "record" — запись ответов
+    # провайдеров, "replay" — воспроизведение с задержкой CASSETTE_LATENCY
+    # ± CASSETTE_LATENCY_JITTER секунд, пусто — обычные запросы
+    CASSETTE_MODE: str = os.getenv("CASSETTE_MODE", "")
+    CASSETTE_DIR: str = os.getenv("CASSETTE_DIR", "data/cassettes")
+    CASSETTE_LATENCY: float = float(os.getenv("CASSETTE_LATENCY", "0"))
+    CASSETTE_LATENCY_JITTER: float = float(os.getenv("CASSETTE_LATENCY_JITTER", "0"))
+    # Свечи OHLC, которые обновляются вместе с курсами (разрешение: секунды)
+    CANDLE_RESOLUTIONS: dict = MappingProxyType({"1m": 60, "1h": 3600, "1d": 86400})
+    # history без --interval берёт самое крупное разрешение, дающее не меньше
+    # CANDLE_MIN_POINTS свечей за запрошенный период
+    CANDLE_MIN_POINTS: int = 50
+    # Уровни хранения истории для compact-history: до 7 дней — все записи,
+    # до года — последняя запись пары за час, старше — за сутки
+    HISTORY_RETENTION: str = "7d:raw,365d:1h,*:1d"
+    # Уровни хранения свечей по разрешениям (только raw и drop): минутные
+    # свечи старше недели удаляются, их покрывают часовые и дневные
+    CANDLE_RETENTION: dict = MappingProxyType({"1m": "7d:raw"})
+    # Общий дедлайн одного обновления (клиенты опрашиваются параллельно)
+    UPDATE_DEADLINE: int = 15
 
 
 config = ParserConfig()
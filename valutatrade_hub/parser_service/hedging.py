@@ -0,0 +1,114 @@
+import statistics
+import time
+
+from valutatrade_hub.parser_service.config import config
+
+FIRST = "first"
+MEDIAN = "median"
+
+
+def pair_sources(pair_key):
+    """Источники пары в порядке приоритета (PAIR_SOURCE_PRIORITY или класс актива)"""  # noqa: E501
+    override = config.PAIR_SOURCE_PRIORITY.get(pair_key)
+    if override:
+        return tuple(override)
+    code = pair_key.partition("_")[0]
+    asset_class = "crypto" if code in config.CRYPTO_CURRENCIES else "fiat"
+    return tuple(config.ASSET_CLASS_SOURCES.get(asset_class, ()))
+
+
+def known_pairs():
+    """Пары вселенной валют к базовой и пары с явным приоритетом источников"""
+    codes = config.CRYPTO_CURRENCIES + config.FIAT_CURRENCIES
+    pairs = {f"{code}_{config.BASE_CURRENCY}" for code in codes}
+    return pairs | set(config.PAIR_SOURCE_PRIORITY)
+
+
+def assigned_pairs(source):
+    """Пары, которые запрашивает источник: те, где он есть в pair_sources"""
+    return sorted(p for p in known_pairs() if source in pair_sources(p))
+
+
+def source_rank(pair_key, source):
+    """Место источника в приоритете пары (не указанные — в конце)"""
+    sources = pair_sources(pair_key)
+    return sources.index(source) if source in sources else len(sources)
+
+
+class QuoteCollector:
+    """
+    Сбор котировок одного обновления от нескольких источников.
+
+    Если пару покрывают несколько провайдеров, запросы к ним идут
+    параллельно (хеджирование), а коллектор решает, когда ответ по паре
+    окончателен. Стратегия "first": пара закрыта, как только ответил её
+    самый приоритетный из ещё ожидаемых источников, а после HEDGE_BUDGET
+    секунд — любым полученным ответом. Стратегия "median": ждутся все
+    источники пары (до общего дедлайна), курс — медиана ответов.
+    Источник, от которого не ждут ни одной открытой пары, можно не ждать.
+    """
+
+    def __init__(self, sources, strategy=None, budget=None):
+        """Инициализация для набора опрашиваемых источников"""
+        self.strategy = strategy or config.HEDGE_STRATEGY
+        if self.strategy not in (FIRST, MEDIAN):
+            raise ValueError(f"Неизвестная стратегия хеджирования '{self.strategy}'")
+        self.budget = config.HEDGE_BUDGET if budget is None else budget
+        self.started = time.monotonic()
+        self.pending = set(sources)
+        self.responded = []
+        self.answers = {}
+        self._expected = {}
+        pairs = known_pairs()
+        for source in self.pending:
+            self._expected[source] = {p for p in pairs if source in pair_sources(p)}
+
+    @property
+    def budget_deadline(self):
+        """Момент time.monotonic(), после которого "first" берёт любой ответ"""
+        return self.started + self.budget
+
+    def add(self, source, rates):
+        """Учитывает ответ источника ({пара: курс})"""
+        self.pending.discard(source)
+        self.responded.append(source)
+        for pair_key, rate in rates.items():
+            self.answers.setdefault(pair_key, {})[source] = rate
+
+    def fail(self, source):
+        """Отмечает, что источник ответа не даст"""
+        self.pending.discard(source)
+
+    def is_settled(self, pair_key, now=None):
+        """Окончателен ли курс пары"""
+        waiting = [s for s in pair_sources(pair_key) if s in self.pending]
+        if not waiting:
+            return True
+        answers = self.answers.get(pair_key)
+        if not answers or self.strategy == MEDIAN:
+            return False
+        now = time.monotonic() if now is None else now
+        if now >= self.budget_deadline:
+            return True
+        best = min(source_rank(pair_key, s) for s in answers)
+        return all(source_rank(pair_key, s) > best for s in waiting)
+
+    def is_needed(self, source, now=None):
+        """Нужен ли ещё ответ источника"""
+        expected = self._expected.get(source)
+        if not expected:
+            # Покрытие источника неизвестно: ждём его ответа
+            return True
+        return any(not self.is_settled(p, now) for p in expected)
+
+    def select(self):
+        """Итоговые курсы: {пара: (курс, источник, [источники ответов])}"""
+        selected = {}
+        for pair_key, answers in self.answers.items():
+            ranked = sorted(answers, key=lambda s: source_rank(pair_key, s))
+            if self.strategy == MEDIAN:
+                rate = statistics.median(answers.values())
+            else:
+                rate = answers[ranked[0]]
+            selected[pair_key] = (rate, ranked[0], ranked)
+        return selected
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+
+import requests
+
+from valutatrade_hub.core.utils import file_signature, write_json_atomic
+from valutatrade_hub.parser_service.config import config
+
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+def cache_key(url, params=None):
+    """Ключ записи кэша: хэш URL и параметров (ключи API не попадают в файл)"""
+    query = "&".join(f"{k}={v}" for k, v in sorted((params or {}).items()))
+    return hashlib.sha256(f"{url}?{query}".encode("utf-8")).hexdigest()
+
+
+def fresh_until_from_headers(headers, now=None):
+    """Определяет срок свежести ответа по Cache-Control/Expires (unix) или None"""
+    now = time.time() if now is None else now
+
+    cache_control = headers.get("Cache-Control", "")
+    if "no-store" in cache_control or "no-cache" in cache_control:
+        return None
+    match = _MAX_AGE_RE.search(cache_control)
+    if match:
+        return now + int(match.group(1))
+
+    expires = headers.get("Expires")
+    if expires:
+        try:
+            return parsedate_to_datetime(expires).timestamp()
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+def build_response(url, entry, status_code=200):
+    """Собирает requests.Response из сохранённой записи кэша"""
+    response = requests.Response()
+    response.status_code = status_code
+    response.url = url
+    response.encoding = "utf-8"
+    response._content = entry["body"].encode("utf-8")
+    response.headers["Content-Type"] = "application/json"
+    response.headers["X-Cache"] = "HIT"
+    return response
+
+
+class HttpResponseCache:
+    """
+    Файловый кэш HTTP-ответов провайдеров курсов.
+
+    Для каждого запроса хранит тело ответа, ETag, Last-Modified и момент,
+    до которого ответ считается свежим. Пока ответ свежий, сеть не нужна;
+    после — запрос уходит с If-None-Match/If-Modified-Since, и ответ 304
+    продлевает сохранённую запись.
+    """
+
+    def __init__(self, file_path=None):
+        """Инициализация кэша (файл читается лениво)"""
+        self._file_path = Path(file_path or config.HTTP_CACHE_FILE_PATH)
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._signature = None
+
+    def _refresh(self):
+        """Перечитывает файл кэша, если его изменил другой процесс"""
+        signature = file_signature(self._file_path)
+        if signature == self._signature:
+            return
+        entries = {}
+        if signature is not None:
+            try:
+                with open(self._file_path, "r", encoding="utf-8") as f:
+                    entries = json.load(f)
+            except (json.JSONDecodeError, IOError):
+                entries = {}
+        self._entries = entries
+        self._signature = signature
+
+    def get(self, key):
+        """Возвращает запись кэша или None"""
+        with self._lock:
+            self._refresh()
+            return self._entries.get(key)
+
+    def put(self, key, entry):
+        """Сохраняет запись кэша"""
+        with self._lock:
+            self._refresh()
+            self._entries[key] = entry
+            try:
+                write_json_atomic(self._file_path, self._entries, indent=None)
+            except (IOError, OSError):
+                # Кэш — оптимизация: ошибка записи не должна ломать обновление
+                return
+            self._signature = file_signature(self._file_path)
+
+    @staticmethod
+    def is_fresh(entry, now=None):
+        """Проверяет, можно ли отдать запись без обращения к сети"""
+        now = time.time() if now is None else now
+        fresh_until = entry.get("fresh_until")
+        return fresh_until is not None and now < fresh_until
+
+    @staticmethod
+    def conditional_headers(entry):
+        """Заголовки условного запроса для сохранённой записи"""
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+
+_http_cache = None
+_http_cache_lock = threading.Lock()
+
+
+def get_http_cache():
+    """Возвращает общий для процесса кэш HTTP-ответов"""
+    global _http_cache
+    if _http_cache is None:
+        with _http_cache_lock:
+            if _http_cache is None:
+                _http_cache = HttpResponseCache()
+    return _http_cache
@@ -0,0 +1,57 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from valutatrade_hub.parser_service.cassettes import CassetteAdapter
+from valutatrade_hub.parser_service.config import config
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def create_session(cassette_mode=None):
+    """
+    Создаёт HTTP-сессию с пулом keep-alive соединений и сжатием gzip.
+
+    При cassette_mode (по умолчанию CASSETTE_MODE) "record" или "replay"
+    транспортом служит CassetteAdapter.
+    """
+    session = requests.Session()
+    pool_options = {
+        "pool_connections": config.HTTP_POOL_CONNECTIONS,
+        "pool_maxsize": config.HTTP_POOL_MAXSIZE,
+        "pool_block": config.HTTP_POOL_BLOCK,
+    }
+    cassette_mode = config.CASSETTE_MODE if cassette_mode is None else cassette_mode
+    if cassette_mode:
+        adapter = CassetteAdapter(cassette_mode, **pool_options)
+    else:
+        adapter = HTTPAdapter(**pool_options)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({
+        "Accept-Encoding": "gzip, deflate",
+        "Connection": "keep-alive",
+        "User-Agent": config.HTTP_USER_AGENT,
+    })
+    return session
+
+
+def get_session():
+    """Возвращает общую для процесса HTTP-сессию (создаётся при первом вызове)"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+    return _session
+
+
+def reset_session():
+    """Закрывает общую сессию (следующий get_session() создаст новую)"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
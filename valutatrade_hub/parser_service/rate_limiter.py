@@ -0,0 +1,73 @@
+import threading
+import time
+
+from valutatrade_hub.core.exceptions import RateLimitExceeded
+from valutatrade_hub.core.logging_config import get_logger
+from valutatrade_hub.core.utils import locked_json_state
+from valutatrade_hub.parser_service.config import config
+
+logger = get_logger("parser_service")
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты запросов к одному источнику (token bucket).
+
+    Ведро вмещает capacity токенов и пополняется со скоростью refill_rate
+    токенов в секунду; каждый сетевой запрос забирает один токен. Состояние
+    хранится в общем файле под файловой блокировкой, поэтому квоту
+    провайдера делят все процессы, запускающие update-rates. Если токена
+    нет, запрос резервирует следующий и ждёт его, но не дольше max_wait;
+    иначе — RateLimitExceeded (запрос не выполняется).
+    """
+
+    def __init__(self, source, capacity, refill_rate, max_wait=None, state_path=None):  # noqa: E501
+        """Инициализация ведра для источника source"""
+        self.source = source
+        self.capacity = float(capacity)
+        self.refill_rate = float(refill_rate)
+        self.max_wait = config.RATE_LIMIT_MAX_WAIT if max_wait is None else max_wait
+        self._state_path = state_path or config.RATE_LIMIT_FILE_PATH
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Забирает токен (возможно, в долг); возвращает время ожидания"""
+        with self._lock, locked_json_state(self._state_path) as states:
+            now = time.time()
+            entry = states.get(self.source, {"tokens": self.capacity, "updated_at": now})  # noqa: E501
+            elapsed = max(0.0, now - entry["updated_at"])
+            tokens = min(self.capacity, entry["tokens"] + elapsed * self.refill_rate)
+
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / self.refill_rate
+            if wait > self.max_wait:
+                raise RateLimitExceeded(self.source, wait)
+
+            states[self.source] = {"tokens": tokens - 1, "updated_at": now}
+            return wait
+
+    def acquire(self):
+        """Ждёт токен перед сетевым запросом; возвращает время ожидания в секундах"""  # noqa: E501
+        wait = self._reserve()
+        if wait > 0:
+            logger.info(f"{self.source}: ожидание лимита запросов {wait:.2f} с")
+            time.sleep(wait)
+        return wait
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_rate_limiter(source):
+    """Возвращает общий для процесса ограничитель источника или None"""
+    limits = config.RATE_LIMITS.get(source)
+    if limits is None:
+        return None
+    with _buckets_lock:
+        if source not in _buckets:
+            _buckets[source] = TokenBucket(
+                source,
+                capacity=limits["capacity"],
+                refill_rate=limits["refill_per_second"],
+            )
+        return _buckets[source]
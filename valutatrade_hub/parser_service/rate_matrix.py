@@ -0,0 +1,114 @@
+import json
+import sys
+import tempfile
+from array import array
+from pathlib import Path
+
+from valutatrade_hub.parser_service.config import config
+
+
+class RateMatrix:
+    """
+    Плотная матрица кросс-курсов валюта × валюта.
+
+    Значение [i][j] — цена одной единицы валюты i в валюте j. Матрица
+    строится один раз при обновлении курсов из пар вида X_USD, поэтому
+    курс любой пары и смена базы — обращение по индексу.
+    """
+
+    def __init__(self, currencies, values, last_refresh=None):
+        """Инициализация матрицы (values — array('d') длины n * n)"""
+        self.currencies = list(currencies)
+        self.last_refresh = last_refresh
+        self._values = values
+        self._index = {code: i for i, code in enumerate(self.currencies)}
+
+    @classmethod
+    def from_pairs(cls, pairs, last_refresh=None):
+        """Строит матрицу из словаря пар {X_BASE: {"rate": ...}}"""
+        base = config.BASE_CURRENCY
+        base_prices = {base: 1.0}
+        for pair_key, pair_data in pairs.items():
+            code, _, quote = pair_key.partition("_")
+            rate = pair_data.get("rate")
+            if quote == base and rate:
+                base_prices[code] = float(rate)
+
+        currencies = sorted(base_prices)
+        prices = [base_prices[code] for code in currencies]
+        values = array("d", (a / b for a in prices for b in prices))
+        return cls(currencies, values, last_refresh)
+
+    def __contains__(self, currency_code):
+        """Проверяет, есть ли валюта в матрице"""
+        return currency_code in self._index
+
+    def rate(self, from_currency, to_currency):
+        """Возвращает курс from_currency в to_currency или None"""
+        i = self._index.get(from_currency)
+        j = self._index.get(to_currency)
+        if i is None or j is None:
+            return None
+        return self._values[i * len(self.currencies) + j]
+
+    def column(self, base_currency):
+        """Возвращает курсы всех валют в base_currency ({код: курс})"""
+        j = self._index.get(base_currency)
+        if j is None:
+            return {}
+        n = len(self.currencies)
+        return {code: self._values[i * n + j] for i, code in enumerate(self.currencies)}  # noqa: E501
+
+    def to_bytes(self):
+        """Сериализует матрицу: строка-заголовок JSON и массив float64 (LE)"""
+        header = json.dumps({
+            "currencies": self.currencies,
+            "last_refresh": self.last_refresh,
+        })
+        values = array("d", self._values)
+        if sys.byteorder == "big":
+            values.byteswap()
+        return header.encode("utf-8") + b"\n" + values.tobytes()
+
+    @classmethod
+    def from_bytes(cls, raw):
+        """Восстанавливает матрицу из результата to_bytes()"""
+        header, _, body = raw.partition(b"\n")
+        meta = json.loads(header)
+        values = array("d")
+        values.frombytes(body)
+        if sys.byteorder == "big":
+            values.byteswap()
+
+        currencies = meta["currencies"]
+        if len(values) != len(currencies) ** 2:
+            raise ValueError("Размер матрицы курсов не совпадает со списком валют")
+        return cls(currencies, values, meta.get("last_refresh"))
+
+
+def save_rate_matrix(matrix):
+    """Сохраняет матрицу кросс-курсов рядом с rates.json"""
+    matrix_file = Path(config.RATES_MATRIX_FILE_PATH)
+    matrix_file.parent.mkdir(parents=True, exist_ok=True)
+
+    try:
+        with tempfile.NamedTemporaryFile(mode="wb", delete=False, dir=matrix_file.parent) as tmp:  # noqa: E501
+            tmp.write(matrix.to_bytes())
+            tmp_path = tmp.name
+
+        Path(tmp_path).replace(matrix_file)
+    except (IOError, OSError) as e:
+        raise ValueError(f"Ошибка при сохранении матрицы курсов: {e}")
+
+
+def load_rate_matrix():
+    """Загружает матрицу кросс-курсов или None, если её нет"""
+    matrix_file = Path(config.RATES_MATRIX_FILE_PATH)
+
+    try:
+        with open(matrix_file, "rb") as f:
+            return RateMatrix.from_bytes(f.read())
+    except FileNotFoundError:
+        return None
+    except (json.JSONDecodeError, UnicodeDecodeError, KeyError, TypeError, IOError) as e:  # noqa: E501
+        raise ValueError(f"Ошибка при чтении матрицы курсов: {e}")
@@ -0,0 +1,136 @@
+import json
+import random
+import time
+
+from valutatrade_hub.core.exceptions import TransientApiError
+from valutatrade_hub.core.logging_config import get_logger
+from valutatrade_hub.core.utils import locked_json_state
+from valutatrade_hub.parser_service.config import config
+
+logger = get_logger("parser_service")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class RetryPolicy:
+    """Повторы запроса с экспоненциальной задержкой и полным джиттером"""
+
+    def __init__(self, attempts=None, base_delay=None, max_delay=None):
+        """Инициализация политики (по умолчанию — из ParserConfig)"""
+        self.attempts = max(1, attempts if attempts is not None else config.RETRY_ATTEMPTS)  # noqa: E501
+        self.base_delay = base_delay if base_delay is not None else config.RETRY_BASE_DELAY  # noqa: E501
+        self.max_delay = max_delay if max_delay is not None else config.RETRY_MAX_DELAY
+
+    def delay(self, attempt):
+        """Задержка перед повтором номер attempt (с 1)"""
+        ceiling = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(0, ceiling)
+
+    def call(self, func, deadline=None):
+        """
+        Вызывает func, повторяя при временных сбоях (TransientApiError).
+
+        Постоянные ошибки (ApiRequestError) пробрасываются сразу. Если
+        провайдер прислал Retry-After, повтор ждёт не меньше него.
+        deadline — момент time.monotonic(), после которого повторы не
+        начинаются.
+        """
+        for attempt in range(1, self.attempts + 1):
+            try:
+                return func()
+            except TransientApiError as e:
+                if attempt == self.attempts:
+                    raise
+                delay = self.delay(attempt)
+                if e.retry_after is not None:
+                    delay = max(delay, e.retry_after)
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    raise
+                logger.warning(f"Попытка {attempt} не удалась ({e}), повтор через {delay:.2f} с")  # noqa: E501
+                time.sleep(delay)
+
+
+class CircuitBreaker:
+    """
+    Автомат защиты для одного источника курсов.
+
+    После failure_threshold ошибок подряд источник считается нездоровым
+    (open), и вызовы к нему не выполняются reset_timeout секунд. Затем
+    пропускается одна пробная попытка (half_open): успех закрывает
+    автомат, ошибка снова открывает. Состояние хранится в файле, поэтому
+    его видят все процессы, запускающие update-rates.
+    """
+
+    def __init__(self, name, failure_threshold=None, reset_timeout=None, state_path=None):  # noqa: E501
+        """Инициализация автомата для источника name"""
+        self.name = name
+        self.failure_threshold = failure_threshold or config.BREAKER_FAILURE_THRESHOLD
+        self.reset_timeout = reset_timeout or config.BREAKER_RESET_TIMEOUT
+        self._state_path = state_path or config.CIRCUIT_BREAKER_FILE_PATH
+
+    def _read(self):
+        """Читает состояние автомата без блокировки"""
+        try:
+            with open(self._state_path, "r", encoding="utf-8") as f:
+                return json.load(f).get(self.name, {})
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _trial_due(self, entry):
+        """Истёк ли таймаут открытого автомата (или зависшей пробы)"""
+        return time.time() - entry.get("opened_at", 0) >= self.reset_timeout
+
+    @property
+    def state(self):
+        """Текущее состояние: closed, open или half_open (проба разрешена)"""
+        entry = self._read()
+        state = entry.get("state", CLOSED)
+        if state == CLOSED:
+            return CLOSED
+        return HALF_OPEN if self._trial_due(entry) else OPEN
+
+    def retry_after(self):
+        """Сколько секунд осталось до пробной попытки"""
+        entry = self._read()
+        if entry.get("state", CLOSED) == CLOSED:
+            return 0.0
+        return max(0.0, entry.get("opened_at", 0) + self.reset_timeout - time.time())
+
+    def allow(self):
+        """Разрешает вызов, если автомат закрыт или пришло время пробы"""
+        state = self.state
+        if state != HALF_OPEN:
+            return state == CLOSED
+
+        # Пробную попытку получает только один процесс
+        with locked_json_state(self._state_path) as states:
+            entry = states.get(self.name, {})
+            if entry.get("state", CLOSED) == CLOSED:
+                return True
+            if not self._trial_due(entry):
+                return False
+            entry["state"] = HALF_OPEN
+            entry["opened_at"] = time.time()
+            states[self.name] = entry
+        return True
+
+    def record_success(self):
+        """Закрывает автомат после успешного вызова"""
+        if not self._read():
+            return
+        with locked_json_state(self._state_path) as states:
+            states.pop(self.name, None)
+
+    def record_failure(self):
+        """Учитывает ошибку и открывает автомат при превышении порога"""
+        with locked_json_state(self._state_path) as states:
+            entry = states.get(self.name, {"state": CLOSED, "failures": 0})
+            entry["failures"] = entry.get("failures", 0) + 1
+            if entry.get("state") == HALF_OPEN or entry["failures"] >= self.failure_threshold:  # noqa: E501
+                if entry.get("state") != OPEN:
+                    logger.warning(f"{self.name}: автомат защиты открыт на {self.reset_timeout} с")  # noqa: E501
+                entry["state"] = OPEN
+                entry["opened_at"] = time.time()
+            states[self.name] = entry
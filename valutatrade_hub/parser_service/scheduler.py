@@ -0,0 +1,129 @@
+import random
+import signal
+import threading
+import time
+from contextlib import contextmanager
+
+from valutatrade_hub.core.logging_config import get_logger
+from valutatrade_hub.parser_service.config import config
+from valutatrade_hub.parser_service.storage import (
+    cache_age_seconds,
+    get_rates_snapshot,
+)
+from valutatrade_hub.parser_service.updater import source_name, source_ttl
+
+logger = get_logger("parser_service")
+
+
+class RatesScheduler:
+    """
+    Фоновое обновление курсов по TTL (режим update-rates --daemon).
+
+    У каждого источника свой TTL (ParserConfig.SOURCE_TTLS). Следующий
+    цикл планируется на момент, когда первый из источников достигнет доли
+    DAEMON_REFRESH_AHEAD своего TTL, — незадолго до устаревания, — и в
+    цикле опрашиваются только такие источники. К интервалу добавляется
+    джиттер, чтобы несколько демонов не обращались к провайдерам
+    одновременно; если источник обновил другой процесс, цикл сдвигается.
+    Для клиентов без TTL используется ttl_seconds. Остановка по
+    SIGINT/SIGTERM дожидается окончания текущего цикла.
+    """
+
+    def __init__(self, updater, ttl_seconds, refresh_ahead=None, jitter=None, min_interval=None):  # noqa: E501
+        """Инициализация планировщика для RatesUpdater"""
+        self.updater = updater
+        self.ttl_seconds = ttl_seconds
+        self.refresh_ahead = config.DAEMON_REFRESH_AHEAD if refresh_ahead is None else refresh_ahead  # noqa: E501
+        self.jitter = config.DAEMON_JITTER if jitter is None else jitter
+        self.min_interval = config.DAEMON_MIN_INTERVAL if min_interval is None else min_interval  # noqa: E501
+        self._stop_event = threading.Event()
+
+    @property
+    def stopped(self):
+        """Запрошена ли остановка"""
+        return self._stop_event.is_set()
+
+    def stop(self):
+        """Просит планировщик завершиться после текущего цикла"""
+        self._stop_event.set()
+
+    @contextmanager
+    def handle_signals(self):
+        """Переводит SIGINT/SIGTERM в мягкую остановку на время работы"""
+        handled = [signal.SIGINT]
+        if hasattr(signal, "SIGTERM"):
+            handled.append(signal.SIGTERM)
+
+        def on_signal(signum, frame):
+            logger.info(f"Получен сигнал {signum}, остановка после текущего цикла")
+            self.stop()
+
+        previous = {signum: signal.signal(signum, on_signal) for signum in handled}
+        try:
+            yield self
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+
+    def next_delay(self, first=False):
+        """Секунды до следующего цикла с учётом возраста источников и джиттера"""
+        delays = []
+        for client in self.updater.api_clients:
+            ttl = source_ttl(source_name(client), self.ttl_seconds)
+            remaining = self.updater.time_to_refresh(client, self.refresh_ahead)
+            if remaining is None:
+                age = cache_age_seconds(get_rates_snapshot().last_refresh)
+                remaining = 0.0 if age is None else ttl * self.refresh_ahead - age
+            delays.append((remaining, ttl))
+        
+        if not delays:
+            return float(self.min_interval)
+        
+        remaining, ttl = min(delays)
+        if remaining <= 0:
+            # Данные устарели: при запуске обновляем сразу, после
+            # неудачного цикла — не чаще min_interval
+            return 0.0 if first else float(self.min_interval)
+
+        # Джиттер только откладывает цикл, чтобы к его началу источник
+        # уже считался устаревшим
+        delay = remaining + random.uniform(0, self.jitter) * ttl
+        return max(float(self.min_interval), delay)
+
+    def run_cycle(self, number):
+        """Обновляет устаревшие источники и возвращает метрики цикла"""
+        started = time.perf_counter()
+        cycle = {"cycle": number, "total_pairs": 0, "failed": [], "error": None}
+        try:
+            result = self.updater.run_update(stale_only=True, refresh_ahead=self.refresh_ahead)  # noqa: E501
+            cycle["total_pairs"] = result["results"]["total_pairs"]
+            cycle["failed"] = [failure["client"] for failure in result["results"]["failed"]]  # noqa: E501
+            cycle["result"] = result
+        except Exception as e:
+            cycle["error"] = str(e)
+            logger.error(f"Цикл обновления {number} завершился ошибкой: {e}")
+        cycle["latency"] = round(time.perf_counter() - started, 3)
+        return cycle
+
+    def run(self, on_cycle=None, max_cycles=None):
+        """Обновляет курсы по расписанию до остановки; возвращает число циклов"""
+        delay = self.next_delay(first=True)
+        logger.info(f"Планировщик курсов запущен (TTL {self.ttl_seconds} с), первый цикл через {delay:.0f} с")  # noqa: E501
+
+        number = 0
+        while not self._stop_event.wait(delay):
+            number += 1
+            cycle = self.run_cycle(number)
+            delay = self.next_delay()
+            cycle["next_in"] = round(delay, 1)
+            logger.info(
+                f"Цикл {number}: {cycle['total_pairs']} курсов за {cycle['latency']:.2f} с, "  # noqa: E501
+                f"следующий через {delay:.0f} с"
+            )
+            if on_cycle is not None:
+                on_cycle(cycle)
+            if max_cycles is not None and number >= max_cycles:
+                break
+
+        logger.info(f"Планировщик курсов остановлен после {number} циклов")
+        return number
@@ -1,8 +1,31 @@
 import json
+import os
 import tempfile
+import threading
+import time
+from array import array
+from datetime import datetime
 from pathlib import Path
 
+from valutatrade_hub.core.logging_config import get_logger
+from valutatrade_hub.core.utils import file_lock, file_signature, locked_json_state
+from valutatrade_hub.parser_service.candles import compact_candles, rebuild_candles
 from valutatrade_hub.parser_service.config import config
+from valutatrade_hub.parser_service.rate_matrix import (
+    RateMatrix,
+    load_rate_matrix,
+    save_rate_matrix,
+)
+from valutatrade_hub.parser_service.timeseries import (
+    compact_timeseries,
+    parse_duration,
+    parse_retention_tiers,
+    rebuild_from_history,
+    retention_mode,
+    to_epoch_ms,
+)
+
+logger = get_logger("parser_service")
 
 
 def generate_rate_id(from_currency, to_currency, timestamp):
@@ -10,18 +33,15 @@ def generate_rate_id(from_currency, to_currency, timestamp):
     return f"{from_currency}_{to_currency}_{timestamp}Z"
 
 
-def save_to_history(rate_data):
-    """Сохраняет запись курса в exchange_rates.json (исторические данные)"""
-    history_file = Path(config.HISTORY_FILE_PATH)
-    history_file.parent.mkdir(parents=True, exist_ok=True)
-    
+def build_history_record(rate_data):
+    """Строит запись истории курсов из данных о курсе"""
     rate_id = generate_rate_id(
         rate_data["from_currency"],
         rate_data["to_currency"],
         rate_data["timestamp"]
     )
     
-    record = {
+    return {
         "id": rate_id,
         "from_currency": rate_data["from_currency"],
         "to_currency": rate_data["to_currency"],
@@ -30,26 +50,219 @@ def save_to_history(rate_data):
         "source": rate_data["source"],
         "meta": rate_data.get("meta", {})
     }
+
+
+def _migrate_legacy_history(history_file):
+    """Однократно переносит старый exchange_rates.json (массив) в JSON Lines"""
+    legacy_file = Path(config.LEGACY_HISTORY_FILE_PATH)
+    if history_file.exists() or not legacy_file.exists():
+        return
+    
+    with open(legacy_file, "r", encoding="utf-8") as f:
+        legacy_records = json.load(f)
+    
+    with tempfile.NamedTemporaryFile(mode="w", delete=False, encoding="utf-8", dir=history_file.parent) as tmp:  # noqa: E501
+        for record in legacy_records:
+            tmp.write(json.dumps(record, ensure_ascii=False) + "\n")
+        tmp_path = tmp.name
+    
+    Path(tmp_path).replace(history_file)
+    legacy_file.replace(legacy_file.with_name(legacy_file.name + ".migrated"))
+
+
+def append_history(records):
+    """Дописывает пачку записей в лог истории курсов одной операцией записи"""
+    if not records:
+        return
+    
+    history_file = Path(config.HISTORY_FILE_PATH)
+    history_file.parent.mkdir(parents=True, exist_ok=True)
+    
+    payload = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)  # noqa: E501
     
     try:
-        if history_file.exists():
-            with open(history_file, "r", encoding="utf-8") as f:
-                history = json.load(f)
-        else:
-            history = []
-        
-        history.append(record)
-        
-        with tempfile.NamedTemporaryFile(mode="w", delete=False, encoding="utf-8", dir=history_file.parent) as tmp:  # noqa: E501
-            json.dump(history, tmp, indent=2, ensure_ascii=False)
-            tmp_path = tmp.name
-        
-        Path(tmp_path).replace(history_file)
-        
+        # Блокировка общая с compact_history(), которая заменяет файл
+        with file_lock(history_file):
+            _migrate_legacy_history(history_file)
+            with open(history_file, "ab") as f:
+                # Если прошлая запись оборвалась, начинаем с новой строки
+                if f.tell() > 0:
+                    with open(history_file, "rb") as tail:
+                        tail.seek(-1, os.SEEK_END)
+                        if tail.read(1) != b"\n":
+                            payload = "\n" + payload
+                f.write(payload.encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
     except (json.JSONDecodeError, IOError, OSError) as e:
         raise ValueError(f"Ошибка при сохранении в историю: {e}")
 
 
+def save_to_history(rate_data):
+    """Сохраняет запись курса в лог истории (exchange_rates.jsonl)"""
+    append_history([build_history_record(rate_data)])
+
+
+def iter_history(history_path=None):
+    """Построчно читает лог истории курсов, не загружая его целиком"""
+    history_file = Path(history_path or config.HISTORY_FILE_PATH)
+    if not history_file.exists():
+        return
+    
+    try:
+        with open(history_file, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # Оборванная строка после сбоя записи пропускается
+                    continue
+    except IOError as e:
+        raise ValueError(f"Ошибка при чтении истории курсов: {e}")
+
+
+def _downsample_history(records, tiers, now_ms):
+    """
+    Прореживает поток записей истории по уровням хранения.
+
+    В прореживаемом уровне от каждой пары за интервал остаётся последняя
+    запись (в meta — интервал и число исходных записей). Записи текущего
+    интервала держатся в памяти до начала следующего и выводятся по
+    времени, поэтому порядок файла сохраняется, а память — O(число пар).
+    """
+    intervals = {mode: parse_duration(mode) for _, mode in tiers if mode not in ("raw", "drop")}  # noqa: E501
+    held = {}
+    held_key = None
+    
+    def flush():
+        for _, record in sorted(held.values(), key=lambda item: item[0]):
+            yield record
+        held.clear()
+    
+    for record in records:
+        try:
+            timestamp = to_epoch_ms(record["timestamp"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        mode = retention_mode(tiers, now_ms - timestamp)
+        if mode == "drop":
+            continue
+        if mode == "raw":
+            yield from flush()
+            yield record
+            continue
+        
+        key = (mode, timestamp - timestamp % intervals[mode])
+        if key != held_key:
+            yield from flush()
+            held_key = key
+        
+        pair_key = f"{record.get('from_currency')}_{record.get('to_currency')}"
+        meta = record.get("meta") or {}
+        # Уже прореженная запись учитывает свои исходные записи
+        samples = meta.get("samples", 1)
+        if pair_key in held:
+            samples += held[pair_key][1]["meta"]["samples"]
+        held[pair_key] = (timestamp, {**record, "meta": {**meta, "downsampled": mode, "samples": samples}})  # noqa: E501
+    
+    yield from flush()
+
+
+def compact_history(tiers=None, now=None, dry_run=False):
+    """
+    Прореживает историю курсов по уровням хранения.
+
+    Лог истории читается потоком и переписывается во временный файл,
+    который атомарно заменяет исходный; дозапись истории на это время
+    ждёт блокировку. Те же уровни применяются к временным рядам
+    (compact_timeseries), устаревшие свечи удаляются по CANDLE_RETENTION.
+    tiers — строка уровней (по умолчанию HISTORY_RETENTION); при dry_run
+    файлы не пишутся, только считаются. Возвращает отчёт: записи и байты
+    лога до/после, отчёты по рядам и свечам и освобождённые байты.
+    """
+    tiers = parse_retention_tiers(tiers or config.HISTORY_RETENTION)
+    now_ms = to_epoch_ms(now) if now is not None else int(time.time() * 1000)
+    history_file = Path(config.HISTORY_FILE_PATH)
+    history_file.parent.mkdir(parents=True, exist_ok=True)
+    
+    report = {"records_before": 0, "records_after": 0, "bytes_before": 0, "bytes_after": 0}  # noqa: E501
+    
+    def counted(records):
+        for record in records:
+            report["records_before"] += 1
+            yield record
+    
+    def encoded():
+        for record in _downsample_history(counted(iter_history(history_file)), tiers, now_ms):  # noqa: E501
+            line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+            report["records_after"] += 1
+            report["bytes_after"] += len(line)
+            yield line
+    
+    try:
+        with file_lock(history_file):
+            _migrate_legacy_history(history_file)
+            if history_file.exists():
+                report["bytes_before"] = history_file.stat().st_size
+                if dry_run:
+                    for _ in encoded():
+                        pass
+                else:
+                    with tempfile.NamedTemporaryFile(mode="wb", delete=False, dir=history_file.parent) as tmp:  # noqa: E501
+                        tmp_path = Path(tmp.name)
+                        try:
+                            tmp.writelines(encoded())
+                            tmp.flush()
+                            os.fsync(tmp.fileno())
+                        except BaseException:
+                            tmp_path.unlink(missing_ok=True)
+                            raise
+                    # Временный файл создаётся с правами 0600
+                    tmp_path.chmod(history_file.stat().st_mode & 0o777)
+                    tmp_path.replace(history_file)
+    except (IOError, OSError) as e:
+        raise ValueError(f"Ошибка при сжатии истории курсов: {e}")
+    
+    report["timeseries"] = compact_timeseries(tiers, now_ms, dry_run=dry_run)
+    report["candles"] = compact_candles(now_ms, dry_run=dry_run)
+    report["reclaimed"] = sum(
+        part["bytes_before"] - part["bytes_after"]
+        for part in (report, report["timeseries"], report["candles"])
+    )
+    return report
+
+
+def rebuild_timeseries():
+    """
+    Заново строит временные ряды и свечи из лога истории курсов.
+
+    Нужна для истории, накопленной до появления рядов, и после ручной
+    правки лога. Лог читается под его блокировкой, поэтому обновление
+    курсов дождётся окончания сборки и допишет ряды после неё.
+    Возвращает {pairs, records}.
+    """
+    history_file = Path(config.HISTORY_FILE_PATH)
+    history_file.parent.mkdir(parents=True, exist_ok=True)
+    report = {"pairs": 0, "records": 0}
+    
+    def counted(records):
+        for record in records:
+            report["records"] += 1
+            yield record
+    
+    try:
+        with file_lock(history_file):
+            _migrate_legacy_history(history_file)
+            report["pairs"] = rebuild_from_history(counted(iter_history(history_file)))  # noqa: E501
+            rebuild_candles(iter_history(history_file))
+    except (IOError, OSError, KeyError, TypeError) as e:
+        raise ValueError(f"Ошибка при сборке временных рядов: {e}")
+    return report
+
+
 def update_rates_cache(rates_data):
     """Обновляет rates.json (текущий кэш курсов)"""
     rates_file = Path(config.RATES_FILE_PATH)
@@ -66,6 +279,49 @@ def update_rates_cache(rates_data):
         raise ValueError(f"Ошибка при обновлении кэша курсов: {e}")
 
 
+def merge_rates_cache(pairs_data, last_refresh, refreshed_sources=()):
+    """
+    Дописывает пары в rates.json, сохраняя пары других источников.
+
+    Чтение, слияние и запись идут под файловой блокировкой, поэтому
+    одновременные обновления разных источников не теряют пары друг друга.
+    Для refreshed_sources запоминается время обновления (раздел
+    "sources"). Матрица кросс-курсов сохраняется до замены rates.json.
+    Повреждённый rates.json — ошибка: пустой кэш вместо него потерял бы
+    пары и время обновления остальных источников. Возвращает итоговое
+    содержимое кэша.
+    """
+    try:
+        with locked_json_state(config.RATES_FILE_PATH, strict=True) as rates_data:
+            pairs = rates_data.setdefault("pairs", {})
+            pairs.update(pairs_data)
+            rates_data["last_refresh"] = last_refresh
+            sources = rates_data.setdefault("sources", {})
+            for source in refreshed_sources:
+                sources[source] = {"last_refresh": last_refresh}
+            
+            try:
+                save_rate_matrix(RateMatrix.from_pairs(pairs, last_refresh))
+            except ValueError as e:
+                logger.warning(f"Не удалось сохранить матрицу кросс-курсов: {e}")
+            
+            return dict(rates_data)
+    except (IOError, OSError) as e:
+        raise ValueError(f"Ошибка при обновлении кэша курсов: {e}")
+
+
+def cache_age_seconds(timestamp, now=None):
+    """Возраст отметки времени кэша (ISO, UTC) в секундах или None"""
+    if not timestamp:
+        return None
+    try:
+        refreshed_at = datetime.fromisoformat(timestamp.rstrip("Z"))
+    except (TypeError, ValueError):
+        return None
+    now = datetime.utcnow() if now is None else now
+    return max(0.0, (now - refreshed_at).total_seconds())
+
+
 def load_rates_cache():
     """ Загружает rates.json (текущий кэш курсов)"""
     rates_file = Path(config.RATES_FILE_PATH)
@@ -78,3 +334,129 @@ def load_rates_cache():
             return json.load(f)
     except (json.JSONDecodeError, IOError) as e:
         raise ValueError(f"Ошибка при чтении кэша курсов: {e}")
+
+
+class RatesSnapshot:
+    """
+    Снимок rates.json в памяти процесса.
+
+    Файл разбирается один раз; при следующих обращениях проверяются только
+    mtime и размер, и файл перечитывается лишь после их изменения. Вместе
+    с файлом берётся матрица кросс-курсов того же обновления (или строится
+    из пар, если её нет), поэтому курс любой пары — обращение по индексу.
+    """
+    
+    def __init__(self):
+        """Инициализация снимка (файл читается лениво)"""
+        self._lock = threading.Lock()
+        self._path = None
+        self._signature = None
+        self._data = {"pairs": {}, "last_refresh": None}
+        self._matrix = RateMatrix([], array("d"))
+    
+    def _refresh(self):
+        """Перечитывает rates.json, если он изменился"""
+        rates_file = Path(config.RATES_FILE_PATH)
+        signature = file_signature(rates_file)
+        if rates_file == self._path and signature == self._signature:
+            return
+        
+        with self._lock:
+            if rates_file == self._path and signature == self._signature:
+                return
+            data = load_rates_cache()
+            last_refresh = data.get("last_refresh")
+            
+            try:
+                matrix = load_rate_matrix()
+            except ValueError as e:
+                # Матрица — производный кэш: повреждённую строим заново из пар
+                logger.warning(f"Матрица кросс-курсов повреждена, строится из rates.json: {e}")  # noqa: E501
+                matrix = None
+            if matrix is None or matrix.last_refresh != last_refresh:
+                matrix = RateMatrix.from_pairs(data.get("pairs", {}), last_refresh)
+            
+            self._data = data
+            self._matrix = matrix
+            self._path = rates_file
+            self._signature = signature
+    
+    @property
+    def data(self):
+        """Содержимое rates.json (не изменять)"""
+        self._refresh()
+        return self._data
+    
+    @property
+    def matrix(self):
+        """Матрица кросс-курсов, соответствующая текущему rates.json"""
+        self._refresh()
+        return self._matrix
+    
+    @property
+    def pairs(self):
+        """Словарь пар из rates.json (не изменять)"""
+        return self.data.get("pairs", {})
+    
+    @property
+    def last_refresh(self):
+        """Время последнего обновления кэша"""
+        return self.data.get("last_refresh")
+    
+    def source_age(self, source):
+        """Возраст последнего обновления источника в секундах или None"""
+        entry = self.data.get("sources", {}).get(source)
+        return cache_age_seconds(entry.get("last_refresh")) if entry else None
+    
+    def get_pair(self, pair_key):
+        """Возвращает данные пары ({rate, updated_at, source}) или None"""
+        return self.pairs.get(pair_key)
+    
+    def get_rate(self, currency_code, base_currency="USD"):
+        """Возвращает курс currency_code в base_currency или None"""
+        if currency_code == base_currency:
+            return 1.0
+        
+        rate = self.matrix.rate(currency_code, base_currency)
+        if rate is not None:
+            return rate
+        
+        pair = self.get_pair(f"{currency_code}_{base_currency}")
+        return pair["rate"] if pair else None
+    
+    def get_quote(self, currency_code, base_currency="USD"):
+        """
+        Возвращает курс с метаданными или None.
+
+        {"rate", "updated_at", "sources"}: для кросс-курса через базовую
+        валюту updated_at — время более старой из двух пар.
+        """
+        rate = self.get_rate(currency_code, base_currency)
+        if rate is None:
+            return None
+        
+        direct = self.get_pair(f"{currency_code}_{base_currency}")
+        if direct is not None:
+            legs = [direct]
+        else:
+            legs = [
+                self.get_pair(f"{code}_{config.BASE_CURRENCY}")
+                for code in (currency_code, base_currency)
+                if code != config.BASE_CURRENCY
+            ]
+            legs = [leg for leg in legs if leg is not None]
+        
+        updated = [leg["updated_at"] for leg in legs if leg.get("updated_at")]
+        return {
+            "rate": rate,
+            "updated_at": min(updated) if updated else self.last_refresh,
+            "sources": sorted({leg["source"] for leg in legs if leg.get("source")}),
+        }
+
+
+_rates_snapshot = RatesSnapshot()
+
+
+def get_rates_snapshot():
+    """Возвращает общий для процесса снимок rates.json"""
+    return _rates_snapshot
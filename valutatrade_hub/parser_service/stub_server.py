@@ -0,0 +1,285 @@
+"""
+Локальный заменитель провайдеров курсов с внедрением сбоев.
+
+Эмулирует CoinGecko /api/v3/simple/price и ExchangeRate-API
+/v6/<key>/latest/<base> для нагрузочной проверки обновления курсов без
+сети. Запуск:
+
+    python -m valutatrade_hub.parser_service.stub_server --port 8080 \\
+        --latency lognormal:0.05:0.8 --error-rate 0.05 --rate-limit-rate 0.1
+
+и затем, например, в .env:
+
+    COINGECKO_URL=http://127.0.0.1:8080/api/v3/simple/price
+    EXCHANGERATE_API_URL=http://127.0.0.1:8080/v6
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from valutatrade_hub.parser_service.cassettes import synthetic_universe
+from valutatrade_hub.parser_service.config import config
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "exponential", "lognormal")
+
+
+class LatencyModel:
+    """
+    Распределение задержки ответа.
+
+    Задаётся строкой: "fixed:0.05", "uniform:0.01:0.2", "exponential:0.1"
+    (среднее) или "lognormal:0.05:0.8" (медиана и sigma — тяжёлый хвост).
+    """
+
+    def __init__(self, spec="fixed:0"):
+        """Разбирает описание распределения"""
+        kind, _, params = spec.partition(":")
+        if kind not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Неизвестное распределение задержки '{kind}'")
+        try:
+            self.params = [float(p) for p in params.split(":")] if params else [0.0]
+        except ValueError:
+            raise ValueError(f"Некорректные параметры задержки '{spec}'")
+        expected = 2 if kind in ("uniform", "lognormal") else 1
+        if len(self.params) != expected:
+            raise ValueError(f"Для '{kind}' нужно параметров: {expected}")
+        self.kind = kind
+        self.spec = spec
+
+    def sample(self, rng):
+        """Случайная задержка в секундах"""
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return rng.uniform(*self.params)
+        if self.kind == "exponential":
+            return rng.expovariate(1 / self.params[0]) if self.params[0] > 0 else 0.0
+        median, sigma = self.params
+        return rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+
+
+class FaultProfile:
+    """Параметры сбоев: задержка и доли ошибок 500, ответов 429 и зависаний"""
+
+    def __init__(self, latency="fixed:0", error_rate=0.0, rate_limit_rate=0.0,
+                 hang_rate=0.0, hang_seconds=30.0, retry_after=1, extra_fiat=0,
+                 seed=None):
+        """Инициализация профиля (extra_fiat — дополнительные валюты в ответе)"""
+        for name, rate in (("error_rate", error_rate), ("rate_limit_rate", rate_limit_rate), ("hang_rate", hang_rate)):  # noqa: E501
+            if not 0 <= rate <= 1:
+                raise ValueError(f"{name} должен быть в диапазоне [0, 1]")
+        if error_rate + rate_limit_rate + hang_rate > 1:
+            raise ValueError("Сумма долей сбоев не может превышать 1")
+        self.latency = LatencyModel(latency) if isinstance(latency, str) else latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.retry_after = retry_after
+        self.extra_fiat = extra_fiat
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self):
+        """Выбирает исход запроса: (задержка, "ok" | "error" | "rate_limit" | "hang")"""  # noqa: E501
+        with self._lock:
+            delay = self.latency.sample(self._rng)
+            roll = self._rng.random()
+        if roll < self.error_rate:
+            return delay, "error"
+        roll -= self.error_rate
+        if roll < self.rate_limit_rate:
+            return delay, "rate_limit"
+        roll -= self.rate_limit_rate
+        if roll < self.hang_rate:
+            return self.hang_seconds, "hang"
+        return delay, "ok"
+
+
+def _price(identifier, low, high):
+    """Стабильная цена для id с небольшим шумом от запроса к запросу"""
+    digest = int(hashlib.sha256(identifier.encode("utf-8")).hexdigest()[:8], 16)
+    base = low + (high - low) * digest / 0xFFFFFFFF
+    return round(base * random.uniform(0.995, 1.005), 6)
+
+
+def _units_per_usd(currency):
+    """Сколько единиц валюты стоит 1 USD в эмуляции провайдеров"""
+    currency = currency.upper()
+    return 1.0 if currency == "USD" else _price(currency, 0.1, 5000)
+
+
+class StubProviderHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов к эмулируемым эндпоинтам"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        """Журнал запросов отключён: сервер используется под нагрузкой"""
+
+    def _send_json(self, status, payload, headers=None):
+        """Отправляет JSON-ответ"""
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """Отвечает на simple/price и latest с учётом профиля сбоев"""
+        server = self.server
+        server.count("requests")
+        parts = urlsplit(self.path)
+        segments = [s for s in parts.path.split("/") if s]
+
+        delay, outcome = server.profile.draw()
+        if delay > 0:
+            time.sleep(delay)
+
+        if outcome == "hang":
+            server.count("hangs")
+            self.close_connection = True
+            return
+        if outcome == "error":
+            server.count("errors")
+            self._send_json(500, {"error": "injected failure"})
+            return
+        if outcome == "rate_limit":
+            server.count("rate_limited")
+            self._send_json(429, {"status": {"error_code": 429, "error_message": "rate limit"}},  # noqa: E501
+                            {"Retry-After": str(server.profile.retry_after)})
+            return
+
+        if parts.path.endswith("/simple/price"):
+            self._simple_price(parse_qs(parts.query))
+        elif len(segments) >= 4 and segments[-2] == "latest":
+            self._latest(segments[-1])
+        else:
+            server.count("not_found")
+            self._send_json(404, {"error": "not found"})
+
+    def _simple_price(self, query):
+        """Эмуляция CoinGecko simple/price: цена для любого запрошенного id"""
+        ids = [i for i in query.get("ids", [""])[0].split(",") if i]
+        vs = query.get("vs_currencies", ["usd"])[0].split(",")
+        # Цены в разных валютах согласованы с курсами эмуляции ExchangeRate-API
+        payload = {
+            crypto_id: {currency: _price(crypto_id, 0.01, 50000) * _units_per_usd(currency) for currency in vs}  # noqa: E501
+            for crypto_id in ids
+        }
+        self.server.count("ok")
+        self._send_json(200, payload, {"Cache-Control": "max-age=0"})
+
+    def _latest(self, base):
+        """Эмуляция ExchangeRate-API latest: фиатные валюты и дополнительные"""
+        codes = list(config.FIAT_CURRENCIES) + self.server.extra_codes
+        rates = {base: 1}
+        rates.update({code: _units_per_usd(code) / _units_per_usd(base) for code in codes if code != base})  # noqa: E501
+        now = int(time.time())
+        self.server.count("ok")
+        self._send_json(200, {
+            "result": "success",
+            "base_code": base,
+            "time_last_update_unix": now,
+            "time_next_update_unix": now + 24 * 3600,
+            "conversion_rates": rates,
+        })
+
+
+class StubProviderServer(ThreadingHTTPServer):
+    """HTTP-сервер-заменитель провайдеров со счётчиками исходов"""
+
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), profile=None):
+        """Инициализация сервера (порт 0 — свободный порт)"""
+        super().__init__(address, StubProviderHandler)
+        self.profile = profile or FaultProfile()
+        self.extra_codes = [
+            entry["code"] for entry in synthetic_universe(0, self.profile.extra_fiat)["fiat"]  # noqa: E501
+        ]
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        """Адрес сервера вида http://127.0.0.1:8080"""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def coingecko_url(self):
+        """Значение для COINGECKO_URL"""
+        return f"{self.base_url}/api/v3/simple/price"
+
+    @property
+    def exchangerate_api_url(self):
+        """Значение для EXCHANGERATE_API_URL"""
+        return f"{self.base_url}/v6"
+
+    def count(self, key):
+        """Увеличивает счётчик исхода"""
+        with self._stats_lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def start_in_thread(self):
+        """Запускает сервер в фоновом потоке (для тестов в одном процессе)"""
+        thread = threading.Thread(target=self.serve_forever, name="stub-provider", daemon=True)  # noqa: E501
+        thread.start()
+        return thread
+
+
+def main(argv=None):
+    """Запуск сервера из командной строки (до Ctrl+C или SIGTERM)"""
+    parser = argparse.ArgumentParser(description="Локальный заменитель CoinGecko и ExchangeRate-API")  # noqa: E501
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", default="fixed:0", help="fixed:S | uniform:A:B | exponential:MEAN | lognormal:MEDIAN:SIGMA")  # noqa: E501
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 500")  # noqa: E501
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Доля ответов 429")  # noqa: E501
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="Доля зависших запросов")  # noqa: E501
+    parser.add_argument("--hang-seconds", type=float, default=30.0, help="Длительность зависания, с")  # noqa: E501
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After для 429, с")  # noqa: E501
+    parser.add_argument("--extra-fiat", type=int, default=0, help="Дополнительные валюты в ответе latest (размер ответа)")  # noqa: E501
+    parser.add_argument("--seed", type=int, help="Зерно генератора сбоев")
+    args = parser.parse_args(argv)
+
+    try:
+        profile = FaultProfile(
+            latency=args.latency,
+            error_rate=args.error_rate,
+            rate_limit_rate=args.rate_limit_rate,
+            hang_rate=args.hang_rate,
+            hang_seconds=args.hang_seconds,
+            retry_after=args.retry_after,
+            extra_fiat=args.extra_fiat,
+            seed=args.seed,
+        )
+    except ValueError as e:
+        parser.error(str(e))
+
+    server = StubProviderServer((args.host, args.port), profile)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    print(f"COINGECKO_URL={server.coingecko_url}")
+    print(f"EXCHANGERATE_API_URL={server.exchangerate_api_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Статистика: {json.dumps(server.stats, ensure_ascii=False)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,470 @@
+import mmap
+import os
+import re
+import struct
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from valutatrade_hub.core.utils import file_lock
+from valutatrade_hub.parser_service.config import config
+
+# timestamp (мс от эпохи, UTC), курс, id источника, выравнивание до 24 байт
+RECORD = struct.Struct("<qdI4x")
+_TIMESTAMP = struct.Struct("<q")
+
+_DURATION_RE = re.compile(r"^(\d+)([smhdw])$")
+_DURATION_UNITS = {"s": 1000, "m": 60_000, "h": 3_600_000, "d": 86_400_000, "w": 604_800_000}  # noqa: E501
+
+
+def to_epoch_ms(value):
+    """Переводит datetime или ISO-строку (в т.ч. с суффиксом Z) в мс от эпохи"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.rstrip("Z"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+def from_epoch_ms(value):
+    """Переводит мс от эпохи в ISO-строку UTC с суффиксом Z"""
+    moment = datetime.fromtimestamp(value / 1000, tz=timezone.utc)
+    return moment.replace(tzinfo=None).isoformat() + "Z"
+
+
+def parse_duration(value):
+    """Переводит длительность вида 15m, 4h, 7d или 2w в миллисекунды"""
+    match = _DURATION_RE.match(value.strip().lower())
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Некорректная длительность '{value}' (ожидается, например, 15m, 4h, 7d)")  # noqa: E501
+    return int(match.group(1)) * _DURATION_UNITS[match.group(2)]
+
+
+def parse_moment(value, now_ms=None):
+    """Переводит ISO-время или длительность назад от текущего момента (7d) в мс"""
+    now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+    if isinstance(value, str) and _DURATION_RE.match(value.strip().lower()):
+        return now_ms - parse_duration(value)
+    try:
+        return to_epoch_ms(value)
+    except ValueError:
+        raise ValueError(f"Некорректное время '{value}' (ожидается ISO 8601 или длительность, например 7d)")  # noqa: E501
+
+
+def parse_retention_tiers(spec):
+    """
+    Разбирает уровни хранения истории вида "7d:raw,365d:1h,*:1d".
+
+    Каждый уровень — "возраст:режим": записи моложе возраста хранятся в
+    режиме raw (все), <длительность> (последняя запись пары за интервал)
+    или drop (удаляются); "*" — все более старые записи. Записи старше
+    последнего уровня без "*" удаляются. Возвращает [(возраст_мс или
+    None, режим)].
+    """
+    tiers = []
+    for part in (p.strip() for p in spec.split(",") if p.strip()):
+        age, _, mode = part.partition(":")
+        mode = mode.strip().lower()
+        if not mode:
+            raise ValueError(f"Некорректный уровень хранения '{part}' (ожидается возраст:режим)")  # noqa: E501
+        if tiers and tiers[-1][0] is None:
+            raise ValueError("Уровень '*' должен быть последним")
+        max_age = None if age.strip() == "*" else parse_duration(age)
+        if max_age is not None and tiers and max_age <= tiers[-1][0]:
+            raise ValueError("Возраст уровней хранения должен возрастать")
+        if mode not in ("raw", "drop"):
+            parse_duration(mode)
+        tiers.append((max_age, mode))
+    if not tiers:
+        raise ValueError("Не заданы уровни хранения истории")
+    return tiers
+
+
+def retention_mode(tiers, age):
+    """Режим хранения записи возраста age (мс)"""
+    for max_age, mode in tiers:
+        if max_age is None or age < max_age:
+            return mode
+    return "drop"
+
+
+def _thin_records(records, tiers, now_ms):
+    """Прореживает упорядоченные записи одного ряда: в интервале — последняя"""
+    intervals = {mode: parse_duration(mode) for _, mode in tiers if mode not in ("raw", "drop")}  # noqa: E501
+    held = held_key = None
+    for record in records:
+        timestamp = record[0]
+        mode = retention_mode(tiers, now_ms - timestamp)
+        if mode == "drop":
+            continue
+        key = None if mode == "raw" else (mode, timestamp - timestamp % intervals[mode])
+        if held is not None and key != held_key:
+            yield held
+            held = None
+        if key is None:
+            yield record
+        else:
+            held, held_key = record, key
+    if held is not None:
+        yield held
+
+
+def source_id(source):
+    """Возвращает числовой id источника для бинарной записи"""
+    return config.SOURCE_IDS.get(source, 0)
+
+
+def source_name(source_code):
+    """Возвращает имя источника по числовому id"""
+    for name, code in config.SOURCE_IDS.items():
+        if code == source_code:
+            return name
+    return "Unknown"
+
+
+class RateSeries:
+    """
+    Временной ряд курса одной пары в бинарном файле фиксированной ширины.
+
+    Записи (timestamp, rate, source_id) упорядочены по времени и читаются
+    через mmap без копирования файла; поиск по времени — бинарный, поэтому
+    запросы по диапазону и «на момент» выполняются за O(log n). Формат
+    записи задаёт атрибут record (первое поле — timestamp в мс).
+    """
+
+    record = RECORD
+
+    def __init__(self, path):
+        """Инициализация ряда"""
+        self._path = Path(path)
+
+    def __len__(self):
+        """Количество записей в ряду"""
+        try:
+            return os.path.getsize(self._path) // self.record.size
+        except FileNotFoundError:
+            return 0
+
+    def append(self, records):
+        """Дописывает записи (timestamp_ms, rate, source_id) в конец ряда"""
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            # Блокировка общая с compact(), который заменяет файл целиком
+            with file_lock(self._path), open(self._path, "a+b") as f:
+                size = f.seek(0, os.SEEK_END)
+                # Обрезаем оборванную запись, оставшуюся после сбоя
+                if size % self.record.size:
+                    size -= size % self.record.size
+                    f.truncate(size)
+
+                last_ts = None
+                if size:
+                    f.seek(size - self.record.size)
+                    last_ts = self.record.unpack(f.read(self.record.size))[0]
+
+                chunk = bytearray()
+                for timestamp, rate, source_code in sorted(records):
+                    # Ряд должен оставаться упорядоченным для бинарного поиска
+                    if last_ts is not None and timestamp < last_ts:
+                        continue
+                    chunk += self.record.pack(timestamp, rate, source_code)
+                    last_ts = timestamp
+
+                f.seek(0, os.SEEK_END)
+                f.write(chunk)
+        except (IOError, OSError) as e:
+            raise ValueError(f"Ошибка при записи временного ряда {self._path}: {e}")
+
+    def _open(self):
+        """Открывает файл ряда через mmap (None, если ряд пуст)"""
+        try:
+            with open(self._path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size < self.record.size:
+                    return None, 0
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None, 0
+        except (IOError, OSError) as e:
+            raise ValueError(f"Ошибка при чтении временного ряда {self._path}: {e}")
+        return mapped, size // self.record.size
+
+    def _bisect(self, mapped, count, timestamp, right=False, lo=0):
+        """Бинарный поиск позиции timestamp (как bisect_left/bisect_right)"""
+        hi = count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = _TIMESTAMP.unpack_from(mapped, mid * self.record.size)[0]
+            if value < timestamp or (right and value == timestamp):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _write_file(self, chunks):
+        """Пишет байты chunks во временный файл и атомарно заменяет им ряд"""
+        with tempfile.NamedTemporaryFile(mode="wb", delete=False, dir=self._path.parent) as tmp:  # noqa: E501
+            tmp_path = Path(tmp.name)
+            try:
+                tmp.writelines(chunks)
+                tmp.flush()
+                os.fsync(tmp.fileno())
+            except BaseException:
+                tmp_path.unlink(missing_ok=True)
+                raise
+        # Права как у файлов, создаваемых append()
+        tmp_path.chmod(0o644)
+        tmp_path.replace(self._path)
+
+    def replace(self, records):
+        """Атомарно заменяет содержимое ряда упорядоченными записями records"""
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            with file_lock(self._path):
+                self._write_file(self.record.pack(*record) for record in records)
+        except (IOError, OSError) as e:
+            raise ValueError(f"Ошибка при записи временного ряда {self._path}: {e}")
+
+    def compact(self, tiers, now_ms, dry_run=False):
+        """
+        Применяет уровни хранения к ряду; возвращает (байт до, байт после).
+
+        Свежие записи первого уровня raw копируются как есть, более старый
+        префикс прореживается (_thin_records). Новый файл пишется рядом и
+        атомарно заменяет ряд под той же блокировкой, что и append();
+        при dry_run только считается размер.
+        """
+        try:
+            with file_lock(self._path):
+                mapped, count = self._open()
+                if mapped is None:
+                    return 0, 0
+                try:
+                    size = count * self.record.size
+                    keep_from = count
+                    max_age, mode = tiers[0]
+                    if mode == "raw":
+                        keep_from = 0 if max_age is None else self._bisect(mapped, count, now_ms - max_age)  # noqa: E501
+                    prefix = [self.record.unpack_from(mapped, i * self.record.size) for i in range(keep_from)]  # noqa: E501
+                    thinned = list(_thin_records(prefix, tiers, now_ms))
+                    bytes_after = size - (len(prefix) - len(thinned)) * self.record.size  # noqa: E501
+                    if dry_run or len(thinned) == len(prefix):
+                        return size, bytes_after
+                    suffix = mapped[keep_from * self.record.size:size]
+                finally:
+                    mapped.close()
+                self._write_file([
+                    b"".join(self.record.pack(*record) for record in thinned),
+                    suffix,
+                ])
+                return size, bytes_after
+        except (IOError, OSError) as e:
+            raise ValueError(f"Ошибка при сжатии временного ряда {self._path}: {e}")
+
+    def range(self, start=None, end=None):
+        """Итерирует записи с start <= timestamp <= end (границы в мс)"""
+        mapped, count = self._open()
+        if mapped is None:
+            return
+        try:
+            first = 0 if start is None else self._bisect(mapped, count, start)
+            last = count if end is None else self._bisect(mapped, count, end, right=True)  # noqa: E501
+            for index in range(first, last):
+                yield self.record.unpack_from(mapped, index * self.record.size)
+        finally:
+            mapped.close()
+
+    def first(self):
+        """Возвращает первую запись ряда или None"""
+        mapped, count = self._open()
+        if mapped is None:
+            return None
+        try:
+            return self.record.unpack_from(mapped, 0)
+        finally:
+            mapped.close()
+
+    def as_of(self, timestamp):
+        """Возвращает последнюю запись с timestamp не позже заданного или None"""
+        mapped, count = self._open()
+        if mapped is None:
+            return None
+        try:
+            index = self._bisect(mapped, count, timestamp, right=True) - 1
+            if index < 0:
+                return None
+            return self.record.unpack_from(mapped, index * self.record.size)
+        finally:
+            mapped.close()
+
+    def as_of_many(self, timestamps):
+        """
+        Записи на каждый из моментов timestamps (в исходном порядке).
+
+        Моменты сортируются и обходятся за один проход: поиск каждого
+        следующего начинается с позиции предыдущего, а файл открывается
+        один раз.
+        """
+        result = [None] * len(timestamps)
+        mapped, count = self._open()
+        if mapped is None:
+            return result
+        try:
+            position = 0
+            for i in sorted(range(len(timestamps)), key=timestamps.__getitem__):
+                position = self._bisect(mapped, count, timestamps[i], right=True, lo=position)  # noqa: E501
+                if position:
+                    result[i] = self.record.unpack_from(mapped, (position - 1) * self.record.size)  # noqa: E501
+            return result
+        finally:
+            mapped.close()
+
+
+def get_series(pair_key):
+    """Возвращает временной ряд для пары вида BTC_USD"""
+    return RateSeries(Path(config.TIMESERIES_DIR) / f"{pair_key}.bin")
+
+
+def compact_series(series_list, tiers, now_ms, dry_run=False):
+    """Сжимает ряды по уровням хранения; отчёт {files, bytes_before, bytes_after}"""
+    report = {"files": 0, "bytes_before": 0, "bytes_after": 0}
+    for series in series_list:
+        bytes_before, bytes_after = series.compact(tiers, now_ms, dry_run=dry_run)
+        report["files"] += 1
+        report["bytes_before"] += bytes_before
+        report["bytes_after"] += bytes_after
+    return report
+
+
+def compact_timeseries(tiers, now_ms, dry_run=False):
+    """Применяет уровни хранения ко всем временным рядам TIMESERIES_DIR"""
+    series_list = (RateSeries(path) for path in sorted(Path(config.TIMESERIES_DIR).glob("*.bin")))  # noqa: E501
+    return compact_series(series_list, tiers, now_ms, dry_run=dry_run)
+
+
+def append_to_timeseries(pairs_data):
+    """Дописывает курсы из rates.json-формата ({пара: {rate, updated_at, source}})"""
+    for pair_key, pair_data in pairs_data.items():
+        get_series(pair_key).append([(
+            to_epoch_ms(pair_data["updated_at"]),
+            float(pair_data["rate"]),
+            source_id(pair_data.get("source")),
+        )])
+
+
+def query_range(pair_key, start=None, end=None):
+    """Итерирует записи пары за интервал (ISO-время или длительность назад)"""
+    # Границы разбираются сразу, чтобы ошибка не откладывалась до чтения
+    start_ms = None if start is None else parse_moment(start)
+    end_ms = None if end is None else parse_moment(end)
+
+    def iterate():
+        for timestamp, rate, source_code in get_series(pair_key).range(start_ms, end_ms):  # noqa: E501
+            yield {
+                "timestamp": from_epoch_ms(timestamp),
+                "rate": rate,
+                "source": source_name(source_code),
+            }
+
+    return iterate()
+
+
+def query_as_of(pair_key, at):
+    """Возвращает курс пары на момент at (последний известный до него) или None"""
+    record = get_series(pair_key).as_of(to_epoch_ms(at))
+    if record is None:
+        return None
+    timestamp, rate, source_code = record
+    return {
+        "timestamp": from_epoch_ms(timestamp),
+        "rate": rate,
+        "source": source_name(source_code),
+    }
+
+
+def _leg_rates(pair_key, timestamps, inverse=False):
+    """Курсы пары на моменты timestamps: [(timestamp, rate, источник) или None]"""
+    legs = []
+    for record in get_series(pair_key).as_of_many(timestamps):
+        if record is None or not record[1]:
+            legs.append(None)
+            continue
+        timestamp, rate, source_code = record
+        legs.append((timestamp, 1.0 / rate if inverse else rate, source_name(source_code)))  # noqa: E501
+    return legs
+
+
+def rates_as_of(from_currency, to_currency, moments):
+    """
+    Курсы from_currency→to_currency на каждый из моментов moments.
+
+    Берётся ряд пары, обратной пары или — для кросс-курса — ряды обеих
+    валют к базовой (ParserConfig.BASE_CURRENCY); по каждому ряду моменты
+    обходятся одним проходом (RateSeries.as_of_many). Моменты — ISO-время,
+    длительность назад (7d) или мс от эпохи. Возвращает список словарей
+    {at, rate, timestamp, sources, via} или None, если курса на момент нет;
+    timestamp — время более старой из использованных записей.
+    """
+    timestamps = [parse_moment(moment) for moment in moments]
+    if from_currency == to_currency:
+        return [
+            {"at": from_epoch_ms(ts), "rate": 1.0, "timestamp": from_epoch_ms(ts), "sources": [], "via": "same"}  # noqa: E501
+            for ts in timestamps
+        ]
+
+    base = config.BASE_CURRENCY
+    direct = f"{from_currency}_{to_currency}"
+    inverse = f"{to_currency}_{from_currency}"
+    if len(get_series(direct)):
+        via, legs = "direct", [_leg_rates(direct, timestamps)]
+    elif len(get_series(inverse)):
+        via, legs = "inverse", [_leg_rates(inverse, timestamps, inverse=True)]
+    else:
+        via, legs = base, [
+            _leg_rates(f"{from_currency}_{base}", timestamps),
+            _leg_rates(f"{to_currency}_{base}", timestamps, inverse=True),
+        ]
+
+    result = []
+    for i, timestamp in enumerate(timestamps):
+        points = [leg[i] for leg in legs]
+        if None in points:
+            result.append(None)
+            continue
+        rate = 1.0
+        for point in points:
+            rate *= point[1]
+        result.append({
+            "at": from_epoch_ms(timestamp),
+            "rate": rate,
+            "timestamp": from_epoch_ms(min(point[0] for point in points)),
+            "sources": sorted({point[2] for point in points}),
+            "via": via,
+        })
+    return result
+
+
+def rebuild_from_history(records):
+    """
+    Строит временные ряды из записей истории (например, iter_history()).
+
+    Ряды пар, встречающихся в истории, заменяются целиком, поэтому
+    повторная сборка не дублирует записи. Возвращает число пар.
+    """
+    # {пара: {timestamp: (rate, source_id)}}: дубли в истории схлопываются
+    batches = {}
+    for record in records:
+        pair_key = f"{record['from_currency']}_{record['to_currency']}"
+        batches.setdefault(pair_key, {})[to_epoch_ms(record["timestamp"])] = (
+            float(record["rate"]),
+            source_id(record.get("source")),
+        )
+
+    for pair_key, batch in batches.items():
+        get_series(pair_key).replace(
+            (timestamp, *batch[timestamp]) for timestamp in sorted(batch)
+        )
+    return len(batches)
@@ -1,74 +1,268 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 
-from valutatrade_hub.core.exceptions import ApiRequestError
+from valutatrade_hub.core.exceptions import (
+    ApiRequestError,
+    RateLimitExceeded,
+    TransientApiError,
+)
 from valutatrade_hub.core.logging_config import get_logger
-from valutatrade_hub.parser_service.storage import save_to_history, update_rates_cache
+from valutatrade_hub.parser_service.api_clients import create_client
+from valutatrade_hub.parser_service.candles import update_candles
+from valutatrade_hub.parser_service.config import config
+from valutatrade_hub.parser_service.hedging import QuoteCollector, pair_sources
+from valutatrade_hub.parser_service.resilience import CircuitBreaker, RetryPolicy
+from valutatrade_hub.parser_service.storage import (
+    append_history,
+    build_history_record,
+    get_rates_snapshot,
+    merge_rates_cache,
+)
+from valutatrade_hub.parser_service.timeseries import append_to_timeseries
 
 logger = get_logger("parser_service")
 
 
+def source_name(client):
+    """Имя источника клиента (SOURCE_NAME или имя класса)"""
+    return getattr(client, "SOURCE_NAME", None) or client.__class__.__name__
+
+
+def source_ttl(source, default=None):
+    """TTL курсов источника в секундах из ParserConfig.SOURCE_TTLS"""
+    return config.SOURCE_TTLS.get(source, default)
+
+
 class RatesUpdater:
     """Класс для координации процесса обновления курсов валют"""
     
-    def __init__(self, api_clients):
+    def __init__(self, api_clients, retry_policy=None):
         """Инициализация RatesUpdater"""
         self.api_clients = api_clients
+        self.retry_policy = retry_policy or RetryPolicy()
+        self._breakers = {}
+    
+    def time_to_refresh(self, client, refresh_ahead=1.0):
+        """
+        Секунды до момента, когда данные клиента пора обновлять.
+
+        Значение <= 0 — данные устарели (или ещё не загружались), None —
+        для источника не задан TTL.
+        """
+        source = source_name(client)
+        ttl = source_ttl(source)
+        if ttl is None:
+            return None
+        age = get_rates_snapshot().source_age(source)
+        if age is None:
+            return 0.0
+        return ttl * refresh_ahead - age
+    
+    def _breaker(self, client):
+        """Возвращает автомат защиты для клиента"""
+        client_name = client.__class__.__name__
+        if client_name not in self._breakers:
+            self._breakers[client_name] = CircuitBreaker(client_name)
+        return self._breakers[client_name]
+    
+    def _fetch(self, client, deadline):
+        """Запрашивает курсы с повторами; возвращает (rates, error, elapsed, attempts)"""  # noqa: E501
+        started = time.perf_counter()
+        breaker = self._breaker(client)
+        
+        if not breaker.allow():
+            error = ApiRequestError(
+                f"источник отключён автоматом защиты, проба через {breaker.retry_after():.0f} с"  # noqa: E501
+            )
+            return None, error, 0.0, 0
+        
+        attempts = 0
+        # Запросы клиента не переживают дедлайн: иначе поток пула держал бы
+        # процесс после завершения обновления
+        client.deadline = deadline
+        
+        def attempt():
+            nonlocal attempts
+            attempts += 1
+            return client.fetch_rates()
+        
+        try:
+            rates = self.retry_policy.call(attempt, deadline=deadline)
+        except TransientApiError as e:
+            breaker.record_failure()
+            return None, e, time.perf_counter() - started, attempts
+        except Exception as e:
+            # Постоянная ошибка (нет ключа, неверный ответ) не говорит о
+            # здоровье провайдера и автомат защиты не трогает
+            return None, e, time.perf_counter() - started, attempts
+        finally:
+            client.deadline = None
+        
+        breaker.record_success()
+        return rates, None, time.perf_counter() - started, attempts
+    
+    @staticmethod
+    def _pop_client_stats(client, results):
+        """Переносит метрики кэша и лимита запросов клиента в результаты"""
+        client_name = client.__class__.__name__
+        pop_cache_stats = getattr(client, "pop_cache_stats", None)
+        if pop_cache_stats is not None:
+            results["cache"][client_name] = pop_cache_stats()
+        pop_rate_limit_stats = getattr(client, "pop_rate_limit_stats", None)
+        if pop_rate_limit_stats is not None:
+            results["rate_limit"][client_name] = pop_rate_limit_stats()
     
-    def run_update(self):
-        """Выполняет обновление курсов валют от всех клиентов"""
+    @staticmethod
+    def _record_failure(results, client_name, source, error):
+        """Добавляет ошибку клиента в результаты и журнал"""
+        if isinstance(error, ApiRequestError):
+            results["failed"].append({
+                "client": client_name,
+                "source": source,
+                "error": str(error)
+            })
+            logger.error(f"{client_name}: ошибка - {error}")
+        else:
+            results["failed"].append({
+                "client": client_name,
+                "source": source,
+                "error": f"Неожиданная ошибка: {error}"
+            })
+            logger.error(f"{client_name}: неожиданная ошибка - {error}")
+    
+    def run_update(self, stale_only=False, refresh_ahead=1.0):
+        """
+        Выполняет обновление курсов валют.
+
+        При stale_only=True опрашиваются только источники, данные которых
+        старше доли refresh_ahead их TTL; остальные попадают в
+        results["skipped"].
+        """
         logger.info("Запуск обновления курсов валют")
         
         timestamp = datetime.utcnow().isoformat() + "Z"
         results = {
             "success": [],
             "failed": [],
-            "total_pairs": 0
+            "skipped": [],
+            "hedged": [],
+            "total_pairs": 0,
+            "timings": {},
+            "attempts": {},
+            "cache": {},
+            "rate_limit": {}
         }
         
-        rates_with_source = {}
+        clients = list(self.api_clients)
+        if stale_only:
+            clients = []
+            for client in self.api_clients:
+                remaining = self.time_to_refresh(client, refresh_ahead)
+                if remaining is None or remaining <= 0:
+                    clients.append(client)
+                else:
+                    source = source_name(client)
+                    age = get_rates_snapshot().source_age(source)
+                    results["skipped"].append({
+                        "client": client.__class__.__name__,
+                        "source": source,
+                        "reason": "fresh",
+                        "age": round(age, 1),
+                    })
+                    logger.info(f"{source}: данные свежие ({age:.0f} с), обновление пропущено")  # noqa: E501
         
-        for client in self.api_clients:
-            client_name = client.__class__.__name__
-            logger.info(f"Запрос курсов от {client_name}")
-            
-            source = "Unknown"
-            if "CoinGecko" in client_name:
-                source = "CoinGecko"
-            elif "ExchangeRate" in client_name:
-                source = "ExchangeRate-API"
-            
-            try:
-                rates = client.fetch_rates()
+        if not clients:
+            return {
+                "pairs": {},
+                "last_refresh": timestamp,
+                "results": results
+            }
+        
+        executor = ThreadPoolExecutor(
+            max_workers=max(1, len(clients)),
+            thread_name_prefix="rates-fetch",
+        )
+        deadline = time.monotonic() + config.UPDATE_DEADLINE
+        collector = QuoteCollector([source_name(client) for client in clients])
+        futures = {}
+        for index, client in enumerate(clients):
+            logger.info(f"Запрос курсов от {client.__class__.__name__}")
+            futures[executor.submit(self._fetch, client, deadline)] = index
+        
+        pending = set(futures)
+        try:
+            while pending:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                wake_at = collector.budget_deadline if now < collector.budget_deadline else deadline  # noqa: E501
+                done, pending = wait(pending, timeout=min(wake_at, deadline) - now, return_when=FIRST_COMPLETED)  # noqa: E501
                 
-                if rates:
-                    for pair_key, rate in rates.items():
-                        rates_with_source[pair_key] = {
-                            "rate": rate,
-                            "source": source
-                        }
+                for future in done:
+                    index = futures[future]
+                    client = clients[index]
+                    client_name = client.__class__.__name__
+                    source = source_name(client)
+                    rates, error, elapsed, attempts = future.result()
+                    results["timings"][client_name] = round(elapsed, 3)
+                    results["attempts"][client_name] = attempts
+                    self._pop_client_stats(client, results)
                     
-                    results["success"].append({
-                        "client": client_name,
-                        "pairs_count": len(rates)
-                    })
-                    logger.info(f"{client_name}: успешно получено {len(rates)} курсов")
-                else:
-                    logger.warning(f"{client_name}: не получено ни одного курса")
+                    if isinstance(error, RateLimitExceeded):
+                        # Свой лимит запросов — не сбой провайдера: источник
+                        # пропускается до следующего обновления
+                        collector.fail(source)
+                        results["skipped"].append({
+                            "client": client_name,
+                            "source": source,
+                            "reason": "rate_limit",
+                            "retry_after": round(error.retry_after, 1),
+                        })
+                        logger.warning(f"{client_name}: {error.reason}, обновление пропущено")  # noqa: E501
+                        continue
+                    if error is not None:
+                        collector.fail(source)
+                        self._record_failure(results, client_name, source, error)
+                        continue
                     
-            except ApiRequestError as e:
-                results["failed"].append({
-                    "client": client_name,
-                    "error": str(e)
-                })
-                logger.error(f"{client_name}: ошибка - {e}")
-            except Exception as e:
-                results["failed"].append({
-                    "client": client_name,
-                    "error": f"Неожиданная ошибка: {e}"
-                })
-                logger.error(f"{client_name}: неожиданная ошибка - {e}")
-        
-        if not rates_with_source:
+                    collector.add(source, rates or {})
+                    if rates:
+                        results["success"].append({
+                            "client": client_name,
+                            "source": source,
+                            "pairs_count": len(rates)
+                        })
+                        logger.info(f"{client_name}: успешно получено {len(rates)} курсов за {elapsed:.2f} с")  # noqa: E501
+                    else:
+                        logger.warning(f"{client_name}: не получено ни одного курса")
+                
+                # Запросы, все пары которых уже закрыты другими источниками,
+                # больше не ждём
+                now = time.monotonic()
+                for future in list(pending):
+                    client = clients[futures[future]]
+                    if not collector.is_needed(source_name(client), now):
+                        pending.discard(future)
+                        results["hedged"].append(client.__class__.__name__)
+                        logger.info(f"{source_name(client)}: ответ не нужен, курсы получены от других источников")  # noqa: E501
+            
+            for future in pending:
+                client = clients[futures[future]]
+                client_name = client.__class__.__name__
+                results["timings"][client_name] = config.UPDATE_DEADLINE
+                self._record_failure(
+                    results,
+                    client_name,
+                    source_name(client),
+                    ApiRequestError(f"превышен общий дедлайн обновления ({config.UPDATE_DEADLINE} с)"),  # noqa: E501
+                )
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        selected = collector.select()
+        if not selected:
             logger.warning("Не получено ни одного курса от всех клиентов")
             return {
                 "pairs": {},
@@ -76,16 +270,15 @@ class RatesUpdater:
                 "results": results
             }
         
-        logger.info(f"Всего получено {len(rates_with_source)} уникальных пар валют")
+        logger.info(f"Всего получено {len(selected)} уникальных пар валют")
         
         pairs_data = {}
-        for pair_key, rate_info in rates_with_source.items():
+        history_records = []
+        for pair_key, (rate, source, answered) in selected.items():
             parts = pair_key.split("_")
             if len(parts) >= 2:
                 from_currency = parts[0]
                 to_currency = "_".join(parts[1:])
-                rate = rate_info["rate"]
-                source = rate_info["source"]
                 
                 pairs_data[pair_key] = {
                     "rate": rate,
@@ -99,21 +292,31 @@ class RatesUpdater:
                     "rate": rate,
                     "timestamp": timestamp,
                     "source": source,
-                    "meta": {}
+                    "meta": {"strategy": collector.strategy, "sources": answered} if len(answered) > 1 else {}  # noqa: E501
                 }
-                
-                try:
-                    save_to_history(rate_data)
-                except ValueError as e:
-                    logger.warning(f"Не удалось сохранить в историю {pair_key}: {e}")
+                history_records.append(build_history_record(rate_data))
         
-        rates_data = {
-            "pairs": pairs_data,
-            "last_refresh": timestamp
-        }
+        try:
+            append_history(history_records)
+        except ValueError as e:
+            logger.warning(f"Не удалось сохранить в историю {len(history_records)} записей: {e}")  # noqa: E501
         
         try:
-            update_rates_cache(rates_data)
+            append_to_timeseries(pairs_data)
+        except ValueError as e:
+            logger.warning(f"Не удалось дописать временные ряды: {e}")
+        
+        try:
+            update_candles(pairs_data)
+        except ValueError as e:
+            logger.warning(f"Не удалось обновить свечи: {e}")
+        
+        try:
+            merge_rates_cache(
+                pairs_data,
+                timestamp,
+                refreshed_sources=collector.responded,
+            )
             results["total_pairs"] = len(pairs_data)
             logger.info(f"Кэш курсов обновлен: {len(pairs_data)} пар")
         except ValueError as e:
@@ -127,3 +330,72 @@ class RatesUpdater:
             "last_refresh": timestamp,
             "results": results
         }
+
+
+def source_for_currency(currency_code):
+    """Приоритетный источник курса валюты к базовой или None"""
+    if currency_code == config.BASE_CURRENCY:
+        return None
+    sources = pair_sources(f"{currency_code}_{config.BASE_CURRENCY}")
+    return sources[0] if sources else None
+
+
+_refreshing = set()
+_refresh_threads = []
+_refreshing_lock = threading.Lock()
+
+
+def _refresh_worker(source_names):
+    """Обновляет источники и снимает отметку «обновляется»"""
+    try:
+        RatesUpdater([create_client(name) for name in source_names]).run_update()
+    except Exception as e:
+        logger.error(f"Фоновое обновление {', '.join(source_names)} не удалось: {e}")
+    finally:
+        with _refreshing_lock:
+            _refreshing.difference_update(source_names)
+
+
+def refresh_sources_async(source_names):
+    """
+    Запускает обновление источников в фоновом потоке (stale-while-revalidate).
+
+    Источник, который уже обновляется в этом процессе, повторно не
+    запрашивается. Возвращает список источников, обновление которых идёт.
+    """
+    source_names = [name for name in dict.fromkeys(source_names) if name]
+    with _refreshing_lock:
+        started = [name for name in source_names if name not in _refreshing]
+        _refreshing.update(started)
+    
+    if started:
+        logger.info(f"Фоновое обновление курсов: {', '.join(started)}")
+        thread = threading.Thread(
+            target=_refresh_worker,
+            args=(started,),
+            name="rates-revalidate",
+            daemon=True,
+        )
+        with _refreshing_lock:
+            _refresh_threads[:] = [t for t in _refresh_threads if t.is_alive()]
+            _refresh_threads.append(thread)
+        thread.start()
+    return source_names
+
+
+def wait_for_refreshes(timeout):
+    """
+    Ждёт фоновые обновления не дольше timeout секунд.
+
+    Потоки обновления — демоны и завершаются вместе с процессом, поэтому
+    короткоживущий процесс (однократная команда CLI) дожидается их перед
+    выходом. Возвращает True, если все обновления завершились.
+    """
+    deadline = time.monotonic() + timeout
+    with _refreshing_lock:
+        threads = list(_refresh_threads)
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+    with _refreshing_lock:
+        _refresh_threads[:] = [t for t in _refresh_threads if t.is_alive()]
+        return not _refresh_threads